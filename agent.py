@@ -1,15 +1,16 @@
+import asyncio
+import copy
 import os
 import signal
 import traceback
 from datetime import datetime
 from multiprocessing import Pipe, Process, set_start_method
 from multiprocessing.connection import Connection
-from time import sleep
+from threading import Thread
 from typing import (
     Annotated,
     Any,
     Dict,
-    Generator,
     List,
     Optional,
     Tuple,
@@ -24,6 +25,7 @@ from pocketflow import Flow, Node
 from pydantic import BaseModel, ValidationError, conint
 
 import db
+from agent_pool import AgentWorkerPool
 from communication import (
     AgentToParentMessage,
     ATPM_Debug,
@@ -33,17 +35,33 @@ from communication import (
     ATPM_Ping,
     ATPM_System,
     ATPM_ToUser,
+    ATPM_ToUserDelta,
+    CommandMailbox,
 )
 from config import (
+    AGENT_WORKER_MAX_TASKS,
+    AGENT_WORKER_POOL_SIZE,
     CTX_WINDOW,
     FLUSH_TGT_TOK_FRAC,
     FLUSH_TOK_FRAC,
+    LLM_COMPLETION_RESERVE,
+    LLM_STREAMING,
     OVERTHINK_WARNING_HEARTBEAT_COUNT,
     PERSONA_MAX_WORDS,
     WARNING_TOK_FRAC,
 )
-from function_sets import FunctionSets
-from llm import call_llm, extract_yaml, llm_tokenise
+from function_sets import FunctionSets, preload_function_sets, reload_callbacks
+from llm import (
+    LLMResponse,
+    call_llm_detailed,
+    call_llm_stream,
+    extract_yaml,
+    get_tokeniser,
+    llm_router,
+    llm_tokenise,
+)
+from llm_ledger import flush_llm_calls, set_agent_id
+from llm_stats import record_parse_result
 from memory import (
     ArchivalStorage,
     AssistantMessageContent,
@@ -53,10 +71,14 @@ from memory import (
     Memory,
     Message,
     RecallStorage,
+    SummaryStore,
     TextContent,
     WorkingContext,
+    wait_for_summaries,
 )
 from persona_gen import generate_persona
+from repair import repair_call_agent_output
+from streaming import SendMessageStream
 
 set_start_method("fork", force=True)
 
@@ -74,26 +96,184 @@ class CallAgentResult(BaseModel):
     function_call: FunctionCallDict
 
 
+call_agent_response_formats: Dict[Tuple[str, ...], Dict[str, Any]] = {}
+reload_callbacks.append(call_agent_response_formats.clear)
+
+
+def call_agent_response_format(function_nodes: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    JSON schema response_format for CallAgentResult, with function_call constrained to the available functions and their argument schemas.
+    Cached per function set combination.
+    """
+    key = tuple(sorted(function_nodes))
+    if key in call_agent_response_formats:
+        return call_agent_response_formats[key]
+
+    schema = CallAgentResult.model_json_schema()
+    defs = schema.pop("$defs", {})
+    defs.pop("FunctionCallDict", None)  # *Replaced by the per-function schemas below
+
+    function_call_schemas = []
+    for name in key:
+        arguments_schema = function_nodes[name].validator.model_json_schema()
+        defs.update(arguments_schema.pop("$defs", {}))
+
+        function_call_schemas.append(
+            {
+                "type": "object",
+                "properties": {
+                    "name": {"const": name},
+                    "arguments": arguments_schema,
+                    "do_heartbeat": {"type": "boolean"},
+                },
+                "required": ["name", "arguments", "do_heartbeat"],
+            }
+        )
+
+    schema["properties"]["function_call"] = {"anyOf": function_call_schemas}
+    if defs:
+        schema["$defs"] = defs
+
+    call_agent_response_formats[key] = {
+        "type": "json_schema",
+        "json_schema": {"name": "CallAgentResult", "schema": schema},
+    }
+
+    return call_agent_response_formats[key]
+
+
+def parse_call_agent_result(response: LLMResponse) -> CallAgentResult:
+    """
+    Structured output is JSON; anything else (or JSON that orjson rejects) goes through extract_yaml.
+    Malformed outputs go through the repair pass before failing (and triggering a full retry).
+    Parse results are recorded per backend.
+    """
+    try:
+        try:
+            result = (
+                orjson.loads(response.text)
+                if response.structured
+                else extract_yaml(response.text)
+            )
+        except orjson.JSONDecodeError:
+            result = extract_yaml(response.text)
+
+        # try:
+        #     result_validated = CallAgentResult.model_validate(result)
+        # except ValidationError as e:
+        #     try:
+        #         result_validated = CallAgentResult.model_validate(
+        #             result["content"]
+        #         )  # *Fallback: if the LLM decides to conform to the input schema instead of output schema
+        #    except Exception:
+        #         raise e
+
+        result_validated = CallAgentResult.model_validate(result)
+    except Exception as e:
+        # *Try to salvage the output before PocketFlow regenerates from the full context
+        repaired = repair_call_agent_output(
+            response.text, e, CallAgentResult.model_validate
+        )
+        if repaired is None:
+            record_parse_result(response, False)
+            raise
+
+        result_validated, repair = repaired
+        record_parse_result(response, False, repair)
+        print(f"Repaired malformed agent output ({repair})", flush=True)
+
+        return result_validated
+
+    record_parse_result(response, True)
+
+    return result_validated
+
+
 class CallAgent(Node):
-    def prep(self, shared: Dict[str, Any]) -> Tuple[Memory, Connection]:
+    def prep(
+        self, shared: Dict[str, Any]
+    ) -> Tuple[Memory, Connection, CommandMailbox, Optional[int]]:
         memory = shared["memory"]
         assert isinstance(memory, Memory)
 
         conn = shared["conn"]
         assert isinstance(conn, Connection)
 
+        mailbox = shared["mailbox"]
+        assert isinstance(mailbox, CommandMailbox)
+
         conn.send(
             AgentToParentMessage.model_validate(
                 {"message_type": "debug", "payload": "Calling agent"}
             ).model_dump_json()
         )
 
-        return memory, conn
+        prompt_tokens = self.preflight(memory, conn)
 
-    def exec(self, inputs: Tuple[Memory, Connection]) -> CallAgentResult:
-        memory, conn = inputs
+        return memory, conn, mailbox, prompt_tokens
 
-        resp = call_llm(memory.main_ctx)
+    def preflight(self, memory: Memory, conn: Connection) -> Optional[int]:
+        """
+        Counts prompt tokens (only if backends.yaml declares context windows) and flushes the FIFO Queue now if the prompt cannot fit any model, rather than letting every backend reject it.
+        """
+        if not llm_router.context_windows_declared:
+            return None
+
+        prompt_tokens = memory.in_ctx_no_tokens
+        max_context_window = llm_router.max_context_window()
+
+        if (
+            max_context_window is not None
+            and prompt_tokens + LLM_COMPLETION_RESERVE > max_context_window
+        ):
+            system_message = Message(
+                message_type="system",
+                timestamp=datetime.now(),
+                content=TextContent(
+                    message="Context exceeds the largest available model context window. Older messages have been evicted to free up context space and are being summarised in the background."
+                ),
+            )
+            memory.push_message(system_message)
+
+            conn.send(
+                AgentToParentMessage.model_validate(
+                    {
+                        "message_type": "message",
+                        "payload": system_message.to_intermediate_repr(),
+                    }
+                ).model_dump_json()
+            )
+
+            memory.flush_fifo_queue(
+                FLUSH_TGT_TOK_FRAC
+                * (max_context_window - LLM_COMPLETION_RESERVE)
+                / CTX_WINDOW
+            )
+            prompt_tokens = memory.in_ctx_no_tokens
+
+        return prompt_tokens
+
+    def exec(
+        self, inputs: Tuple[Memory, Connection, CommandMailbox, Optional[int]]
+    ) -> Optional[CallAgentResult]:
+        memory, conn, mailbox, prompt_tokens = inputs
+
+        if self.cur_retry > 0 and mailbox.halt_requested():
+            return None  # *Halted while the last output was being retried; no further LLM calls
+
+        response_format = call_agent_response_format(
+            memory.function_sets.get_function_nodes()
+        )
+
+        if LLM_STREAMING and memory.in_convo:
+            return self.exec_streaming(memory, conn, response_format, prompt_tokens)
+
+        response = call_llm_detailed(
+            memory.main_ctx,
+            call_site="call_agent",
+            response_format=response_format,
+            prompt_tokens=prompt_tokens,
+        )
 
         # conn.send(
         #     AgentToParentMessage.model_validate(
@@ -101,29 +281,69 @@ class CallAgent(Node):
         #     ).model_dump_json()
         # )
 
-        result = extract_yaml(resp)
+        return parse_call_agent_result(response)
 
-        # try:
-        #     result_validated = CallAgentResult.model_validate(result)
-        # except ValidationError as e:
-        #     try:
-        #         result_validated = CallAgentResult.model_validate(
-        #             result["content"]
-        #         )  # *Fallback: if the LLM decides to conform to the input schema instead of output schema
-        #    except Exception:
-        #         raise e
+    def exec_streaming(
+        self,
+        memory: Memory,
+        conn: Connection,
+        response_format: Dict[str, Any],
+        prompt_tokens: Optional[int],
+    ) -> CallAgentResult:
+        """
+        Streams the completion and forwards send_message text to the user as it is generated.
+        The streamed text is discarded by the client if the full output turns out to be invalid (the node is then retried) or is not that send_message call.
+        """
+        send_message_stream = SendMessageStream()
+        response = LLMResponse("")
 
-        result_validated = CallAgentResult.model_validate(result)
+        try:
+            for delta in call_llm_stream(
+                memory.main_ctx,
+                response_format=response_format,
+                response=response,
+                prompt_tokens=prompt_tokens,
+                call_site="call_agent",
+            ):
+                if message_delta := send_message_stream.feed(delta):
+                    conn.send(
+                        AgentToParentMessage.model_validate(
+                            {"message_type": "to_user_delta", "payload": message_delta}
+                        ).model_dump_json()
+                    )
 
-        return result_validated
+            result = parse_call_agent_result(response)
+        except Exception:
+            if send_message_stream.sent:
+                self.discard_streamed(conn)
+            raise
+
+        # *Streamed text the agent did not end up sending (e.g. a different function call parsed from the final output)
+        if send_message_stream.sent and not send_message_stream.delivered(
+            result.function_call
+        ):
+            self.discard_streamed(conn)
+
+        return result
+
+    def discard_streamed(self, conn: Connection) -> None:
+        conn.send(
+            AgentToParentMessage.model_validate(
+                {"message_type": "to_user_delta", "payload": "", "discard": True}
+            ).model_dump_json()
+        )
 
     def post(
         self,
         shared: Dict[str, Any],
-        prep_res: Tuple[Memory, Connection],
-        exec_res: CallAgentResult,
+        prep_res: Tuple[Memory, Connection, CommandMailbox, Optional[int]],
+        exec_res: Optional[CallAgentResult],
     ) -> str:
-        memory, conn = prep_res
+        memory, conn, _, _ = prep_res
+
+        if exec_res is None:
+            shared["do_heartbeat"] = True  # *ExitOrContinue overrides it with the pending halt
+            return "halted"
 
         agent_message_dict = {
             "message_type": "assistant",
@@ -189,7 +409,7 @@ class InvalidFunction(Node):
 class ExitOrContinue(Node):
     def prep(
         self, shared: Dict[str, Any]
-    ) -> Tuple[Memory, bool, Connection, int, bool]:
+    ) -> Tuple[Memory, bool, Connection, CommandMailbox, int, bool]:
         memory = shared["memory"]
         assert isinstance(memory, Memory)
 
@@ -199,6 +419,9 @@ class ExitOrContinue(Node):
         conn = shared["conn"]
         assert isinstance(conn, Connection)
 
+        mailbox = shared["mailbox"]
+        assert isinstance(mailbox, CommandMailbox)
+
         loops_since_overthink_warning = shared["loops_since_overthink_warning"] + 1
         assert isinstance(loops_since_overthink_warning, int)
         shared["loops_since_overthink_warning"] = loops_since_overthink_warning
@@ -210,17 +433,19 @@ class ExitOrContinue(Node):
             memory,
             do_heartbeat,
             conn,
+            mailbox,
             loops_since_overthink_warning,
             ctx_window_warning_given_flag,
         )
 
     def exec(
-        self, inputs: Tuple[Memory, bool, Connection, int, bool]
+        self, inputs: Tuple[Memory, bool, Connection, CommandMailbox, int, bool]
     ) -> Tuple[bool, bool, int]:
         (
             memory,
             do_heartbeat,
             conn,
+            mailbox,
             loops_since_overthink_warning,
             ctx_window_warning_given_flag,
         ) = inputs
@@ -243,7 +468,7 @@ class ExitOrContinue(Node):
                 message_type="system",
                 timestamp=datetime.now(),
                 content=TextContent(
-                    message=f"FIFO Queue above {FLUSH_TOK_FRAC:.0%} of context window. Queue has been flushed to free up context space."
+                    message=f"FIFO Queue above {FLUSH_TOK_FRAC:.0%} of context window. Older messages have been evicted to free up context space and are being summarised in the background."
                 ),
             )
             memory.push_message(system_message)
@@ -288,57 +513,58 @@ class ExitOrContinue(Node):
 
             do_heartbeat = True
 
-        if conn.poll(0.25):
-            match (conn.recv(), do_heartbeat):
-                case ("halt", True):
-                    system_message = Message(
-                        message_type="system",
-                        timestamp=datetime.now(),
-                        content=TextContent(
-                            message=f"The user has overridden your heartbeat request. Your AI has been halted."
-                        ),
-                    )
-                    memory.push_message(system_message)
-
-                    conn.send(
-                        AgentToParentMessage.model_validate(
-                            {
-                                "message_type": "message",
-                                "payload": system_message.to_intermediate_repr(),
-                            }
-                        ).model_dump_json()
-                    )
-
-                    do_heartbeat = False
-                case ("halt_soon", True):
-                    system_message = Message(
-                        message_type="system",
-                        timestamp=datetime.now(),
-                        content=TextContent(
-                            message=f"The user has requested that you finish up whatever you are doing soon. You should double-check whether you have gathered sufficient information to accurately answer the user's query or finish your background tasks. If you have, please send a final message to the user or finish up your tasks and then set your 'do_heartbeat' field to false. If you have not, please carry on until you have, but hurry up as the user may forcefully halt your AI."
-                        ),
-                    )
-                    memory.push_message(system_message)
-
-                    conn.send(
-                        AgentToParentMessage.model_validate(
-                            {
-                                "message_type": "message",
-                                "payload": system_message.to_intermediate_repr(),
-                            }
-                        ).model_dump_json()
-                    )
-
-                    loops_since_overthink_warning = 0
-                case _:
-                    conn.send(
-                        AgentToParentMessage.model_validate(
-                            {
-                                "message_type": "error",
-                                "payload": "Invalid command",
-                            }
-                        ).model_dump_json()
-                    )
+        if commands := mailbox.take():  # *Only what has already arrived; never waits
+            for command in commands:
+                match (command, do_heartbeat):
+                    case ("halt", True):
+                        system_message = Message(
+                            message_type="system",
+                            timestamp=datetime.now(),
+                            content=TextContent(
+                                message=f"The user has overridden your heartbeat request. Your AI has been halted."
+                            ),
+                        )
+                        memory.push_message(system_message)
+
+                        conn.send(
+                            AgentToParentMessage.model_validate(
+                                {
+                                    "message_type": "message",
+                                    "payload": system_message.to_intermediate_repr(),
+                                }
+                            ).model_dump_json()
+                        )
+
+                        do_heartbeat = False
+                    case ("halt_soon", True):
+                        system_message = Message(
+                            message_type="system",
+                            timestamp=datetime.now(),
+                            content=TextContent(
+                                message=f"The user has requested that you finish up whatever you are doing soon. You should double-check whether you have gathered sufficient information to accurately answer the user's query or finish your background tasks. If you have, please send a final message to the user or finish up your tasks and then set your 'do_heartbeat' field to false. If you have not, please carry on until you have, but hurry up as the user may forcefully halt your AI."
+                            ),
+                        )
+                        memory.push_message(system_message)
+
+                        conn.send(
+                            AgentToParentMessage.model_validate(
+                                {
+                                    "message_type": "message",
+                                    "payload": system_message.to_intermediate_repr(),
+                                }
+                            ).model_dump_json()
+                        )
+
+                        loops_since_overthink_warning = 0
+                    case _:
+                        conn.send(
+                            AgentToParentMessage.model_validate(
+                                {
+                                    "message_type": "error",
+                                    "payload": "Invalid command",
+                                }
+                            ).model_dump_json()
+                        )
 
         elif (
             loops_since_overthink_warning >= OVERTHINK_WARNING_HEARTBEAT_COUNT
@@ -373,7 +599,7 @@ class ExitOrContinue(Node):
     def post(
         self,
         shared: Dict[str, Any],
-        prep_res: Tuple[Memory, bool, Connection, int, bool],
+        prep_res: Tuple[Memory, bool, Connection, CommandMailbox, int, bool],
         exec_res: Tuple[bool, bool, int],
     ) -> Optional[str]:
         do_heartbeat, ctx_window_warning_given_flag, loops_since_overthink_warning = (
@@ -394,6 +620,7 @@ def get_memory_object(agent_id: str, in_convo: bool):
         chat_log=ChatLog(agent_id=agent_id),
         function_sets=FunctionSets(agent_id=agent_id),
         fifo_queue=FIFOQueue(agent_id=agent_id),
+        summary_store=SummaryStore(agent_id=agent_id),
         agent_id=agent_id,
         in_convo=in_convo,
     )
@@ -428,16 +655,32 @@ def get_memory_object(agent_id: str, in_convo: bool):
 #     return memory
 
 
-def get_agent_flow(memory: Memory):
+# *One flow per combination of optional function sets, reused across turns (Flow.run copies nodes as it goes)
+agent_flows: Dict[Tuple[str, ...], Flow] = {}
+reload_callbacks.append(agent_flows.clear)
+
+
+def get_agent_flow(memory: Memory) -> Flow:
+    key = memory.function_sets.optional_function_sets_key
+    if key not in agent_flows:
+        agent_flows[key] = build_agent_flow(memory.function_sets.get_function_nodes())
+
+    return agent_flows[key]
+
+
+def build_agent_flow(function_nodes: Dict[str, Any]) -> Flow:
     call_agent_node = CallAgent(max_retries=10)
     invalid_function_node = InvalidFunction()
     exit_or_continue_node = ExitOrContinue()
 
-    function_node_dict = memory.function_sets.get_function_nodes()
-    for function_name, function_node in function_node_dict.items():
+    for function_name, shared_function_node in function_nodes.items():
+        function_node = copy.deepcopy(
+            shared_function_node
+        )  # *Registry nodes are shared by all flows; wiring adds successors
         call_agent_node - function_name >> function_node
         function_node >> exit_or_continue_node
     call_agent_node - "invalid_function" >> invalid_function_node
+    call_agent_node - "halted" >> exit_or_continue_node
     invalid_function_node >> exit_or_continue_node
 
     exit_or_continue_node - "heartbeat" >> call_agent_node
@@ -492,7 +735,7 @@ def create_new_agent(
         ),
     )
 
-    db.create_chromadb_client().create_collection(str(agent_id))
+    db.create_archival_collection(str(agent_id))
 
     return str(agent_id)
 
@@ -500,7 +743,18 @@ def create_new_agent(
 def get_agents() -> List[Dict[Any, Union[UUID, datetime, List[str], str]]]:
     # return db.read("SELECT id, created_at FROM agents;")
     partial_agent_infos = db.read(
-        "SELECT id, created_at, user_exit_time, optional_function_sets, recursive_summary, recursive_summary_update_time FROM agents;"
+        """
+        SELECT id, created_at, user_exit_time, optional_function_sets,
+            COALESCE(
+                (SELECT string_agg(content, E'\n\n' ORDER BY start_time) FROM summaries WHERE summaries.agent_id = agents.id AND parent_id IS NULL),
+                'No content in recursive summary yet'
+            ),
+            COALESCE(
+                (SELECT MAX(created_at) FROM summaries WHERE summaries.agent_id = agents.id),
+                created_at
+            )
+        FROM agents;
+        """
     )
 
     agent_infos = []
@@ -535,11 +789,15 @@ def get_agents() -> List[Dict[Any, Union[UUID, datetime, List[str], str]]]:
 def delete_agent(agent_id: str) -> None:
     db.write("DELETE FROM agents WHERE id = %s;", (agent_id,))
     db.write("DELETE FROM working_context WHERE agent_id = %s;", (agent_id,))
+    db.write("DELETE FROM tasks WHERE agent_id = %s;", (agent_id,))
     db.write("DELETE FROM recall_storage WHERE agent_id = %s;", (agent_id,))
     db.write("DELETE FROM chat_log WHERE agent_id = %s;", (agent_id,))
     db.write("DELETE FROM fifo_queue WHERE agent_id = %s;", (agent_id,))
+    db.write("DELETE FROM archival_signatures WHERE agent_id = %s;", (agent_id,))
+    db.write("DELETE FROM summaries WHERE agent_id = %s;", (agent_id,))
+    db.write("DELETE FROM memory_versions WHERE agent_id = %s;", (agent_id,))
 
-    db.create_chromadb_client().delete_collection(agent_id)
+    db.delete_archival_collection(agent_id)
 
 
 def list_optional_function_sets() -> List[str]:
@@ -557,6 +815,7 @@ def list_optional_function_sets() -> List[str]:
 
 def call_agent_worker(agent_id: str, in_convo: bool, conn: Connection) -> None:
     signal.signal(signal.SIGINT, signal.SIG_IGN)
+    set_agent_id(agent_id)
     try:
         conn.send(
             AgentToParentMessage.model_validate(
@@ -564,6 +823,7 @@ def call_agent_worker(agent_id: str, in_convo: bool, conn: Connection) -> None:
             ).model_dump_json()
         )
         memory = get_memory_object(agent_id, in_convo)
+        memory.resume_pending_summary()
 
         conn.send(
             AgentToParentMessage.model_validate(
@@ -575,6 +835,7 @@ def call_agent_worker(agent_id: str, in_convo: bool, conn: Connection) -> None:
         shared = {
             "memory": memory,
             "conn": conn,
+            "mailbox": CommandMailbox(conn),
             "loops_since_overthink_warning": 0,
             "ctx_window_warning_given_flag": False,
         }
@@ -603,46 +864,136 @@ def call_agent_worker(agent_id: str, in_convo: bool, conn: Connection) -> None:
             pass
         conn.close()
 
+        flush_llm_calls()  # *Forked workers exit without running atexit handlers
 
-def call_agent(agent_id: str, in_convo: bool = True) -> Generator[
-    Union[
-        ATPM_Message,
-        ATPM_Debug,
-        ATPM_Error,
-        ATPM_ToUser,
-        ATPM_System,
-        ATPM_Halt,
-        ATPM_Ping,
-    ],
-    str,
-    None,
-]:
-    parent_conn, child_conn = Pipe()
-    p = Process(target=call_agent_worker, args=(agent_id, in_convo, child_conn))
-    p.start()
-
-    # print("Stream start")
 
-    try:
-        while True:
-            try:
-                if parent_conn.poll():
-                    msg = AgentToParentMessage.model_validate(
-                        orjson.loads(parent_conn.recv())
-                    ).root
-
-                    input_cmd = yield msg
-                    if input_cmd:
-                        parent_conn.send(input_cmd)
-
-                    if msg.message_type == "halt":
-                        return
-                else:
-                    sleep(0.01)
-            except EOFError:
-                break
-    finally:
-        child_conn.close()
-        parent_conn.close()
-        p.join()
-        # print("End of stream")
+def call_agent_worker_once(agent_id: str, in_convo: bool, conn: Connection) -> None:
+    """
+    One-off forked worker: runs the turn, then lets background summaries finish before the process exits.
+    Pooled workers run call_agent_worker directly, so "done" is reported as soon as the turn is handed back.
+    """
+    call_agent_worker(agent_id, in_convo, conn)
+
+    wait_for_summaries()
+    flush_llm_calls()
+
+
+def warm_agent_worker() -> None:
+    get_tokeniser()
+    preload_function_sets()
+
+
+agent_worker_pool = AgentWorkerPool(
+    call_agent_worker,
+    AGENT_WORKER_POOL_SIZE,
+    AGENT_WORKER_MAX_TASKS,
+    initializer=warm_agent_worker,
+)
+
+
+ATPM = Union[
+    ATPM_Message,
+    ATPM_Debug,
+    ATPM_Error,
+    ATPM_ToUser,
+    ATPM_ToUserDelta,
+    ATPM_System,
+    ATPM_Halt,
+    ATPM_Ping,
+]
+
+
+class AgentTurn:
+    """
+    A running agent turn as an async iterator of its messages, ending after the halt message.
+    Messages are read by an event loop reader as soon as the worker sends them; commands (e.g. "halt", "halt_soon") can be sent at any time.
+    Must be created inside a running event loop; use as an async context manager (or call close) to stop reading early.
+    """
+
+    def __init__(self, agent_id: str, in_convo: bool) -> None:
+        self.loop = asyncio.get_running_loop()
+        self.messages: asyncio.Queue[ATPM] = asyncio.Queue()
+        self.halted = False
+        self.closed = False
+
+        self.parent_conn, child_conn = Pipe()
+        self.process: Optional[Process] = None
+        if not agent_worker_pool.submit(agent_id, in_convo, child_conn):
+            # *Pool disabled or all pooled workers busy
+            self.process = Process(
+                target=call_agent_worker_once, args=(agent_id, in_convo, child_conn)
+            )
+            self.process.start()
+        child_conn.close()  # *The worker holds the only copy, so a crash shows up as EOF
+
+        self.loop.add_reader(self.parent_conn.fileno(), self.on_readable)
+
+    def on_readable(self) -> None:
+        try:
+            while self.parent_conn.poll():
+                msg = AgentToParentMessage.model_validate(
+                    orjson.loads(self.parent_conn.recv())
+                ).root
+                self.messages.put_nowait(msg)
+
+                if msg.message_type == "halt":
+                    self.loop.remove_reader(self.parent_conn.fileno())
+                    return
+        except (EOFError, OSError):
+            self.loop.remove_reader(self.parent_conn.fileno())
+            # *The worker closes its end after the halt message; EOF before that means it died
+            self.messages.put_nowait(
+                AgentToParentMessage.model_validate(
+                    {
+                        "message_type": "error",
+                        "payload": "Agent worker exited unexpectedly",
+                    }
+                ).root
+            )
+            self.messages.put_nowait(
+                AgentToParentMessage.model_validate({"message_type": "halt"}).root
+            )
+
+    def __aiter__(self) -> "AgentTurn":
+        return self
+
+    async def __anext__(self) -> ATPM:
+        if self.halted:
+            raise StopAsyncIteration
+
+        msg = await self.messages.get()
+        if msg.message_type == "halt":
+            self.halted = True
+            self.close()
+
+        return msg
+
+    def send(self, command: str) -> None:
+        if self.closed:
+            return
+        try:
+            self.parent_conn.send(command)
+        except OSError:
+            pass  # *Worker already gone; its EOF is reported through the reader
+
+    def close(self) -> None:
+        if self.closed:
+            return
+        self.closed = True
+
+        self.loop.remove_reader(self.parent_conn.fileno())
+        self.parent_conn.close()
+        if self.process:
+            Thread(
+                target=self.process.join, daemon=True
+            ).start()  # *Reap without waiting for background summaries
+
+    async def __aenter__(self) -> "AgentTurn":
+        return self
+
+    async def __aexit__(self, *_: Any) -> None:
+        self.close()
+
+
+def call_agent(agent_id: str, in_convo: bool = True) -> AgentTurn:
+    return AgentTurn(agent_id, in_convo)
@@ -0,0 +1,250 @@
+import signal
+from dataclasses import dataclass
+from multiprocessing import Pipe, Process
+from multiprocessing.connection import Connection, wait
+from multiprocessing.reduction import recv_handle, send_handle
+from threading import Event, Lock, Thread
+from typing import Any, Callable, Dict, List, Optional
+
+JobTarget = Callable[[str, bool, Connection], None]
+
+
+def pool_worker(
+    target: JobTarget,
+    initializer: Optional[Callable[[], None]],
+    job_conn: Connection,
+    max_tasks: int,
+) -> None:
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+    if initializer:
+        initializer()
+
+    no_tasks = 0
+    while max_tasks <= 0 or no_tasks < max_tasks:
+        try:
+            job = job_conn.recv()
+        except (EOFError, OSError):
+            return
+        if job is None:
+            return
+
+        agent_id, in_convo = job
+        conn = Connection(recv_handle(job_conn))
+
+        target(agent_id, in_convo, conn)  # *Reports its own errors over conn
+        no_tasks += 1
+
+        try:
+            job_conn.send("done")
+        except OSError:
+            return
+
+
+@dataclass
+class PoolWorker:
+    process: Process
+    job_conn: Connection
+    busy: bool = False
+    no_tasks: int = 0
+
+
+class AgentWorkerPool:
+    """
+    Long-lived forked worker processes that run agent turns, so imports, the tokeniser, clients and per-process caches stay warm between turns.
+    Each job gets a fresh Pipe end (passed over the worker's job pipe); a worker is retired after max_tasks jobs (0 = never) and replaced, as is any worker that crashes.
+    When the pool is disabled or every worker is busy, submit returns False and the caller forks a one-off worker instead.
+
+    Workers are forked rather than started from a fork server so that they inherit the router and limiter shared-memory Arrays.
+    Forks happen outside self.lock, but other threads of the parent (request handlers, schedulers, summary threads) keep running, so module-level state a worker uses must survive a fork taken at any point:
+    - threading locks, buffers and background threads are recreated in the child with os.register_at_fork (llm_ledger buffer and flusher, db Chroma HTTP client and embedded archival lock)
+    - multiprocessing Array locks are process-shared semaphores, released by whichever parent thread holds them
+    - Postgres connections are opened per call and never cross a fork
+    """
+
+    def __init__(
+        self,
+        target: JobTarget,
+        size: int,
+        max_tasks: int,
+        initializer: Optional[Callable[[], None]] = None,
+    ) -> None:
+        self.target = target
+        self.size = size
+        self.max_tasks = max_tasks
+        self.initializer = initializer
+
+        self.workers: List[PoolWorker] = []
+        self.lock = Lock()
+        self.stopping = Event()
+        self.monitor: Optional[Thread] = None
+
+        self.no_jobs = 0
+        self.no_overflows = 0
+        self.no_recycled = 0
+        self.no_crashed = 0
+
+    def spawn(self) -> PoolWorker:
+        job_conn, child_job_conn = Pipe()
+        process = Process(
+            target=pool_worker,
+            args=(self.target, self.initializer, child_job_conn, self.max_tasks),
+            daemon=True,
+        )
+        process.start()
+        child_job_conn.close()
+
+        return PoolWorker(process=process, job_conn=job_conn)
+
+    def start(self) -> None:
+        if self.size <= 0 or self.monitor is not None:
+            return
+
+        workers = [self.spawn() for _ in range(self.size)]
+
+        with self.lock:
+            self.workers = workers
+
+        self.monitor = Thread(target=self.supervise, daemon=True)
+        self.monitor.start()
+
+    def stop(self, timeout: float = 5) -> None:
+        self.stopping.set()
+
+        with self.lock:
+            workers, self.workers = self.workers, []
+
+        for worker in workers:
+            try:
+                worker.job_conn.send(None)
+            except OSError:
+                pass
+
+        for worker in workers:
+            worker.process.join(timeout)
+            if worker.process.is_alive():
+                worker.process.terminate()
+            worker.job_conn.close()
+
+    def retire(self, worker: PoolWorker, timeout: float = 5) -> None:
+        try:
+            worker.job_conn.send(None)
+        except OSError:
+            pass
+
+        worker.process.join(timeout)
+        if worker.process.is_alive():
+            worker.process.terminate()
+        worker.job_conn.close()
+
+    def submit(self, agent_id: str, in_convo: bool, conn: Connection) -> bool:
+        """
+        Hands a turn to an idle worker. The caller still owns (and should close) its copy of conn.
+        """
+        if self.size <= 0 or self.stopping.is_set():
+            return False
+
+        with self.lock:
+            for worker in self.workers:
+                if worker.busy or not worker.process.is_alive():
+                    continue
+
+                try:
+                    worker.job_conn.send((agent_id, in_convo))
+                    send_handle(worker.job_conn, conn.fileno(), worker.process.pid)
+                except OSError:
+                    continue  # *Exited in the meantime; the monitor replaces it
+
+                worker.busy = True
+                self.no_jobs += 1
+                return True
+
+            self.no_overflows += 1
+            return False
+
+    def supervise(self) -> None:
+        while not self.stopping.is_set():
+            with self.lock:
+                by_conn = {worker.job_conn: worker for worker in self.workers}
+                by_sentinel = {
+                    worker.process.sentinel: worker for worker in self.workers
+                }
+
+            for ready in wait([*by_conn, *by_sentinel], timeout=1):
+                if self.stopping.is_set():
+                    return
+
+                if ready in by_conn:
+                    worker = by_conn[ready]
+                    try:
+                        ready.recv()
+                    except (EOFError, OSError):
+                        continue  # *Exit is handled through the sentinel
+
+                    with self.lock:
+                        worker.busy = False
+                        worker.no_tasks += 1
+                        if 0 < self.max_tasks <= worker.no_tasks:
+                            worker.busy = True  # *Retiring; never hand it another job
+                else:
+                    self.replace(by_sentinel[ready])
+
+    def replace(self, worker: PoolWorker) -> None:
+        worker.process.join()
+
+        if worker.job_conn.poll():  # *A retiring worker's last "done" may not have been read yet
+            try:
+                worker.job_conn.recv()
+                worker.no_tasks += 1
+            except (EOFError, OSError):
+                pass
+
+        crashed = worker.process.exitcode != 0 or not (
+            0 < self.max_tasks <= worker.no_tasks
+        )
+
+        if crashed:
+            print(
+                f"Agent worker {worker.process.pid} exited with code {worker.process.exitcode}{' during a turn' if worker.busy else ''}; replacing it",
+                flush=True,
+            )
+
+        worker.job_conn.close()  # *Also drops a job handle the worker never received
+
+        with self.lock:
+            if self.stopping.is_set() or worker not in self.workers:
+                return
+
+            if crashed:
+                self.no_crashed += 1
+            else:
+                self.no_recycled += 1
+
+        replacement = self.spawn()  # *Never fork while holding self.lock
+
+        with self.lock:
+            if not self.stopping.is_set() and worker in self.workers:
+                self.workers[self.workers.index(worker)] = replacement
+                return
+
+        self.retire(replacement)  # *The pool was stopped while forking
+
+    def stats(self) -> Dict[str, Any]:
+        with self.lock:
+            return {
+                "size": self.size,
+                "max_tasks": self.max_tasks,
+                "busy": sum(1 for worker in self.workers if worker.busy),
+                "jobs": self.no_jobs,
+                "overflows": self.no_overflows,
+                "recycled": self.no_recycled,
+                "crashed": self.no_crashed,
+                "workers": [
+                    {
+                        "pid": worker.process.pid,
+                        "busy": worker.busy,
+                        "tasks": worker.no_tasks,
+                    }
+                    for worker in self.workers
+                ],
+            }
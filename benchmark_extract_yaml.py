@@ -0,0 +1,108 @@
+"""
+Benchmarks extract_yaml (parsing.py) against the previous implementation over a corpus of model outputs.
+
+Usage: uv run python benchmark_extract_yaml.py [--iterations N] [--from-cache N]
+(--from-cache also benchmarks up to N recorded responses from the llm_cache table; needs the database)
+"""
+
+import argparse
+import re
+from glob import glob
+from os import path
+from time import perf_counter
+from typing import Any, Callable, Dict, List, Tuple
+
+import yaml
+
+from parsing import SafeLoader, extract_yaml
+
+CORPUS_DIR = path.join(path.dirname(path.abspath(__file__)), "benchmark_corpus", "extract_yaml")
+
+
+def extract_yaml_baseline(resp: str) -> Dict[str, Any]:
+    # *extract_yaml before the fast path, kept for comparison
+    matches = list(re.finditer(r"```(?:ya?ml)?\s*([\s\S]*?)```", resp, re.IGNORECASE))
+    if matches:
+        yaml_str = matches[-1].group(1).strip()
+    else:
+        yaml_str = re.sub(r"^<think>.*?</think>", "", resp, flags=re.DOTALL).strip()
+
+    yaml_str_sanitised = re.sub(r"[\ud800-\udfff]", "", yaml_str)
+    data = yaml.safe_load(yaml_str_sanitised)
+
+    def deep_clean(obj):
+        if isinstance(obj, str):
+            return re.sub(r"[\ud800-\udfff]", "", obj)
+        elif isinstance(obj, list):
+            return [deep_clean(i) for i in obj]
+        elif isinstance(obj, dict):
+            return {k: deep_clean(v) for k, v in obj.items()}
+        else:
+            return obj
+
+    return deep_clean(data)
+
+
+def load_corpus(from_cache: int) -> List[Tuple[str, str]]:
+    corpus = []
+    for file_path in sorted(glob(path.join(CORPUS_DIR, "*.txt"))):
+        with open(file_path, "r", encoding="utf-8") as f:
+            corpus.append((path.basename(file_path), f.read()))
+
+    if from_cache > 0:
+        import db
+
+        for messages_hash, response in db.read(
+            "SELECT messages_hash, response FROM llm_cache ORDER BY last_hit_at DESC LIMIT %s;",
+            (from_cache,),
+        ):
+            corpus.append((f"cache:{messages_hash[:12]}", response))
+
+    return corpus
+
+
+def time_per_call(fn: Callable[[str], Any], resp: str, iterations: int) -> float:
+    started_at = perf_counter()
+    for _ in range(iterations):
+        fn(resp)
+    return (perf_counter() - started_at) / iterations
+
+
+def benchmark(corpus: List[Tuple[str, str]], iterations: int) -> None:
+    print(f"Loader: {SafeLoader.__name__}, {iterations} iterations per response\n", flush=True)
+    print(f"{'response':<32} {'chars':>6} {'baseline µs':>12} {'fast µs':>9} {'speedup':>8}")
+
+    total_baseline = 0.0
+    total_fast = 0.0
+
+    for name, resp in corpus:
+        try:
+            expected = extract_yaml_baseline(resp)
+        except Exception as e:
+            print(f"{name:<32} skipped (baseline fails: {type(e).__name__})")
+            continue
+
+        assert extract_yaml(resp) == expected, f"{name}: fast path result differs"
+
+        baseline = time_per_call(extract_yaml_baseline, resp, iterations)
+        fast = time_per_call(extract_yaml, resp, iterations)
+        total_baseline += baseline
+        total_fast += fast
+
+        print(
+            f"{name[:32]:<32} {len(resp):>6} {baseline * 1e6:>12.1f} {fast * 1e6:>9.1f} {baseline / fast:>7.1f}x"
+        )
+
+    if total_fast > 0:
+        print(
+            f"\n{'total':<32} {'':>6} {total_baseline * 1e6:>12.1f} {total_fast * 1e6:>9.1f} {total_baseline / total_fast:>7.1f}x"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--iterations", type=int, default=200)
+    parser.add_argument("--from-cache", type=int, default=0)
+    args = parser.parse_args()
+
+    benchmark(load_corpus(args.from_cache), args.iterations)
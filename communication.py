@@ -1,4 +1,6 @@
-from typing import Literal
+from collections import deque
+from multiprocessing.connection import Connection
+from typing import Deque, List, Literal
 
 from pydantic import BaseModel, Field, RootModel
 
@@ -23,6 +25,12 @@ class ATPM_ToUser(BaseModel):
     payload: str
 
 
+class ATPM_ToUserDelta(BaseModel):
+    message_type: Literal["to_user_delta"]
+    payload: str
+    discard: bool = False
+
+
 class ATPM_System(BaseModel):
     message_type: Literal["system"]
     payload: str
@@ -43,7 +51,46 @@ class AgentToParentMessage(RootModel):
         | ATPM_Debug
         | ATPM_Error
         | ATPM_ToUser
+        | ATPM_ToUserDelta
         | ATPM_System
         | ATPM_Halt
         | ATPM_Ping
     ) = Field(discriminator="message_type")
+
+
+class CommandMailbox:
+    """
+    Commands from the parent ("halt", "halt_soon") for a running agent turn.
+    Checks never wait: they only collect whatever has already arrived on the connection.
+    CallAgent checks for a halt before retrying the LLM call; ExitOrContinue takes the commands at the end of every step.
+    """
+
+    def __init__(self, conn: Connection) -> None:
+        self.conn = conn
+        self.pending: Deque[str] = deque()
+
+    def check(self) -> bool:
+        try:
+            while self.conn.poll(0):
+                self.pending.append(self.conn.recv())
+        except (EOFError, OSError):
+            pass  # *Parent gone; nothing more will arrive
+
+        return len(self.pending) > 0
+
+    def halt_requested(self) -> bool:
+        self.check()
+        return "halt" in self.pending
+
+    def take(self) -> List[str]:
+        """
+        Pending commands, each once; a halt supersedes a halt_soon.
+        """
+        self.check()
+        commands = list(dict.fromkeys(self.pending))
+        self.pending.clear()
+
+        if "halt" in commands:
+            commands = [command for command in commands if command != "halt_soon"]
+
+        return commands
@@ -1,12 +1,16 @@
-from os import path
-from typing import Any, List, Optional, Tuple, Union
+import shutil
+from contextlib import contextmanager
+from os import path, register_at_fork
+from threading import Lock
+from typing import Any, Dict, Iterator, List, Optional, Tuple, Union
 
 import chromadb
 import orjson
 import psycopg
+from chromadb.api.client import SharedSystemClient
 from psycopg.types.json import set_json_dumps, set_json_loads
 
-from config import POSTGRES_URL
+from config import ARCHIVAL_BACKEND, ARCHIVAL_EMBEDDED_DIR, POSTGRES_URL
 
 
 # *Helper functions
@@ -32,13 +36,182 @@ def read(
             return cur.fetchall()
 
 
-create_chromadb_client = lambda: chromadb.HttpClient(
+def write_many(query: str, values: List[Tuple[Any, ...]]) -> None:
+    with psycopg.connect(POSTGRES_URL) as conn:
+        with conn.cursor() as cur:
+            cur.executemany(query, values)
+            conn.commit()
+
+
+@contextmanager
+def advisory_lock(key: str) -> Iterator[None]:
+    """
+    Session-level Postgres advisory lock held for the duration of the block.
+    """
+    with psycopg.connect(POSTGRES_URL) as conn:
+        conn.execute("SELECT pg_advisory_lock(hashtextextended(%s, 0));", (key,))
+        conn.commit()
+        try:
+            yield
+        finally:
+            conn.execute("SELECT pg_advisory_unlock(hashtextextended(%s, 0));", (key,))
+            conn.commit()
+
+
+create_chromadb_http_client = lambda: chromadb.HttpClient(
     # host="localhost",
     host="chroma",
     port=8000,
     settings=chromadb.config.Settings(anonymized_telemetry=False),
 )
 
+create_chromadb_embedded_client = lambda agent_id: chromadb.PersistentClient(
+    path=path.join(ARCHIVAL_EMBEDDED_DIR, agent_id),
+    settings=chromadb.config.Settings(anonymized_telemetry=False),
+)
+
+
+# *One HTTP client per process, reused across turns by pooled agent workers (not shared across a fork)
+chromadb_http_client: Optional[Any] = None
+chromadb_http_collections: Dict[str, Any] = {}
+
+# *Embedded Chroma keeps one warm PersistentClient per agent per process. The directory is shared by the parent (uploads, deletes),
+# *one-off and pooled agent workers, so writes hold a per-agent advisory lock and bump the agent's archival_storage memory version;
+# *a process reloads its index from disk only when another process has changed the collection since it was opened.
+# *Chroma's system cache is process-wide (a reload drops every agent's client), hence the process lock around every embedded use
+embedded_archival_lock = Lock()
+embedded_archival_collections: Dict[str, Tuple[int, Any]] = {}  # *agent_id -> (version when opened, collection)
+
+
+def reset_chromadb_clients() -> None:
+    global chromadb_http_client, chromadb_http_collections, embedded_archival_lock
+    chromadb_http_client = None
+    chromadb_http_collections = {}
+    embedded_archival_lock = Lock()
+    if embedded_archival_collections:  # *The parent's clients (sqlite connections, index threads) are not the child's
+        embedded_archival_collections.clear()
+        SharedSystemClient.clear_system_cache()
+
+
+register_at_fork(after_in_child=reset_chromadb_clients)
+
+
+def get_chromadb_http_client() -> Any:
+    global chromadb_http_client
+    if chromadb_http_client is None:
+        chromadb_http_client = create_chromadb_http_client()
+    return chromadb_http_client
+
+
+def archival_version(agent_id: str) -> int:
+    rows = read(
+        "SELECT version FROM memory_versions WHERE agent_id = %s AND section = 'archival_storage';",
+        (agent_id,),
+    )
+    return rows[0][0] if rows else 0
+
+
+def bump_archival_version(agent_id: str) -> int:
+    return read(
+        """
+        INSERT INTO memory_versions (agent_id, section, version)
+        VALUES (%s, 'archival_storage', 1)
+        ON CONFLICT (agent_id, section) DO UPDATE SET version = memory_versions.version + 1
+        RETURNING version;
+        """,
+        (agent_id,),
+    )[0][0]
+
+
+def open_embedded_archival_collection(agent_id: str, version: int) -> Any:
+    # *Caller holds embedded_archival_lock
+    cached = embedded_archival_collections.get(agent_id)
+    if cached is not None and cached[0] == version:
+        return cached[1]
+
+    if cached is not None:  # *Changed by another process: reload from disk
+        embedded_archival_collections.clear()
+        SharedSystemClient.clear_system_cache()
+
+    collection = create_chromadb_embedded_client(agent_id).get_or_create_collection(
+        name=agent_id
+    )
+    embedded_archival_collections[agent_id] = (version, collection)
+
+    return collection
+
+
+@contextmanager
+def embedded_archival_collection(agent_id: str, write: bool = False) -> Iterator[Any]:
+    with embedded_archival_lock:
+        version = archival_version(agent_id)
+        cached = embedded_archival_collections.get(agent_id)
+
+        if not write and cached is not None and cached[0] == version:
+            yield cached[1]
+            return
+
+        # *Writes, first opens and reloads must not interleave with another process's write
+        with advisory_lock(f"archival_storage:{agent_id}"):
+            collection = open_embedded_archival_collection(
+                agent_id, archival_version(agent_id)
+            )
+            yield collection
+
+            if write:
+                embedded_archival_collections[agent_id] = (
+                    bump_archival_version(agent_id),
+                    collection,
+                )
+
+
+@contextmanager
+def archival_collection(agent_id: str, write: bool = False) -> Iterator[Any]:
+    """
+    Archival storage collection of an agent, backend selected by ARCHIVAL_BACKEND:
+    - chroma: shared Chroma HTTP server
+    - embedded: in-process persistent Chroma client (on-disk HNSW index) per agent
+    Blocks that change the collection pass write=True, which bumps the agent's archival_storage memory version.
+    """
+    match ARCHIVAL_BACKEND:
+        case "chroma":
+            if agent_id not in chromadb_http_collections:
+                chromadb_http_collections[agent_id] = (
+                    get_chromadb_http_client().get_or_create_collection(name=agent_id)
+                )
+            yield chromadb_http_collections[agent_id]
+
+            if write:
+                bump_archival_version(agent_id)
+        case "embedded":
+            with embedded_archival_collection(agent_id, write) as collection:
+                yield collection
+        case _:
+            raise ValueError("Invalid ARCHIVAL_BACKEND")
+
+
+def create_archival_collection(agent_id: str) -> None:
+    with archival_collection(agent_id):
+        pass
+
+
+def delete_archival_collection(agent_id: str) -> None:
+    match ARCHIVAL_BACKEND:
+        case "chroma":
+            get_chromadb_http_client().delete_collection(agent_id)
+            chromadb_http_collections.pop(agent_id, None)
+        case "embedded":
+            with embedded_archival_lock, advisory_lock(f"archival_storage:{agent_id}"):
+                if embedded_archival_collections.pop(agent_id, None) is not None:
+                    embedded_archival_collections.clear()
+                    SharedSystemClient.clear_system_cache()
+                shutil.rmtree(
+                    path.join(ARCHIVAL_EMBEDDED_DIR, agent_id), ignore_errors=True
+                )
+        case _:
+            raise ValueError("Invalid ARCHIVAL_BACKEND")
+
+
 # *Init DB
 
 
@@ -82,6 +255,33 @@ write(
     """,
 )
 
+## *Task Queue
+
+write(
+    """
+    CREATE TABLE IF NOT EXISTS tasks (
+        id UUID PRIMARY KEY NOT NULL,
+        agent_id UUID NOT NULL,
+        position BIGSERIAL NOT NULL,
+        priority INTEGER NOT NULL DEFAULT 0,
+        task TEXT NOT NULL,
+        FOREIGN KEY (agent_id) REFERENCES agents(id) ON DELETE CASCADE
+    );
+    """,
+)
+
+write(  # *Move tasks out of the old working_context.tasks array
+    """
+    WITH moved AS (
+        INSERT INTO tasks (id, agent_id, task)
+        SELECT gen_random_uuid(), working_context.agent_id, queued.task
+        FROM working_context, unnest(working_context.tasks) WITH ORDINALITY AS queued(task, ordinality)
+        ORDER BY working_context.agent_id, queued.ordinality
+    )
+    UPDATE working_context SET tasks = '{}' WHERE cardinality(tasks) > 0;
+    """,
+)
+
 ## *Recall Storage
 
 write(
@@ -127,12 +327,255 @@ write(
     """,
 )
 
+write(
+    "ALTER TABLE fifo_queue ADD COLUMN IF NOT EXISTS summary_pending BOOLEAN NOT NULL DEFAULT FALSE;",
+)
+
+## *Summaries (leaf summaries per evicted batch, rolled up into higher levels)
+
+write(
+    """
+    CREATE TABLE IF NOT EXISTS summaries (
+        id UUID PRIMARY KEY NOT NULL,
+        agent_id UUID NOT NULL,
+        level INTEGER NOT NULL,
+        parent_id UUID DEFAULT NULL,
+        content TEXT NOT NULL,
+        token_count INTEGER DEFAULT NULL,
+        start_time TIMESTAMP NOT NULL,
+        end_time TIMESTAMP NOT NULL,
+        created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY (agent_id) REFERENCES agents(id) ON DELETE CASCADE,
+        FOREIGN KEY (parent_id) REFERENCES summaries(id) ON DELETE SET NULL
+    );
+    """,
+)
+
+write(  # *Carry over single-field recursive summaries from before the summary tree
+    """
+    INSERT INTO summaries (id, agent_id, level, content, start_time, end_time)
+    SELECT gen_random_uuid(), id, 0, recursive_summary, created_at, recursive_summary_update_time
+    FROM agents
+    WHERE recursive_summary IS NOT NULL
+        AND recursive_summary <> 'No content in recursive summary yet'
+        AND NOT EXISTS (SELECT 1 FROM summaries WHERE summaries.agent_id = agents.id);
+    """,
+)
+
+## *Archival Signatures (near-duplicate suppression)
+
+write(
+    """
+    CREATE TABLE IF NOT EXISTS archival_signatures (
+        id UUID PRIMARY KEY NOT NULL,
+        agent_id UUID NOT NULL,
+        signature BIGINT NOT NULL,
+        FOREIGN KEY (agent_id) REFERENCES agents(id) ON DELETE CASCADE
+    );
+    """,
+)
+
+write(
+    "ALTER TABLE archival_signatures ADD COLUMN IF NOT EXISTS category TEXT;",
+)
+
+write(
+    "ALTER TABLE archival_signatures ADD COLUMN IF NOT EXISTS no_tokens INTEGER;",
+)
+
+## *Archival Terms (BM25 postings, so hybrid search never re-tokenises the corpus)
+
+write(
+    """
+    CREATE TABLE IF NOT EXISTS archival_terms (
+        chunk_id UUID NOT NULL,
+        agent_id UUID NOT NULL,
+        term TEXT NOT NULL,
+        tf INTEGER NOT NULL,
+        PRIMARY KEY (agent_id, term, chunk_id),
+        FOREIGN KEY (chunk_id) REFERENCES archival_signatures(id) ON DELETE CASCADE
+    );
+    """,
+)
+
+## *Memory Versions (bumped on every mutation, used to memoise rendered memory sections)
+
+write(
+    """
+    CREATE TABLE IF NOT EXISTS memory_versions (
+        agent_id UUID NOT NULL,
+        section TEXT NOT NULL,
+        version BIGINT NOT NULL DEFAULT 0,
+        PRIMARY KEY (agent_id, section)
+    );
+    """,
+)
+
+# *Statement-level: one bump per agent per statement, however many rows it touches
+write(
+    """
+    CREATE OR REPLACE FUNCTION bump_memory_versions() RETURNS TRIGGER AS $$
+    BEGIN
+        INSERT INTO memory_versions (agent_id, section, version)
+        SELECT DISTINCT agent_id, TG_ARGV[0], 1 FROM changed_rows
+        ON CONFLICT (agent_id, section) DO UPDATE SET version = memory_versions.version + 1;
+
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql;
+    """,
+)
+
+for table, section in (
+    ("working_context", "working_context"),
+    ("tasks", "working_context"),
+    ("recall_storage", "conversation"),
+    ("chat_log", "conversation"),
+    ("fifo_queue", "conversation"),
+    ("summaries", "summaries"),
+):
+    write(f"DROP TRIGGER IF EXISTS {table}_bump_memory_version ON {table};")
+
+    # *Transition tables allow only one event per trigger
+    for event, transition_table in (
+        ("INSERT", "NEW"),
+        ("UPDATE", "NEW"),
+        ("DELETE", "OLD"),
+    ):
+        write(
+            f"""
+            CREATE OR REPLACE TRIGGER {table}_{event.lower()}_bump_memory_version
+            AFTER {event} ON {table}
+            REFERENCING {transition_table} TABLE AS changed_rows
+            FOR EACH STATEMENT EXECUTE FUNCTION bump_memory_versions('{section}');
+            """,
+        )
+
+## *LLM Response Cache (content-addressed, shared by all agents)
+
+write(
+    """
+    CREATE TABLE IF NOT EXISTS llm_cache (
+        messages_hash TEXT NOT NULL,
+        model TEXT NOT NULL,
+        response TEXT NOT NULL,
+        size INT NOT NULL,
+        hits INT NOT NULL DEFAULT 0,
+        created_at TIMESTAMP NOT NULL DEFAULT NOW(),
+        last_hit_at TIMESTAMP NOT NULL DEFAULT NOW(),
+        PRIMARY KEY (messages_hash, model)
+    );
+    """,
+)
+
+write(
+    """
+    CREATE TABLE IF NOT EXISTS llm_cache_stats (
+        call_site TEXT PRIMARY KEY NOT NULL,
+        hits BIGINT NOT NULL DEFAULT 0,
+        misses BIGINT NOT NULL DEFAULT 0
+    );
+    """,
+)
+
+## *LLM Parse Stats (agent output parse/validation failures per backend)
+
+write(
+    """
+    CREATE TABLE IF NOT EXISTS llm_parse_stats (
+        backend TEXT NOT NULL,
+        model TEXT NOT NULL,
+        structured BOOLEAN NOT NULL,
+        attempts BIGINT NOT NULL DEFAULT 0,
+        failures BIGINT NOT NULL DEFAULT 0,
+        PRIMARY KEY (backend, model, structured)
+    );
+    """,
+)
+
+write(
+    "ALTER TABLE llm_parse_stats ADD COLUMN IF NOT EXISTS deterministic_repairs BIGINT NOT NULL DEFAULT 0;",
+)
+
+write(
+    "ALTER TABLE llm_parse_stats ADD COLUMN IF NOT EXISTS llm_repairs BIGINT NOT NULL DEFAULT 0;",
+)
+
+## *LLM Call Ledger (one row per backend attempt, written in batches)
+
+write(
+    """
+    CREATE TABLE IF NOT EXISTS llm_calls (
+        id BIGSERIAL PRIMARY KEY,
+        agent_id UUID DEFAULT NULL,
+        call_site TEXT NOT NULL,
+        backend TEXT DEFAULT NULL,
+        model TEXT DEFAULT NULL,
+        outcome TEXT NOT NULL,
+        prompt_tokens INT DEFAULT NULL,
+        completion_tokens INT DEFAULT NULL,
+        usage_estimated BOOLEAN NOT NULL DEFAULT FALSE,
+        latency DOUBLE PRECISION DEFAULT NULL,
+        ttft DOUBLE PRECISION DEFAULT NULL,
+        created_at TIMESTAMP NOT NULL DEFAULT NOW(),
+        FOREIGN KEY (agent_id) REFERENCES agents(id) ON DELETE SET NULL
+    );
+    """,
+)
+
+write(
+    """
+    CREATE OR REPLACE VIEW llm_usage_per_agent AS
+    SELECT
+        agent_id,
+        call_site,
+        COUNT(*) AS calls,
+        COUNT(*) FILTER (WHERE outcome = 'success') AS successes,
+        COUNT(*) FILTER (WHERE outcome IN ('error', 'rate_limited')) AS failures,
+        COUNT(*) FILTER (WHERE outcome = 'cache_hit') AS cache_hits,
+        COALESCE(SUM(prompt_tokens), 0) AS prompt_tokens,
+        COALESCE(SUM(completion_tokens), 0) AS completion_tokens,
+        COALESCE(SUM(latency), 0) AS total_latency,
+        MIN(created_at) AS first_call_at,
+        MAX(created_at) AS last_call_at
+    FROM llm_calls
+    GROUP BY agent_id, call_site;
+    """,
+)
+
+write(
+    """
+    CREATE OR REPLACE VIEW llm_usage_per_backend AS
+    SELECT
+        backend,
+        model,
+        COUNT(*) AS calls,
+        COUNT(*) FILTER (WHERE outcome = 'success') AS successes,
+        COUNT(*) FILTER (WHERE outcome = 'error') AS errors,
+        COUNT(*) FILTER (WHERE outcome = 'rate_limited') AS rate_limited,
+        COUNT(*) FILTER (WHERE outcome = 'cancelled') AS cancelled,
+        COALESCE(SUM(prompt_tokens), 0) AS prompt_tokens,
+        COALESCE(SUM(completion_tokens), 0) AS completion_tokens,
+        COALESCE(SUM(prompt_tokens + completion_tokens) FILTER (WHERE created_at > NOW() - INTERVAL '1 hour'), 0) AS tokens_last_hour,
+        percentile_cont(0.5) WITHIN GROUP (ORDER BY latency) FILTER (WHERE outcome = 'success') AS latency_p50,
+        percentile_cont(0.95) WITHIN GROUP (ORDER BY latency) FILTER (WHERE outcome = 'success') AS latency_p95,
+        percentile_cont(0.5) WITHIN GROUP (ORDER BY ttft) AS ttft_p50
+    FROM llm_calls
+    WHERE backend IS NOT NULL
+    GROUP BY backend, model;
+    """,
+)
+
 ## *Indexes
 
 write(
     "CREATE UNIQUE INDEX IF NOT EXISTS idx_working_context_agent_id ON working_context(agent_id);",
 )
 
+write(
+    "CREATE INDEX IF NOT EXISTS idx_tasks_agent_priority_position ON tasks(agent_id, priority DESC, position ASC);",
+)
+
 write(
     "CREATE INDEX IF NOT EXISTS idx_recall_agent_timestamp ON recall_storage(agent_id, timestamp);",
 )
@@ -149,6 +592,34 @@ write(
     "CREATE INDEX IF NOT EXISTS idx_chat_log_content_trgm ON chat_log USING gin (content gin_trgm_ops);",
 )
 
+write(
+    "CREATE INDEX IF NOT EXISTS idx_archival_signatures_agent_id ON archival_signatures(agent_id);",
+)
+
+write(
+    "CREATE INDEX IF NOT EXISTS idx_summaries_agent_start_time ON summaries(agent_id, start_time);",
+)
+
 write(
     "CREATE INDEX IF NOT EXISTS idx_fifo_agent_timestamp ON fifo_queue(agent_id, timestamp ASC);",
 )
+
+write(
+    "DROP INDEX IF EXISTS idx_llm_cache_last_hit_at;",
+)
+
+write(  # *Matches the LRU eviction order in llm_cache.py
+    "CREATE INDEX IF NOT EXISTS idx_llm_cache_recency ON llm_cache(last_hit_at DESC, created_at DESC);",
+)
+
+write(
+    "CREATE INDEX IF NOT EXISTS idx_llm_cache_created_at ON llm_cache(created_at);",
+)
+
+write(
+    "CREATE INDEX IF NOT EXISTS idx_llm_calls_agent_id ON llm_calls(agent_id);",
+)
+
+write(
+    "CREATE INDEX IF NOT EXISTS idx_llm_calls_created_at ON llm_calls(created_at);",
+)
@@ -26,7 +26,9 @@ def vlm_process_image(b64_image, img_type):
                     },
                 ],
             },
-        ]
+        ],
+        call_site="doc_upload",
+        cache=True,
     )
 
 
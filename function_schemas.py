@@ -0,0 +1,169 @@
+from typing import Any, Dict
+
+import orjson
+import yaml
+
+SCHEMA_CONSTRAINT_KEYS = (
+    "minimum",
+    "maximum",
+    "exclusiveMinimum",
+    "exclusiveMaximum",
+    "minLength",
+    "maxLength",
+    "minItems",
+    "maxItems",
+    "pattern",
+    "format",
+)
+
+
+def resolve_schema(schema: Dict[str, Any], defs: Dict[str, Any]) -> Dict[str, Any]:
+    if "$ref" in schema:
+        return resolve_schema(defs[schema["$ref"].split("/")[-1]], defs)
+    return schema
+
+
+def render_yaml_schema(schema: Dict[str, Any]) -> str:
+    return yaml.dump(dict(reversed(schema.items())), sort_keys=False).strip()
+
+
+def typescript_type(schema: Dict[str, Any], defs: Dict[str, Any]) -> str:
+    schema = resolve_schema(schema, defs)
+
+    if "enum" in schema:
+        return " | ".join(orjson.dumps(v).decode("utf-8") for v in schema["enum"])
+    if "const" in schema:
+        return orjson.dumps(schema["const"]).decode("utf-8")
+    if "anyOf" in schema or "oneOf" in schema:
+        return " | ".join(
+            dict.fromkeys(
+                typescript_type(s, defs) for s in schema.get("anyOf", schema.get("oneOf"))
+            )
+        )
+
+    match schema.get("type"):
+        case "array":
+            items_type = typescript_type(schema.get("items", {}), defs)
+            return f"({items_type})[]" if " | " in items_type else f"{items_type}[]"
+        case "object" if "properties" in schema:
+            required = set(schema.get("required", []))
+            return (
+                "{ "
+                + ", ".join(
+                    f"{name}{'' if name in required else '?'}: {typescript_type(s, defs)}"
+                    for name, s in schema["properties"].items()
+                )
+                + " }"
+            )
+        case list() as types:
+            return " | ".join(types)
+        case None:
+            return "any"
+        case schema_type:
+            return schema_type
+
+
+def typescript_notes(schema: Dict[str, Any], defs: Dict[str, Any]) -> str:
+    # *Constraints (also from nullable anyOf branches), default and description
+    schema = resolve_schema(schema, defs)
+    branches = [schema] + [
+        resolve_schema(s, defs) for s in schema.get("anyOf", schema.get("oneOf", []))
+    ]
+    notes = [
+        f"{key}: {branch[key]}"
+        for branch in branches
+        for key in SCHEMA_CONSTRAINT_KEYS
+        if key in branch
+    ]
+    if "default" in schema and schema["default"] is not None:
+        notes.append(f"default: {orjson.dumps(schema['default']).decode('utf-8')}")
+
+    return ". ".join(
+        part for part in (", ".join(notes), schema.get("description", "")) if part
+    )
+
+
+def render_typescript_schema(schema: Dict[str, Any]) -> str:
+    """
+    e.g.
+    // Searches Recall Storage by text (exact match).
+    recall_search({
+      query: string, // Search query. ...
+      page?: integer, // minimum: 0, default: 0. Result list page number.
+    })
+    """
+    defs = schema.get("$defs", {})
+    required = set(schema.get("required", []))
+    lines = [f"// {schema['description']}"] if schema.get("description") else []
+
+    if not schema.get("properties"):
+        return "\n".join(lines + [f"{schema['title']}({{}})"])
+
+    lines.append(f"{schema['title']}({{")
+    for name, property_schema in schema["properties"].items():
+        property_type = typescript_type(property_schema, defs)
+        if name not in required:  # *Omitting an optional field already means null
+            property_type = " | ".join(
+                t for t in property_type.split(" | ") if t != "null"
+            )
+        notes = typescript_notes(property_schema, defs)
+
+        lines.append(
+            f"  {name}{'' if name in required else '?'}: {property_type},"
+            + (f" // {notes}" if notes else "")
+        )
+    lines.append("})")
+
+    return "\n".join(lines)
+
+
+def minimal_json_schema(schema: Any, optional: bool = False) -> Any:
+    # *Drops titles; optional fields lose their anyOf null branch
+    if isinstance(schema, list):
+        return [minimal_json_schema(s) for s in schema]
+    if not isinstance(schema, dict):
+        return schema
+
+    if optional and "anyOf" in schema:
+        non_null = [s for s in schema["anyOf"] if s != {"type": "null"}]
+        if len(non_null) == 1:
+            schema = {
+                **{k: v for k, v in schema.items() if k != "anyOf"},
+                **non_null[0],
+            }
+
+    required = set(schema.get("required", []))
+    return {
+        key: (
+            {
+                name: minimal_json_schema(s, name not in required)
+                for name, s in value.items()
+            }
+            if key == "properties"
+            else minimal_json_schema(value)
+        )
+        for key, value in schema.items()
+        if key != "title"
+    }
+
+
+def render_json_schema(schema: Dict[str, Any]) -> str:
+    parameters = minimal_json_schema(
+        {k: v for k, v in schema.items() if k not in ("title", "description")}
+    )
+    parameters.pop("type", None)
+
+    return orjson.dumps(
+        {
+            "name": schema["title"],
+            "description": schema.get("description", ""),
+            "parameters": parameters,
+        }
+    ).decode("utf-8")
+
+
+SCHEMA_RENDERERS = {
+    "yaml": render_yaml_schema,
+    "typescript": render_typescript_schema,
+    "json": render_json_schema,
+}
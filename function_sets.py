@@ -3,12 +3,14 @@ import os
 import sys
 from dataclasses import dataclass
 from datetime import datetime
+from functools import cached_property
 from types import ModuleType
-from typing import Any, Dict, List, Tuple
-
-import yaml
+from typing import Any, Callable, Dict, List, Tuple
 
 import db
+from config import FUNCTION_SCHEMA_FORMAT, FUNCTION_SETS_HOT_RELOAD
+from function_schemas import SCHEMA_RENDERERS
+from llm import llm_count_tokens
 
 # from function_node import FunctionNode
 
@@ -27,71 +29,181 @@ def import_from_path(
     return module
 
 
-@dataclass
-class FunctionSets:
-    agent_id: str
+# *Function set registry: each module is imported once per process, and node dicts are built once per combination of optional function sets
+BASE_FUNCTION_SETS_DIR = os.path.join(os.path.dirname(__file__), "function_sets", "base")
+OPTIONAL_FUNCTION_SETS_DIR = os.path.join(
+    os.path.dirname(__file__), "function_sets", "optional"
+)
 
-    @property
-    def optional_function_set_names(self) -> List[str]:
-        return db.read(
-            "SELECT optional_function_sets FROM agents WHERE id = %s;",
-            (self.agent_id,),
-        )[0][0]
+function_set_modules: Dict[str, Tuple[float, List[Any]]] = {}  # *By file path
+base_function_set_files: List[str] = []
+function_node_dicts: Dict[Tuple[str, ...], Dict[str, Any]] = {}
+reload_callbacks: List[Callable[[], None]] = []  # *Clear caches derived from the nodes
 
-    # def get_function_nodes(self) -> Dict[str, "FunctionNode"]:
-    def get_function_nodes(self) -> Dict[str, Any]:
-        function_node_list = []
 
-        # *Load nodes
+def list_base_function_set_files() -> List[str]:
+    return sorted(
+        fsf for fsf in os.listdir(BASE_FUNCTION_SETS_DIR) if fsf.endswith(".py")
+    )
 
-        base_function_sets_dir = os.path.join(
-            os.path.dirname(__file__), "function_sets", "base"
-        )
 
-        for function_set_file in os.listdir(base_function_sets_dir):
-            if not function_set_file.endswith(".py"):
-                continue
-            function_set_module = import_from_path(
+def load_function_set_nodes(module_name: str, file_path: str) -> List[Any]:
+    if file_path in function_set_modules:
+        return function_set_modules[file_path][1]
+
+    mtime = os.path.getmtime(file_path)
+    function_set_module = import_from_path(module_name, file_path)
+    function_nodes = getattr(function_set_module, "FUNCTION_NODES", None)
+    assert function_nodes
+    assert isinstance(function_nodes, list)
+
+    function_set_modules[file_path] = (mtime, function_nodes)
+    return function_nodes
+
+
+def reload_changed_function_sets() -> None:
+    changed = (
+        len(base_function_set_files) > 0
+        and base_function_set_files != list_base_function_set_files()
+    ) or any(
+        not os.path.exists(file_path) or os.path.getmtime(file_path) != mtime
+        for file_path, (mtime, _) in function_set_modules.items()
+    )
+    if not changed:
+        return
+
+    print("Function sets changed, reloading", flush=True)
+    function_set_modules.clear()
+    base_function_set_files.clear()
+    function_node_dicts.clear()
+    rendered_function_schemas.clear()
+    for reload_callback in reload_callbacks:
+        reload_callback()
+
+
+def load_function_nodes(optional_function_set_names: Tuple[str, ...]) -> Dict[str, Any]:
+    """
+    Function nodes (by name) of the base function sets plus the given optional ones.
+    The returned nodes are shared by every agent in the process; copy them before wiring them into a flow.
+    """
+    if FUNCTION_SETS_HOT_RELOAD:
+        reload_changed_function_sets()
+
+    if optional_function_set_names in function_node_dicts:
+        return function_node_dicts[optional_function_set_names]
+
+    if not base_function_set_files:
+        base_function_set_files.extend(list_base_function_set_files())
+
+    function_node_list = []
+
+    for function_set_file in base_function_set_files:
+        function_node_list.extend(
+            load_function_set_nodes(
                 function_set_file.replace(".py", ""),
-                os.path.join(base_function_sets_dir, function_set_file),
+                os.path.join(BASE_FUNCTION_SETS_DIR, function_set_file),
             )
-            current_set_function_nodes = getattr(
-                function_set_module, "FUNCTION_NODES", None
-            )
-            assert current_set_function_nodes
-            assert isinstance(current_set_function_nodes, list)
-            function_node_list.extend(current_set_function_nodes)
-
-        optional_function_sets_dir = os.path.join(
-            os.path.dirname(__file__), "function_sets", "optional"
         )
 
-        for function_set_name in self.optional_function_set_names:
-            function_set_module = import_from_path(
+    for function_set_name in optional_function_set_names:
+        function_node_list.extend(
+            load_function_set_nodes(
                 function_set_name,
-                os.path.join(optional_function_sets_dir, function_set_name + ".py"),
+                os.path.join(OPTIONAL_FUNCTION_SETS_DIR, function_set_name + ".py"),
             )
-            current_set_function_nodes = getattr(
-                function_set_module, "FUNCTION_NODES", None
+        )
+
+    function_node_dicts[optional_function_set_names] = {
+        node.name: node for node in function_node_list
+    }
+    return function_node_dicts[optional_function_set_names]
+
+
+def preload_function_sets() -> None:
+    load_function_nodes(
+        tuple(
+            sorted(
+                fsf.replace(".py", "")
+                for fsf in os.listdir(OPTIONAL_FUNCTION_SETS_DIR)
+                if fsf.endswith(".py")
             )
-            assert current_set_function_nodes
-            assert isinstance(current_set_function_nodes, list)
-            function_node_list.extend(current_set_function_nodes)
+        )
+    )
 
-        # *Convert to dict
-        function_node_dict = {
-            name: node for name, node in map(lambda n: (n.name, n), function_node_list)
-        }
 
-        return function_node_dict
+@dataclass(frozen=True)
+class RenderedFunctionSchemas:
+    text: str
+    no_tokens: int
+    yaml_no_tokens: int  # *Token count of the full YAML schemas, for comparison
 
-    def __repr__(self) -> str:
+
+# *Rendered once per (format, optional function sets); cleared when function sets are hot reloaded
+rendered_function_schemas: Dict[Tuple[str, Tuple[str, ...]], RenderedFunctionSchemas] = {}
+
+
+@dataclass
+class FunctionSets:
+    agent_id: str
+
+    @cached_property  # *Fixed at agent creation
+    def optional_function_set_names(self) -> List[str]:
+        return db.read(
+            "SELECT optional_function_sets FROM agents WHERE id = %s;",
+            (self.agent_id,),
+        )[0][0]
+
+    @property
+    def optional_function_sets_key(self) -> Tuple[str, ...]:
+        return tuple(sorted(self.optional_function_set_names))
+
+    # def get_function_nodes(self) -> Dict[str, "FunctionNode"]:
+    def get_function_nodes(self) -> Dict[str, Any]:
+        return load_function_nodes(self.optional_function_sets_key)
+
+    def render_schemas(self, schema_format: str) -> str:
         return "\n\n".join(
             [
-                yaml.dump(
-                    dict(reversed(node.validator.model_json_schema().items())),
-                    sort_keys=False,
-                ).strip()
+                SCHEMA_RENDERERS[schema_format](node.validator.model_json_schema())
                 for node in self.get_function_nodes().values()
             ]
         )
+
+    @property
+    def rendered_schemas(self) -> RenderedFunctionSchemas:
+        key = (FUNCTION_SCHEMA_FORMAT, self.optional_function_sets_key)
+        if key in rendered_function_schemas:
+            return rendered_function_schemas[key]
+
+        text = self.render_schemas(FUNCTION_SCHEMA_FORMAT)
+        no_tokens = llm_count_tokens(text)
+        rendered = RenderedFunctionSchemas(
+            text,
+            no_tokens,
+            (
+                no_tokens
+                if FUNCTION_SCHEMA_FORMAT == "yaml"
+                else llm_count_tokens(self.render_schemas("yaml"))
+            ),
+        )
+        rendered_function_schemas[key] = rendered
+
+        return rendered
+
+    def schema_stats(self) -> Dict[str, Any]:
+        rendered = self.rendered_schemas
+
+        return {
+            "format": FUNCTION_SCHEMA_FORMAT,
+            "no_tokens": rendered.no_tokens,
+            "yaml_no_tokens": rendered.yaml_no_tokens,
+            "saved_tokens": rendered.yaml_no_tokens - rendered.no_tokens,
+            "saved_fraction": (
+                (rendered.yaml_no_tokens - rendered.no_tokens) / rendered.yaml_no_tokens
+                if rendered.yaml_no_tokens > 0
+                else 0.0
+            ),
+        }
+
+    def __repr__(self) -> str:
+        return self.rendered_schemas.text
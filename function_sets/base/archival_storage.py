@@ -35,27 +35,41 @@ class ArchivalInsert(FunctionNode):
         conn: Connection,
         arguments_validated: ArchivalInsertValidator,
     ) -> Message:
-        memory.archival_storage.archival_insert(
+        no_inserted, no_deduplicated = memory.archival_storage.archival_insert(
             arguments_validated.text, arguments_validated.category
         )
 
+        if no_inserted == 0:
+            return Message(
+                message_type="function_res",
+                timestamp=datetime.now(),
+                content=FunctionResultContent(
+                    success=True,
+                    result=f"Text '{arguments_validated.text}' was not inserted as Archival Storage already contains near-duplicate entries ({no_deduplicated} chunk(s) deduplicated)",
+                ),
+            )
+
         return Message(
             message_type="function_res",
             timestamp=datetime.now(),
             content=FunctionResultContent(
                 success=True,
-                result=f"Successfully inserted text '{arguments_validated.text}' into Archival Storage with category '{arguments_validated.category}'",
+                result=f"Successfully inserted text '{arguments_validated.text}' into Archival Storage with category '{arguments_validated.category}' ({no_inserted} chunk(s) inserted, {no_deduplicated} near-duplicate chunk(s) skipped)",
             ),
         )
 
 
 # *archival_search
 class ArchivalSearchValidator(BaseModel):
-    """Searches Archival Storage by text (vector search)."""
+    """Searches Archival Storage by text (vector search, or hybrid keyword + vector search)."""
 
     query: str = Field(
         description="Search query. To be formatted for more effective vector search."
     )
+    mode: Optional[Literal["vector", "hybrid"]] = Field(
+        default="hybrid",
+        description="Search mode. 'hybrid' also matches exact keywords (e.g. names, identifiers, numbers) in the query; 'vector' only matches by meaning.",
+    )
     page: Optional[NonNegativeInt] = Field(
         default=0,
         description="Result list page number.",
@@ -82,6 +96,7 @@ class ArchivalSearch(FunctionNode):
             arguments_validated.page * PAGE_SIZE,
             PAGE_SIZE,
             arguments_validated.category,
+            arguments_validated.mode or "hybrid",
         )
 
         result_str = (
@@ -1,10 +1,11 @@
 from datetime import datetime
 from multiprocessing.connection import Connection
-from typing import Any, Dict, List, Literal
+from typing import Any, Dict, List, Literal, Optional
 
 from pocketflow import *
 from pydantic import BaseModel, Field
 
+from config import PERSONA_MAX_WORDS
 from function_node import FunctionNode
 from memory import FunctionResultContent, Memory, Message
 
@@ -31,18 +32,16 @@ class PersonaAppend(FunctionNode):
         conn: Connection,
         arguments_validated: PersonaAppendValidator,
     ) -> Message:
-        match arguments_validated.section:
-            case "user":
-                memory.working_context.user_persona += "\n" + arguments_validated.text
-            case "agent":
-                memory.working_context.agent_persona += "\n" + arguments_validated.text
+        new_persona, new_persona_no_tokens = memory.working_context.persona_append(
+            arguments_validated.section, "\n" + arguments_validated.text
+        )
 
         return Message(
             message_type="function_res",
             timestamp=datetime.now(),
             content=FunctionResultContent(
                 success=True,
-                result=f"Successfully updated {'Agent' if arguments_validated.section == 'agent' else 'user'} Persona",
+                result=f"Successfully updated {'Agent' if arguments_validated.section == 'agent' else 'User'} Persona (now {len(new_persona.split())}/{PERSONA_MAX_WORDS} words, {new_persona_no_tokens} tokens)",
             ),
         )
 
@@ -70,30 +69,18 @@ class PersonaReplace(FunctionNode):
         conn: Connection,
         arguments_validated: PersonaReplaceValidator,
     ) -> Message:
-        match arguments_validated.section:
-            case "user":
-                old_persona = memory.working_context.user_persona
-                if arguments_validated.old_text not in old_persona:
-                    raise ValueError("old_text does not exist in User persona")
-
-                memory.working_context.user_persona = old_persona.replace(
-                    arguments_validated.old_text, arguments_validated.new_text
-                )
-            case "agent":
-                old_persona = memory.working_context.agent_persona
-                if arguments_validated.old_text not in old_persona:
-                    raise ValueError("old_text does not exist in Agent persona")
-
-                memory.working_context.agent_persona = old_persona.replace(
-                    arguments_validated.old_text, arguments_validated.new_text
-                )
+        new_persona, new_persona_no_tokens = memory.working_context.persona_replace(
+            arguments_validated.section,
+            arguments_validated.old_text,
+            arguments_validated.new_text,
+        )
 
         return Message(
             message_type="function_res",
             timestamp=datetime.now(),
             content=FunctionResultContent(
                 success=True,
-                result=f"Successfully updated {'Agent' if arguments_validated.section == 'agent' else 'User'} Persona",
+                result=f"Successfully updated {'Agent' if arguments_validated.section == 'agent' else 'User'} Persona (now {len(new_persona.split())}/{PERSONA_MAX_WORDS} words, {new_persona_no_tokens} tokens)",
             ),
         )
 
@@ -103,6 +90,10 @@ class PushTaskValidator(BaseModel):
     """Pushes a task to your Working Context's task queue."""
 
     task: str = Field(description="Task to be pushed.")
+    priority: Optional[int] = Field(
+        default=0,
+        description="Task priority. Higher-priority tasks are popped first; tasks of equal priority are popped in the order they were pushed.",
+    )
 
     model_config = {"title": "push_task"}
 
@@ -114,7 +105,9 @@ class PushTask(FunctionNode):
     def exec_function(
         self, memory: Memory, conn: Connection, arguments_validated: PushTaskValidator
     ) -> Message:
-        memory.working_context.push_task(arguments_validated.task)
+        memory.working_context.push_task(
+            arguments_validated.task, arguments_validated.priority or 0
+        )
 
         return Message(
             message_type="function_res",
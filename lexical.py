@@ -0,0 +1,82 @@
+import re
+from collections import Counter
+from hashlib import blake2b
+from typing import List, Sequence
+
+import numpy as np
+
+TOKEN_PATTERN = re.compile(r"\w+", re.UNICODE)
+
+
+def lexical_tokenise(text: str) -> List[str]:
+    return TOKEN_PATTERN.findall(text.lower())
+
+
+def term_frequencies(text: str) -> Counter:
+    return Counter(lexical_tokenise(text))
+
+
+def bm25_from_statistics(
+    tf: np.ndarray,
+    doc_lengths: np.ndarray,
+    df: np.ndarray,
+    no_docs: int,
+    avg_doc_length: float,
+    k1: float = 1.5,
+    b: float = 0.75,
+) -> np.ndarray:
+    """
+    BM25 over precomputed statistics: tf is (documents x query terms), df and no_docs cover the whole corpus.
+    """
+    idf = np.log1p((no_docs - df + 0.5) / (df + 0.5))
+    length_norm = k1 * (1 - b + b * doc_lengths / max(avg_doc_length, 1.0))
+
+    return ((tf * (k1 + 1)) / (tf + length_norm[:, None]) * idf).sum(axis=1)
+
+
+def reciprocal_rank_fusion(rankings: Sequence[np.ndarray], k: int = 60) -> np.ndarray:
+    """
+    Fuses rankings (arrays of candidate indices, best first) over the same candidate pool.
+    Returns fused RRF scores indexed by candidate.
+    """
+    no_candidates = max((int(r.max()) + 1 for r in rankings if len(r) > 0), default=0)
+    scores = np.zeros(no_candidates, dtype=np.float64)
+
+    for ranking in rankings:
+        np.add.at(scores, ranking, 1.0 / (k + np.arange(1, len(ranking) + 1)))
+
+    return scores
+
+
+def simhash(text: str) -> int:
+    """
+    64-bit SimHash over word unigrams and bigrams (returned unsigned).
+    """
+    tokens = lexical_tokenise(text)
+    if len(tokens) == 0:
+        return 0
+
+    features = Counter(tokens + [" ".join(pair) for pair in zip(tokens, tokens[1:])])
+
+    hashes = np.array(
+        [
+            int.from_bytes(blake2b(f.encode(), digest_size=8).digest(), "little")
+            for f in features
+        ],
+        dtype=np.uint64,
+    )
+    weights = np.array(list(features.values()), dtype=np.float64)
+
+    bits = np.unpackbits(
+        hashes.view(np.uint8).reshape(-1, 8), axis=1, bitorder="little"
+    )
+    votes = (np.where(bits, 1.0, -1.0) * weights[:, None]).sum(axis=0)
+
+    return int(np.packbits(votes > 0, bitorder="little").view(np.uint64)[0])
+
+
+def simhash_similarities(signature: int, signatures: np.ndarray) -> np.ndarray:
+    if len(signatures) == 0:
+        return np.zeros(0, dtype=np.float64)
+
+    return 1.0 - np.bitwise_count(signatures ^ np.uint64(signature)) / 64.0
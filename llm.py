@@ -1,71 +1,766 @@
 # from debug import printd
-import re
-from typing import Any, Dict, List, Union, cast
+from dataclasses import dataclass
+from functools import cache
+from threading import Event, Thread
+from time import monotonic
+from typing import Any, Dict, Iterator, List, Optional, Union, cast
 
-import yaml
-from openai import OpenAI
+from openai import OpenAI, Timeout
 from transformers import AutoTokenizer  # type: ignore[attr-defined]
 
-from config import HF_LLM_NAME, HF_TOKEN, LLM_CONFIG, VLM_CONFIG
+from config import (
+    HF_LLM_NAME,
+    HF_TOKEN,
+    LLM_COMPLETION_RESERVE,
+    LLM_CONFIG,
+    LLM_CONNECT_TIMEOUT,
+    LLM_HEDGING,
+    LLM_RATE_LIMIT_MAX_WAIT,
+    LLM_TIMEOUT,
+    REPAIR_CONFIG,
+    VLM_CONFIG,
+)
+from llm_cache import cache_get, cache_put
+from llm_ledger import record_llm_call
+from llm_limiter import RateLimiter
+from llm_router import Candidate, LLMRouter
+from parsing import extract_yaml  # *Re-exported for existing callers
+
+llm_timeout = Timeout(LLM_TIMEOUT, connect=LLM_CONNECT_TIMEOUT)
+
+
+def model_entries(backend: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """
+    Model entries as dicts; backend-level context_window/rpm/tpm/max_concurrency act as defaults.
+    """
+    defaults = {
+        key: backend[key]
+        for key in ("context_window", "rpm", "tpm", "max_concurrency")
+        if key in backend
+    }
+
+    return [
+        {**defaults, "name": model} if isinstance(model, str) else {**defaults, **model}
+        for model in backend["models"]
+    ]
+
 
 llm_backends = [
     (
         backend["name"],
-        OpenAI(base_url=backend["base_url"], api_key=backend["api_key"], max_retries=0),
-        backend["models"],
+        OpenAI(
+            base_url=backend["base_url"],
+            api_key=backend["api_key"],
+            max_retries=0,
+            timeout=llm_timeout,
+        ),
+        model_entries(backend),
     )
     for backend in LLM_CONFIG
 ]
 vlm_backends = [
     (
         backend["name"],
-        OpenAI(base_url=backend["base_url"], api_key=backend["api_key"], max_retries=0),
-        backend["models"],
+        OpenAI(
+            base_url=backend["base_url"],
+            api_key=backend["api_key"],
+            max_retries=0,
+            timeout=llm_timeout,
+        ),
+        model_entries(backend),
     )
     for backend in VLM_CONFIG
 ]
+repair_backends = [
+    (
+        backend["name"],
+        OpenAI(
+            base_url=backend["base_url"],
+            api_key=backend["api_key"],
+            max_retries=0,
+            timeout=llm_timeout,
+        ),
+        model_entries(backend),
+    )
+    for backend in REPAIR_CONFIG
+]
+
+structured_output_backends = {
+    backend["name"] for backend in LLM_CONFIG if backend.get("structured_output")
+}
+
+# *Created at import so the health state is shared with forked agent workers
+llm_router = LLMRouter(llm_backends)
+vlm_router = LLMRouter(vlm_backends)
+repair_router = LLMRouter(repair_backends)
+llm_limiter = RateLimiter(llm_router.candidates)
+vlm_limiter = RateLimiter(vlm_router.candidates)
+repair_limiter = RateLimiter(repair_router.candidates)
+
+
+@dataclass
+class LLMResponse:
+    text: str
+    backend: Optional[str] = None  # *None for cache hits
+    model: Optional[str] = None
+    structured: bool = False  # *Generated under response_format (JSON)
+    usage: Optional[Dict[str, int]] = None
+
 
+def completion_kwargs(
+    candidate: Candidate[OpenAI], response_format: Optional[Dict[str, Any]]
+) -> Dict[str, Any]:
+    # *response_format is only sent to backends flagged with structured_output in backends.yaml
+    if response_format is not None and candidate.name in structured_output_backends:
+        return {"response_format": response_format}
+    return {}
+
+
+def message_text(message: Dict[str, Any]) -> str:
+    if isinstance(message["content"], list):  # *VLM messages: skip image parts
+        return "".join(
+            part.get("text", "") for part in message["content"] if isinstance(part, dict)
+        )
+    return str(message["content"])
+
+
+def estimate_prompt_tokens(
+    messages: List[Dict[str, Any]], prompt_tokens: Optional[int] = None
+) -> int:
+    if prompt_tokens is not None:
+        return prompt_tokens
+    # *Rough chars-per-token ratio; avoids tokenising when no window is declared
+    return sum(len(message_text(message)) for message in messages) // 4
+
+
+def estimate_request_tokens(
+    messages: List[Dict[str, Any]], prompt_tokens: Optional[int] = None
+) -> int:
+    """
+    Tokens to reserve against a tpm limit before the actual usage is known.
+    """
+    return estimate_prompt_tokens(messages, prompt_tokens) + LLM_COMPLETION_RESERVE
+
+
+def call_llm(
+    messages: List[Dict[str, str]],
+    backend_offset: int = 0,
+    hedge: Optional[bool] = None,
+    call_site: str = "other",
+    cache: bool = False,
+    cache_read: bool = True,
+) -> str:
+    """
+    Tries models healthiest first (see LLMRouter).
+    backend_offset rotates comparably healthy models (to spread concurrent calls across backends).
+    hedge overrides LLM_HEDGING for this call.
+    call_site names the caller in the llm_calls ledger and the cache stats.
+    cache opts the call into the response cache (for deterministic inputs); cache_read=False skips the lookup but still stores the new response (e.g. when retrying after a bad cached response).
+    """
+    return call_llm_detailed(
+        messages,
+        backend_offset=backend_offset,
+        hedge=hedge,
+        call_site=call_site,
+        cache=cache,
+        cache_read=cache_read,
+    ).text
+
+
+def call_llm_detailed(
+    messages: List[Dict[str, str]],
+    backend_offset: int = 0,
+    hedge: Optional[bool] = None,
+    call_site: str = "other",
+    cache: bool = False,
+    cache_read: bool = True,
+    response_format: Optional[Dict[str, Any]] = None,
+    prompt_tokens: Optional[int] = None,
+) -> LLMResponse:
+    """
+    Like call_llm, but also reports which backend/model answered.
+    response_format (e.g. a json_schema) is used by backends that support structured output; the others generate free-form text as usual.
+    prompt_tokens (counted here if not given and any model declares a context_window) keeps oversized prompts away from models that cannot fit them.
+    """
+    if cache and cache_read:
+        started_at = monotonic()
+        cached = cache_get(
+            call_site, messages, [c.model for c in llm_router.candidates]
+        )
+        if cached is not None:
+            record_llm_call(
+                call_site, None, None, "cache_hit", latency=monotonic() - started_at
+            )
+            return LLMResponse(cached)
+
+    if prompt_tokens is None and llm_router.context_windows_declared:
+        prompt_tokens = llm_count_prompt_tokens(messages)
+
+    if LLM_HEDGING if hedge is None else hedge:
+        response = call_llm_hedged(
+            messages, backend_offset, response_format, prompt_tokens, call_site
+        )
+    else:
+        response = call_llm_sequential(
+            messages, backend_offset, response_format, prompt_tokens, call_site
+        )
 
-def call_llm(messages: List[Dict[str, str]]) -> str:
+    if cache:
+        cache_put(messages, cast(str, response.model), response.text)
+
+    return response
+
+
+def record_completion(
+    call_site: str,
+    candidate: Candidate[OpenAI],
+    latency: float,
+    completion: Any,
+    messages: List[Dict[str, Any]],
+    prompt_tokens: Optional[int],
+) -> None:
+    # *Backends that do not report usage are estimated
+    if completion.usage:
+        record_llm_call(
+            call_site,
+            candidate.name,
+            candidate.model,
+            "success",
+            latency=latency,
+            prompt_tokens=completion.usage.prompt_tokens,
+            completion_tokens=completion.usage.completion_tokens,
+        )
+    else:
+        record_llm_call(
+            call_site,
+            candidate.name,
+            candidate.model,
+            "success",
+            latency=latency,
+            prompt_tokens=estimate_prompt_tokens(messages, prompt_tokens),
+            completion_tokens=llm_count_tokens(completion.choices[0].message.content),
+            usage_estimated=True,
+        )
+
+
+def call_llm_sequential(
+    messages: List[Dict[str, str]],
+    backend_offset: int = 0,
+    response_format: Optional[Dict[str, Any]] = None,
+    prompt_tokens: Optional[int] = None,
+    call_site: str = "other",
+    router: LLMRouter[OpenAI] = llm_router,
+    limiter: RateLimiter[OpenAI] = llm_limiter,
+) -> LLMResponse:
     errors = []
+    estimated_tokens = estimate_request_tokens(messages, prompt_tokens)
+
+    for candidate in router.order(backend_offset, prompt_tokens):
+        # *Queue briefly for rate limit/concurrency capacity before moving on
+        if not limiter.acquire(candidate, estimated_tokens, LLM_RATE_LIMIT_MAX_WAIT):
+            errors.append(
+                f"backend {candidate.name} model {candidate.model}: rate limited"
+            )
+            record_llm_call(call_site, candidate.name, candidate.model, "rate_limited")
+            continue
+
+        started_at = monotonic()
+        used_tokens = None
+        try:
+            kwargs = completion_kwargs(candidate, response_format)
+            completion = candidate.client.chat.completions.create(
+                model=candidate.model,
+                messages=cast(Any, messages),
+                **kwargs,
+            )
+
+            if completion.usage:
+                used_tokens = completion.usage.total_tokens
+
+            assert completion.choices[0].message.content, "Empty completion from LLM"
+            router.record_success(candidate, monotonic() - started_at)
+            record_completion(
+                call_site,
+                candidate,
+                monotonic() - started_at,
+                completion,
+                messages,
+                prompt_tokens,
+            )
+            return LLMResponse(
+                completion.choices[0].message.content,
+                candidate.name,
+                candidate.model,
+                "response_format" in kwargs,
+                (
+                    {
+                        "prompt_tokens": completion.usage.prompt_tokens,
+                        "completion_tokens": completion.usage.completion_tokens,
+                    }
+                    if completion.usage
+                    else None
+                ),
+            )
+        except Exception as e:
+            router.record_failure(candidate, monotonic() - started_at)
+            record_llm_call(
+                call_site,
+                candidate.name,
+                candidate.model,
+                "error",
+                latency=monotonic() - started_at,
+            )
+            errors.append(f"backend {candidate.name} model {candidate.model}: {e}")
+            print(
+                f"LLM backend {candidate.name} model {candidate.model} failed: {e}",
+                flush=True,
+            )
+        finally:
+            limiter.release(candidate, estimated_tokens, used_tokens)
+
+    raise RuntimeError(f"All LLM models failed:\n" + "\n".join(errors))
 
-    for name, client, models in llm_backends:
-        for model in models:
-            try:
-                completion = client.chat.completions.create(
-                    model=model.strip(),
-                    messages=cast(Any, messages),
-                )
 
-                assert completion.choices[
-                    0
-                ].message.content, "Empty completion from LLM"
-                return completion.choices[0].message.content
-            except Exception as e:
-                errors.append(f"backend {name} model {model}: {e}")
-                print(f"LLM backend {name} model {model} failed: {e}", flush=True)
+def call_repair_llm(messages: List[Dict[str, str]]) -> str:
+    """
+    For short output repair prompts (repair_backends in backends.yaml).
+    """
+    return call_llm_sequential(
+        messages, call_site="repair", router=repair_router, limiter=repair_limiter
+    ).text
+
+
+def call_llm_stream(
+    messages: List[Dict[str, str]],
+    response_format: Optional[Dict[str, Any]] = None,
+    response: Optional[LLMResponse] = None,
+    prompt_tokens: Optional[int] = None,
+    call_site: str = "other",
+) -> Iterator[str]:
+    """
+    Yields completion deltas as they arrive.
+    Fails over to the next model only until the first delta is received; errors after that are raised (the partial output has already been consumed).
+    If response is given, it is filled in with the backend/model that streamed and the full text.
+    """
+    errors = []
+
+    if prompt_tokens is None and llm_router.context_windows_declared:
+        prompt_tokens = llm_count_prompt_tokens(messages)
+
+    estimated_tokens = estimate_request_tokens(messages, prompt_tokens)
+
+    for candidate in llm_router.order(prompt_tokens=prompt_tokens):
+        if not llm_limiter.acquire(
+            candidate, estimated_tokens, LLM_RATE_LIMIT_MAX_WAIT
+        ):
+            errors.append(
+                f"backend {candidate.name} model {candidate.model}: rate limited"
+            )
+            record_llm_call(call_site, candidate.name, candidate.model, "rate_limited")
+            continue
+
+        started_at = monotonic()
+        started = False
+        ttft = None
+        deltas = []
+        try:
+            kwargs = completion_kwargs(candidate, response_format)
+            stream = candidate.client.chat.completions.create(
+                model=candidate.model,
+                messages=cast(Any, messages),
+                stream=True,
+                **kwargs,
+            )
+
+            for chunk in stream:
+                if len(chunk.choices) == 0 or not chunk.choices[0].delta.content:
+                    continue
+
+                if not started:
+                    started = True
+                    ttft = monotonic() - started_at
+                    llm_router.record_first_token(candidate, ttft)
+                    if response is not None:
+                        response.backend = candidate.name
+                        response.model = candidate.model
+                        response.structured = "response_format" in kwargs
+                if response is not None:
+                    response.text += chunk.choices[0].delta.content
+                deltas.append(chunk.choices[0].delta.content)
+                yield chunk.choices[0].delta.content
+
+            assert started, "Empty completion from LLM"
+            llm_router.record_success(candidate, monotonic() - started_at)
+            record_llm_call(
+                call_site,
+                candidate.name,
+                candidate.model,
+                "success",
+                latency=monotonic() - started_at,
+                ttft=ttft,
+                prompt_tokens=estimate_prompt_tokens(messages, prompt_tokens),
+                completion_tokens=llm_count_tokens("".join(deltas)),
+                usage_estimated=True,
+            )
+            return
+        except Exception as e:
+            llm_router.record_failure(candidate, monotonic() - started_at)
+            record_llm_call(
+                call_site,
+                candidate.name,
+                candidate.model,
+                "error",
+                latency=monotonic() - started_at,
+                ttft=ttft,
+            )
+            if started:
+                raise
+            errors.append(f"backend {candidate.name} model {candidate.model}: {e}")
+            print(
+                f"LLM backend {candidate.name} model {candidate.model} failed: {e}",
+                flush=True,
+            )
+        finally:
+            llm_limiter.release(candidate, estimated_tokens)
 
     raise RuntimeError(f"All LLM models failed:\n" + "\n".join(errors))
 
 
-def call_vlm(messages: List[Dict[str, Union[str, Any]]]) -> str:
+class HedgedAttempt:
+    """
+    Streams one completion in a background thread (so it can be raced against a hedge and cancelled).
+    Only that thread touches the stream: cancel just flags the attempt, and the thread closes its stream at the next chunk (or read timeout).
+    """
+
+    def __init__(
+        self,
+        candidate: Candidate[OpenAI],
+        messages: List[Dict[str, str]],
+        changed: Event,
+        call_site: str,
+        prompt_tokens: Optional[int],
+        response_format: Optional[Dict[str, Any]] = None,
+    ) -> None:
+        """
+        The caller must already hold a limiter slot for candidate (for estimate_request_tokens(messages, prompt_tokens); released when the attempt finishes).
+        """
+        self.candidate = candidate
+        self.call_site = call_site
+        self.prompt_tokens = estimate_prompt_tokens(messages, prompt_tokens)
+        self.completion_tokens: Optional[int] = None
+        self.usage_estimated = True
+        self.estimated_tokens = estimate_request_tokens(messages, prompt_tokens)
+        self.kwargs = completion_kwargs(candidate, response_format)
+        self.changed = changed
+        self.text = ""
+        self.first_token = False
+        self.ttft: Optional[float] = None
+        self.done = False
+        self.error: Optional[Exception] = None
+        self.cancelled = False
+        self.stream: Optional[Any] = None
+        self.started_at = monotonic()
+
+        Thread(target=self.run, args=(messages,), daemon=True).start()
+
+    def run(self, messages: List[Dict[str, str]]) -> None:
+        try:
+            self.stream = self.candidate.client.chat.completions.create(
+                model=self.candidate.model,
+                messages=cast(Any, messages),
+                stream=True,
+                **self.kwargs,
+            )
+
+            for chunk in self.stream:
+                if self.cancelled:
+                    break
+                if chunk.usage is not None:  # *Only backends that report usage when streaming
+                    self.prompt_tokens = chunk.usage.prompt_tokens
+                    self.completion_tokens = chunk.usage.completion_tokens
+                    self.usage_estimated = False
+                if len(chunk.choices) == 0 or not chunk.choices[0].delta.content:
+                    continue
+
+                if not self.first_token:
+                    self.first_token = True
+                    self.ttft = monotonic() - self.started_at
+                    llm_router.record_first_token(self.candidate, self.ttft)
+                    self.changed.set()
+                self.text += chunk.choices[0].delta.content
+
+            if not self.cancelled:
+                assert self.text, "Empty completion from LLM"
+                llm_router.record_success(self.candidate, monotonic() - self.started_at)
+        except Exception as e:
+            if not self.cancelled:
+                self.error = e
+                llm_router.record_failure(self.candidate, monotonic() - self.started_at)
+        finally:
+            if self.cancelled and self.stream is not None:
+                self.close()
+            llm_limiter.release(self.candidate, self.estimated_tokens)
+            self.record()
+            self.done = True
+            self.changed.set()
+
+    def record(self) -> None:
+        if self.cancelled:
+            outcome = "cancelled"
+        elif self.error is not None:
+            outcome = "error"
+        else:
+            outcome = "success"
+
+        record_llm_call(
+            self.call_site,
+            self.candidate.name,
+            self.candidate.model,
+            outcome,
+            latency=monotonic() - self.started_at,
+            ttft=self.ttft,
+            prompt_tokens=self.prompt_tokens,
+            completion_tokens=(
+                llm_count_tokens(self.text)
+                if self.completion_tokens is None
+                else self.completion_tokens
+            ),
+            usage_estimated=self.usage_estimated,
+        )
+
+    def close(self) -> None:
+        try:
+            self.stream.close()  # type: ignore[union-attr]
+        except Exception:
+            pass
+
+    def cancel(self) -> None:
+        self.cancelled = True
+
+
+def call_llm_hedged(
+    messages: List[Dict[str, str]],
+    backend_offset: int = 0,
+    response_format: Optional[Dict[str, Any]] = None,
+    prompt_tokens: Optional[int] = None,
+    call_site: str = "other",
+) -> LLMResponse:
+    """
+    Streams from the healthiest model; if no token arrives within its hedge delay (a percentile of recent time-to-first-token), the same request is also sent to the next model.
+    The first to finish wins and the other is cancelled. Failed attempts fail over like call_llm.
+    """
+    candidates = llm_router.order(backend_offset, prompt_tokens)
+    estimated_tokens = estimate_request_tokens(messages, prompt_tokens)
+    changed = Event()
+    attempts: List[HedgedAttempt] = []
     errors = []
+    hedge: Optional[HedgedAttempt] = None
+    call_started_at = monotonic()
+    next_candidate = 0
+
+    llm_router.record_hedged_call()
 
-    for name, client, models in vlm_backends:
-        for model in models:
-            try:
-                completion = client.chat.completions.create(
-                    model=model.strip(),
-                    messages=cast(Any, messages),
+    while True:
+        changed.clear()
+
+        for attempt in attempts:
+            if attempt.done and attempt.error is not None:
+                errors.append(
+                    f"backend {attempt.candidate.name} model {attempt.candidate.model}: {attempt.error}"
+                )
+                print(
+                    f"LLM backend {attempt.candidate.name} model {attempt.candidate.model} failed: {attempt.error}",
+                    flush=True,
                 )
+        attempts = [a for a in attempts if not (a.done and a.error is not None)]
+
+        winner = next((a for a in attempts if a.done), None)
+        if winner is not None:
+            losers = [a for a in attempts if a is not winner]
+            for loser in losers:
+                loser.cancel()
 
-                assert completion.choices[
-                    0
-                ].message.content, "Empty completion from LLM"
-                return completion.choices[0].message.content
-            except Exception as e:
-                errors.append(f"backend {name} model {model}: {e}")
-                print(f"VLM backend {name} model {model} failed: {e}", flush=True)
+            # *Read before the censored samples below raise it
+            loser_expected_latency = (
+                llm_router.expected_latency(losers[0].candidate)
+                if len(losers) > 0
+                else 0.0
+            )
+
+            if winner is hedge:
+                for loser in losers:
+                    llm_router.record_censored_latency(
+                        loser.candidate, monotonic() - loser.started_at
+                    )
+
+            if hedge is not None and len(losers) > 0:
+                # *Estimated: the cancelled primary would have taken at least its usual latency
+                latency_saved = (
+                    max(
+                        0.0,
+                        loser_expected_latency - (monotonic() - call_started_at),
+                    )
+                    if winner is hedge
+                    else 0.0
+                )
+                extra_completion_tokens = sum(
+                    llm_count_tokens(loser.text) for loser in losers
+                )
+                # *Every attempt sends the same prompt: the caller's count, else what the winner reported (or its estimate)
+                extra_prompt_tokens = len(losers) * (
+                    prompt_tokens if prompt_tokens is not None else winner.prompt_tokens
+                )
+
+                llm_router.record_hedge_outcome(
+                    winner is hedge,
+                    latency_saved,
+                    extra_prompt_tokens,
+                    extra_completion_tokens,
+                )
+                print(
+                    f"LLM hedge: {'hedge' if winner is hedge else 'primary'} ({winner.candidate}) won, est. {latency_saved:.2f}s saved, {extra_prompt_tokens} prompt + {extra_completion_tokens} completion tokens extra",
+                    flush=True,
+                )
+
+            return LLMResponse(
+                winner.text,
+                winner.candidate.name,
+                winner.candidate.model,
+                "response_format" in winner.kwargs,
+            )
+
+        if len(attempts) == 0:  # *Nothing in flight: fail over
+            if next_candidate >= len(candidates):
+                break
+            candidate = candidates[next_candidate]
+            next_candidate += 1
+
+            if not llm_limiter.acquire(
+                candidate, estimated_tokens, LLM_RATE_LIMIT_MAX_WAIT
+            ):
+                errors.append(
+                    f"backend {candidate.name} model {candidate.model}: rate limited"
+                )
+                record_llm_call(
+                    call_site, candidate.name, candidate.model, "rate_limited"
+                )
+                continue
+
+            attempts.append(
+                HedgedAttempt(
+                    candidate,
+                    messages,
+                    changed,
+                    call_site,
+                    prompt_tokens,
+                    response_format,
+                )
+            )
+            continue
+
+        timeout = None
+        if (
+            hedge is None
+            and len(attempts) == 1
+            and not attempts[0].first_token
+            and next_candidate < len(candidates)
+        ):
+            primary = attempts[0]
+            timeout = (
+                primary.started_at
+                + llm_router.hedge_delay(primary.candidate)
+                - monotonic()
+            )
+
+            if timeout <= 0:
+                # *Never wait for capacity to hedge: a throttled hedge would not be faster
+                if llm_limiter.try_acquire(candidates[next_candidate], estimated_tokens):
+                    hedge = HedgedAttempt(
+                        candidates[next_candidate],
+                        messages,
+                        changed,
+                        call_site,
+                        prompt_tokens,
+                        response_format,
+                    )
+                    attempts.append(hedge)
+                    next_candidate += 1
+                    llm_router.record_hedge_fired()
+                    continue
+                timeout = None
+
+        changed.wait(timeout)
+
+    raise RuntimeError(f"All LLM models failed:\n" + "\n".join(errors))
+
+
+def call_vlm(
+    messages: List[Dict[str, Union[str, Any]]],
+    call_site: str = "vlm",
+    cache: bool = False,
+    cache_read: bool = True,
+) -> str:
+    """
+    call_site, cache: see call_llm.
+    """
+    if cache and cache_read:
+        started_at = monotonic()
+        cached = cache_get(
+            call_site, messages, [c.model for c in vlm_router.candidates]
+        )
+        if cached is not None:
+            record_llm_call(
+                call_site, None, None, "cache_hit", latency=monotonic() - started_at
+            )
+            return cached
+
+    errors = []
+    estimated_tokens = estimate_request_tokens(messages)
+
+    for candidate in vlm_router.order():
+        if not vlm_limiter.acquire(candidate, estimated_tokens, LLM_RATE_LIMIT_MAX_WAIT):
+            errors.append(
+                f"backend {candidate.name} model {candidate.model}: rate limited"
+            )
+            record_llm_call(call_site, candidate.name, candidate.model, "rate_limited")
+            continue
+
+        started_at = monotonic()
+        used_tokens = None
+        try:
+            completion = candidate.client.chat.completions.create(
+                model=candidate.model,
+                messages=cast(Any, messages),
+            )
+            if completion.usage is not None:
+                used_tokens = completion.usage.total_tokens
+
+            assert completion.choices[0].message.content, "Empty completion from LLM"
+            vlm_router.record_success(candidate, monotonic() - started_at)
+            record_completion(
+                call_site, candidate, monotonic() - started_at, completion, messages, None
+            )
+
+            if cache:
+                cache_put(messages, candidate.model, completion.choices[0].message.content)
+
+            return completion.choices[0].message.content
+        except Exception as e:
+            vlm_router.record_failure(candidate, monotonic() - started_at)
+            record_llm_call(
+                call_site,
+                candidate.name,
+                candidate.model,
+                "error",
+                latency=monotonic() - started_at,
+            )
+            errors.append(f"backend {candidate.name} model {candidate.model}: {e}")
+            print(
+                f"VLM backend {candidate.name} model {candidate.model} failed: {e}",
+                flush=True,
+            )
+        finally:
+            vlm_limiter.release(candidate, estimated_tokens, used_tokens)
 
     raise RuntimeError(f"All VLM models failed:\n" + "\n".join(errors))
 
@@ -84,31 +779,38 @@ def call_vlm(messages: List[Dict[str, Union[str, Any]]]) -> str:
 #     ],
 # },
 
-def extract_yaml(resp: str) -> Dict[str, Any]:
-    matches = list(re.finditer(r"```(?:ya?ml)?\s*([\s\S]*?)```", resp, re.IGNORECASE))
-    if matches:
-        yaml_str = matches[-1].group(1).strip()
-    else:
-        yaml_str = re.sub(r"^<think>.*?</think>", "", resp, flags=re.DOTALL).strip()
-
-    yaml_str_sanitised = re.sub(r"[\ud800-\udfff]", "", yaml_str)
-    data = yaml.safe_load(yaml_str_sanitised)
-
-    # recursively sanitize everything that might contain text after yaml loading
-    def deep_clean(obj):
-        if isinstance(obj, str):
-            return re.sub(r"[\ud800-\udfff]", "", obj)
-        elif isinstance(obj, list):
-            return [deep_clean(i) for i in obj]
-        elif isinstance(obj, dict):
-            return {k: deep_clean(v) for k, v in obj.items()}
-        else:
-            return obj
 
-    return deep_clean(data)
+@cache
+def get_tokeniser() -> Any:
+    return AutoTokenizer.from_pretrained(HF_LLM_NAME, token=HF_TOKEN)  # type: ignore[no-untyped-call]
+
+
+def llm_count_tokens(text: str) -> int:
+    return len(get_tokeniser().encode(text, add_special_tokens=False))
+
+
+def llm_split_tokens(text: str, max_tokens: int) -> List[str]:
+    tokeniser = get_tokeniser()
+    token_ids = tokeniser.encode(text, add_special_tokens=False)
+
+    return [
+        tokeniser.decode(token_ids[i : i + max_tokens])
+        for i in range(0, len(token_ids), max_tokens)
+    ]
+
+
+def llm_count_prompt_tokens(messages: List[Dict[str, str]]) -> Optional[int]:
+    """
+    None if the messages cannot be tokenised with the chat template (pre-flight checks are then skipped).
+    """
+    try:
+        return len(llm_tokenise([dict(message) for message in messages]))
+    except Exception:
+        return None
+
 
 def llm_tokenise(messages: List[Dict[str, str]]) -> Union[List[int], Any]:
-    tokeniser = AutoTokenizer.from_pretrained(HF_LLM_NAME, token=HF_TOKEN)  # type: ignore[no-untyped-call]
+    tokeniser = get_tokeniser()
     assert (
         messages[0]["role"] == "system" and messages[1]["role"] == "user"
     ) or messages[0]["role"] == "user"
@@ -0,0 +1,119 @@
+from hashlib import sha256
+from itertools import count
+from typing import Any, Dict, List, Optional
+
+import orjson
+
+import db
+from config import LLM_CACHE_EVICT_EVERY, LLM_CACHE_MAX_MB, LLM_CACHE_TTL_HOURS
+
+# *Puts in this process; eviction scans the cache, so it runs every LLM_CACHE_EVICT_EVERY puts
+# *(expired entries are never served in between, and the size limit may briefly be exceeded)
+cache_puts = count(1)
+
+
+def messages_hash(messages: List[Dict[str, Any]]) -> str:
+    return sha256(orjson.dumps(messages, option=orjson.OPT_SORT_KEYS)).hexdigest()
+
+
+def cache_get(
+    call_site: str, messages: List[Dict[str, Any]], models: List[str]
+) -> Optional[str]:
+    """
+    Returns a cached response from any of the given models (and records the hit/miss for call_site).
+    Cache errors never fail the LLM call.
+    """
+    try:
+        rows = db.read(
+            """
+            WITH hit AS (
+                UPDATE llm_cache SET hits = hits + 1, last_hit_at = NOW()
+                WHERE (messages_hash, model) = (
+                    SELECT messages_hash, model FROM llm_cache
+                    WHERE messages_hash = %s
+                    AND model = ANY(%s)
+                    AND created_at > NOW() - make_interval(hours => %s)
+                    ORDER BY last_hit_at DESC
+                    LIMIT 1
+                )
+                RETURNING response
+            ), stat AS (
+                INSERT INTO llm_cache_stats (call_site, hits, misses)
+                SELECT %s, COUNT(*), 1 - COUNT(*) FROM hit
+                ON CONFLICT (call_site) DO UPDATE SET
+                    hits = llm_cache_stats.hits + EXCLUDED.hits,
+                    misses = llm_cache_stats.misses + EXCLUDED.misses
+            )
+            SELECT response FROM hit;
+            """,
+            (messages_hash(messages), models, LLM_CACHE_TTL_HOURS, call_site),
+        )
+    except Exception as e:
+        print(f"LLM cache lookup failed: {e}", flush=True)
+        return None
+
+    return rows[0][0] if len(rows) > 0 else None
+
+
+def cache_put(messages: List[Dict[str, Any]], model: str, response: str) -> None:
+    try:
+        db.write(
+            """
+            INSERT INTO llm_cache (messages_hash, model, response, size)
+            VALUES (%s, %s, %s, %s)
+            ON CONFLICT (messages_hash, model) DO UPDATE SET
+                response = EXCLUDED.response,
+                size = EXCLUDED.size,
+                created_at = NOW(),
+                last_hit_at = NOW();
+            """,
+            (
+                messages_hash(messages),
+                model,
+                response,
+                len(response.encode("utf-8", "surrogatepass")),
+            ),
+        )
+
+        if next(cache_puts) % LLM_CACHE_EVICT_EVERY != 0:
+            return
+
+        # *Evict expired entries, then least recently used ones beyond the size limit
+        db.write(
+            """
+            DELETE FROM llm_cache
+            WHERE created_at <= NOW() - make_interval(hours => %s)
+            OR (messages_hash, model) IN (
+                SELECT messages_hash, model FROM (
+                    SELECT messages_hash, model,
+                    SUM(size) OVER (ORDER BY last_hit_at DESC, created_at DESC) AS cumulative_size
+                    FROM llm_cache
+                ) ranked
+                WHERE cumulative_size > %s
+            );
+            """,
+            (LLM_CACHE_TTL_HOURS, int(LLM_CACHE_MAX_MB * 1024 * 1024)),
+        )
+    except Exception as e:
+        print(f"LLM cache insert failed: {e}", flush=True)
+
+
+def cache_stats() -> Dict[str, Any]:
+    no_entries, total_size = db.read(
+        "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM llm_cache;"
+    )[0]
+
+    return {
+        "entries": no_entries,
+        "size_bytes": total_size,
+        "call_sites": {
+            call_site: {
+                "hits": hits,
+                "misses": misses,
+                "hit_rate": hits / (hits + misses) if hits + misses > 0 else None,
+            }
+            for call_site, hits, misses in db.read(
+                "SELECT call_site, hits, misses FROM llm_cache_stats ORDER BY call_site;"
+            )
+        },
+    }
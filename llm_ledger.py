@@ -0,0 +1,188 @@
+import atexit
+import os
+from datetime import datetime
+from threading import Event, Lock, Thread
+from typing import Any, Dict, List, Literal, Optional, Tuple
+
+import db
+from config import LLM_LEDGER_BATCH_SIZE, LLM_LEDGER_FLUSH_SECONDS
+
+Outcome = Literal["success", "error", "rate_limited", "cancelled", "cache_hit"]
+
+# *Per process: agent workers are forked, and each worker runs one agent turn at a time
+current_agent_id: Optional[str] = None
+buffer: List[Tuple[Any, ...]] = []
+buffer_lock = Lock()
+wake = Event()
+flusher: Optional[Thread] = None
+
+
+def reset_after_fork() -> None:
+    # *Rows buffered by the parent are the parent's to write; its flusher thread does not survive the fork
+    global buffer, buffer_lock, wake, flusher
+    buffer = []
+    buffer_lock = Lock()
+    wake = Event()
+    flusher = None
+
+
+os.register_at_fork(after_in_child=reset_after_fork)
+
+
+def set_agent_id(new_agent_id: Optional[str]) -> None:
+    """
+    Attributes subsequent LLM calls in this process to the given agent.
+    """
+    global current_agent_id
+    current_agent_id = new_agent_id
+
+
+def record_llm_call(
+    call_site: str,
+    backend: Optional[str],
+    model: Optional[str],
+    outcome: Outcome,
+    latency: Optional[float] = None,
+    ttft: Optional[float] = None,
+    prompt_tokens: Optional[int] = None,
+    completion_tokens: Optional[int] = None,
+    usage_estimated: bool = False,
+) -> None:
+    """
+    Buffers one backend attempt; rows are written in batches by a background thread (call flush_llm_calls before a worker exits).
+    """
+    global flusher
+
+    with buffer_lock:
+        buffer.append(
+            (
+                current_agent_id,
+                call_site,
+                backend,
+                model,
+                outcome,
+                prompt_tokens,
+                completion_tokens,
+                usage_estimated,
+                latency,
+                ttft,
+                datetime.now(),
+            )
+        )
+        full = len(buffer) >= LLM_LEDGER_BATCH_SIZE
+
+        if flusher is None:
+            flusher = Thread(target=flush_periodically, daemon=True)
+            flusher.start()
+
+    if full:
+        wake.set()
+
+
+def flush_periodically() -> None:
+    while True:
+        wake.wait(LLM_LEDGER_FLUSH_SECONDS)
+        wake.clear()
+        flush_llm_calls()
+
+
+def flush_llm_calls() -> None:
+    global buffer
+
+    with buffer_lock:
+        rows, buffer = buffer, []
+
+    if len(rows) == 0:
+        return
+
+    try:
+        db.write_many(
+            """
+            INSERT INTO llm_calls (agent_id, call_site, backend, model, outcome, prompt_tokens, completion_tokens, usage_estimated, latency, ttft, created_at)
+            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s);
+            """,
+            rows,
+        )
+    except Exception as e:  # *Dropped rather than retried so a DB outage cannot grow the buffer without bound
+        print(f"Writing {len(rows)} LLM ledger rows failed: {e}", flush=True)
+
+
+atexit.register(flush_llm_calls)
+
+
+def usage_per_agent(agent_id: str) -> List[Dict[str, Any]]:
+    return [
+        {
+            "call_site": call_site,
+            "calls": calls,
+            "successes": successes,
+            "failures": failures,
+            "cache_hits": cache_hits,
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_latency": total_latency,
+            "first_call_at": first_call_at,
+            "last_call_at": last_call_at,
+        }
+        for (
+            call_site,
+            calls,
+            successes,
+            failures,
+            cache_hits,
+            prompt_tokens,
+            completion_tokens,
+            total_latency,
+            first_call_at,
+            last_call_at,
+        ) in db.read(
+            """
+            SELECT call_site, calls, successes, failures, cache_hits, prompt_tokens, completion_tokens, total_latency, first_call_at, last_call_at
+            FROM llm_usage_per_agent
+            WHERE agent_id = %s
+            ORDER BY call_site;
+            """,
+            (agent_id,),
+        )
+    ]
+
+
+def usage_per_backend() -> List[Dict[str, Any]]:
+    return [
+        {
+            "backend": backend,
+            "model": model,
+            "calls": calls,
+            "successes": successes,
+            "errors": errors,
+            "rate_limited": rate_limited,
+            "cancelled": cancelled,
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "tokens_last_hour": tokens_last_hour,
+            "latency_p50": latency_p50,
+            "latency_p95": latency_p95,
+            "ttft_p50": ttft_p50,
+        }
+        for (
+            backend,
+            model,
+            calls,
+            successes,
+            errors,
+            rate_limited,
+            cancelled,
+            prompt_tokens,
+            completion_tokens,
+            tokens_last_hour,
+            latency_p50,
+            latency_p95,
+            ttft_p50,
+        ) in db.read(
+            """
+            SELECT backend, model, calls, successes, errors, rate_limited, cancelled, prompt_tokens, completion_tokens, tokens_last_hour, latency_p50, latency_p95, ttft_p50
+            FROM llm_usage_per_backend
+            ORDER BY backend, model;
+            """
+        )
+    ]
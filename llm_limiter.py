@@ -0,0 +1,219 @@
+import os
+from ctypes import c_double, c_long
+from multiprocessing import Array
+from time import monotonic, sleep, time
+from typing import Any, Dict, Generic, List, Optional
+
+from llm_router import Candidate, ClientT
+
+# *Per-model limiter slot layout (shared across forked agent workers)
+REQUEST_BUCKET = 0
+TOKEN_BUCKET = 1
+LAST_REFILL = 2  # wall clock, so it is comparable across processes
+NO_THROTTLED = 3
+THROTTLED_SECONDS = 4
+NO_REJECTED = 5
+NO_FIELDS = 6
+
+MAX_LEASES = 64  # *Upper bound on max_concurrency per model
+POLL_INTERVAL = 0.05
+
+
+def pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class RateLimiter(Generic[ClientT]):
+    """
+    Token buckets for requests and tokens per minute, plus a concurrency cap, per (backend, model).
+    State lives in shared memory (create before forking); concurrency leases are tagged with the holder's PID so that leases of crashed workers are reclaimed.
+    Limits come from backends.yaml (rpm, tpm, max_concurrency on a backend or model entry); unset limits are not enforced.
+    """
+
+    def __init__(self, candidates: List[Candidate[ClientT]]) -> None:
+        self.candidates = candidates
+        no_slots = max(len(candidates), 1)
+
+        self.state = Array(c_double, no_slots * NO_FIELDS)
+        self.leases = Array(c_long, no_slots * MAX_LEASES, lock=False)  # *Guarded by the state lock
+
+        now = time()
+        for candidate in candidates:
+            self.set_field(candidate.slot, REQUEST_BUCKET, candidate.limits.get("rpm") or 0)
+            self.set_field(candidate.slot, TOKEN_BUCKET, candidate.limits.get("tpm") or 0)
+            self.set_field(candidate.slot, LAST_REFILL, now)
+
+    def field(self, slot: int, field: int) -> float:
+        return self.state[slot * NO_FIELDS + field]
+
+    def set_field(self, slot: int, field: int, value: float) -> None:
+        self.state[slot * NO_FIELDS + field] = value
+
+    def refill(self, candidate: Candidate[ClientT], now: float) -> None:
+        # *Caller holds the state lock
+        slot = candidate.slot
+        elapsed = max(now - self.field(slot, LAST_REFILL), 0)
+        self.set_field(slot, LAST_REFILL, now)
+
+        if rpm := candidate.limits.get("rpm"):
+            self.set_field(
+                slot,
+                REQUEST_BUCKET,
+                min(self.field(slot, REQUEST_BUCKET) + elapsed * rpm / 60, rpm),
+            )
+        if tpm := candidate.limits.get("tpm"):
+            self.set_field(
+                slot,
+                TOKEN_BUCKET,
+                min(self.field(slot, TOKEN_BUCKET) + elapsed * tpm / 60, tpm),
+            )
+
+    def active_leases(self, slot: int) -> List[int]:
+        # *Caller holds the state lock; reclaims leases of dead processes
+        active = []
+        for i in range(slot * MAX_LEASES, (slot + 1) * MAX_LEASES):
+            pid = self.leases[i]
+            if pid == 0:
+                continue
+            if not pid_alive(pid):
+                self.leases[i] = 0
+                continue
+            active.append(i)
+        return active
+
+    def try_acquire(self, candidate: Candidate[ClientT], tokens: int) -> bool:
+        slot = candidate.slot
+        rpm = candidate.limits.get("rpm")
+        tpm = candidate.limits.get("tpm")
+        max_concurrency = candidate.limits.get("max_concurrency")
+
+        with self.state.get_lock():
+            self.refill(candidate, time())
+
+            if rpm and self.field(slot, REQUEST_BUCKET) < 1:
+                return False
+            # *Requests larger than the whole bucket only need a full bucket
+            if tpm and self.field(slot, TOKEN_BUCKET) < min(tokens, tpm):
+                return False
+
+            if max_concurrency:
+                if len(self.active_leases(slot)) >= min(max_concurrency, MAX_LEASES):
+                    return False
+                free_lease = next(
+                    i
+                    for i in range(slot * MAX_LEASES, (slot + 1) * MAX_LEASES)
+                    if self.leases[i] == 0
+                )
+                self.leases[free_lease] = os.getpid()
+
+            if rpm:
+                self.set_field(slot, REQUEST_BUCKET, self.field(slot, REQUEST_BUCKET) - 1)
+            if tpm:
+                self.set_field(slot, TOKEN_BUCKET, self.field(slot, TOKEN_BUCKET) - tokens)
+
+        return True
+
+    def acquire(self, candidate: Candidate[ClientT], tokens: int, max_wait: float) -> bool:
+        """
+        Waits up to max_wait seconds for capacity. Returns False if there is still none (the caller should move on to another model).
+        """
+        if not candidate.limits:
+            return True
+
+        started_at = monotonic()
+        throttled = False
+
+        while not self.try_acquire(candidate, tokens):
+            throttled = True
+            if monotonic() - started_at >= max_wait:
+                with self.state.get_lock():
+                    self.set_field(
+                        candidate.slot,
+                        NO_REJECTED,
+                        self.field(candidate.slot, NO_REJECTED) + 1,
+                    )
+                    self.set_field(
+                        candidate.slot,
+                        THROTTLED_SECONDS,
+                        self.field(candidate.slot, THROTTLED_SECONDS)
+                        + monotonic()
+                        - started_at,
+                    )
+                return False
+            sleep(POLL_INTERVAL)
+
+        if throttled:
+            with self.state.get_lock():
+                self.set_field(
+                    candidate.slot,
+                    NO_THROTTLED,
+                    self.field(candidate.slot, NO_THROTTLED) + 1,
+                )
+                self.set_field(
+                    candidate.slot,
+                    THROTTLED_SECONDS,
+                    self.field(candidate.slot, THROTTLED_SECONDS)
+                    + monotonic()
+                    - started_at,
+                )
+
+        return True
+
+    def release(
+        self,
+        candidate: Candidate[ClientT],
+        estimated_tokens: int,
+        used_tokens: Optional[int] = None,
+    ) -> None:
+        """
+        Frees the concurrency lease and corrects the token bucket once actual usage is known.
+        """
+        if not candidate.limits:
+            return
+
+        slot = candidate.slot
+
+        with self.state.get_lock():
+            if candidate.limits.get("max_concurrency"):
+                own_lease = next(
+                    (
+                        i
+                        for i in range(slot * MAX_LEASES, (slot + 1) * MAX_LEASES)
+                        if self.leases[i] == os.getpid()
+                    ),
+                    None,
+                )
+                if own_lease is not None:
+                    self.leases[own_lease] = 0
+
+            if (tpm := candidate.limits.get("tpm")) and used_tokens is not None:
+                self.set_field(
+                    slot,
+                    TOKEN_BUCKET,
+                    min(
+                        self.field(slot, TOKEN_BUCKET) + estimated_tokens - used_tokens,
+                        tpm,
+                    ),
+                )
+
+    def stats(self) -> List[Dict[str, Any]]:
+        with self.state.get_lock():
+            return [
+                {
+                    "backend": candidate.name,
+                    "model": candidate.model,
+                    "limits": candidate.limits,
+                    "in_flight": len(self.active_leases(candidate.slot)),
+                    "no_throttled": int(self.field(candidate.slot, NO_THROTTLED)),
+                    "no_rejected": int(self.field(candidate.slot, NO_REJECTED)),
+                    "throttled_seconds": self.field(candidate.slot, THROTTLED_SECONDS),
+                }
+                for candidate in self.candidates
+                if candidate.limits
+            ]
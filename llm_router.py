@@ -0,0 +1,377 @@
+from ctypes import c_double
+from multiprocessing import Array
+from time import time
+from typing import Any, Dict, Generic, List, Optional, Tuple, TypeVar, Union, cast
+
+import numpy as np
+
+from config import (
+    LLM_CIRCUIT_COOLDOWN,
+    LLM_CIRCUIT_FAILURES,
+    LLM_CIRCUIT_MAX_COOLDOWN,
+    LLM_COMPLETION_RESERVE,
+    LLM_EWMA_ALPHA,
+    LLM_HEDGE_DEFAULT_DELAY,
+    LLM_HEDGE_MIN_SAMPLES,
+    LLM_HEDGE_PERCENTILE,
+    LLM_TIMEOUT,
+)
+
+ClientT = TypeVar("ClientT")
+
+# *Per-model health slot layout (shared across forked agent workers)
+LATENCY = 0  # EWMA latency in seconds (0 = no observations yet)
+ERROR_RATE = 1  # EWMA of failures (0-1)
+CONSECUTIVE_FAILURES = 2
+STATE = 3
+OPENED_AT = 4  # wall clock, so it is comparable across processes
+COOLDOWN = 5
+PROBE_STARTED_AT = 6
+NO_CALLS = 7
+NO_FAILURES = 8
+NO_TTFT_SAMPLES = 9
+NO_FIELDS = 10
+
+TTFT_WINDOW = 64  # *Recent time-to-first-token samples kept per model
+
+# *Hedging counters
+HEDGED_CALLS = 0
+HEDGES_FIRED = 1
+HEDGE_WINS = 2
+LATENCY_SAVED = 3  # estimated, in seconds
+EXTRA_PROMPT_TOKENS = 4
+EXTRA_COMPLETION_TOKENS = 5
+NO_HEDGING_FIELDS = 6
+
+CLOSED = 0.0
+OPEN = 1.0
+HALF_OPEN = 2.0
+
+STATE_NAMES = {CLOSED: "closed", OPEN: "open", HALF_OPEN: "half_open"}
+
+LIMIT_KEYS = ("rpm", "tpm", "max_concurrency")
+
+
+class ContextWindowExceeded(ValueError):
+    pass
+
+
+class Candidate(Generic[ClientT]):
+    def __init__(
+        self,
+        slot: int,
+        name: str,
+        client: ClientT,
+        model: str,
+        context_window: Optional[int] = None,
+        limits: Optional[Dict[str, int]] = None,
+    ) -> None:
+        self.slot = slot
+        self.name = name
+        self.client = client
+        self.model = model
+        self.context_window = context_window  # *None = not declared (assumed to fit)
+        self.limits = limits or {}  # *rpm, tpm, max_concurrency (see RateLimiter)
+
+    def fits(self, prompt_tokens: Optional[int]) -> bool:
+        return (
+            prompt_tokens is None
+            or self.context_window is None
+            or prompt_tokens + LLM_COMPLETION_RESERVE <= self.context_window
+        )
+
+    def __repr__(self) -> str:
+        return f"{self.name}/{self.model}"
+
+
+class LLMRouter(Generic[ClientT]):
+    """
+    Orders (backend, model) pairs by observed health.
+    Tracks EWMA latency, EWMA error rate and a circuit breaker per model in shared memory, so that every forked agent worker sees the same state.
+    Must be created before the workers are forked.
+    """
+
+    def __init__(
+        self, backends: List[Tuple[str, ClientT, List[Union[str, Dict[str, Any]]]]]
+    ) -> None:
+        """
+        Model entries are either names or {name, context_window, rpm, tpm, max_concurrency} dicts.
+        """
+        self.candidates: List[Candidate[ClientT]] = [
+            (
+                Candidate(slot, name, client, model.strip())
+                if isinstance(model, str)
+                else Candidate(
+                    slot,
+                    name,
+                    client,
+                    str(model["name"]).strip(),
+                    model.get("context_window"),
+                    {key: model[key] for key in LIMIT_KEYS if model.get(key)},
+                )
+            )
+            for slot, (name, client, model) in enumerate(
+                (name, client, model)
+                for name, client, models in backends
+                for model in models
+            )
+        ]
+        self.context_windows_declared = any(
+            c.context_window is not None for c in self.candidates
+        )
+        self.health = Array(c_double, max(len(self.candidates), 1) * NO_FIELDS)
+        self.ttft_samples = Array(
+            c_double, max(len(self.candidates), 1) * TTFT_WINDOW, lock=False
+        )  # *Guarded by the health lock
+        self.hedging = Array(c_double, NO_HEDGING_FIELDS)
+
+    def field(self, slot: int, field: int) -> float:
+        return self.health[slot * NO_FIELDS + field]
+
+    def set_field(self, slot: int, field: int, value: float) -> None:
+        self.health[slot * NO_FIELDS + field] = value
+
+    def score(self, slot: int) -> Tuple[float, float]:
+        """
+        Error rate first (rounded to 0.1 so that noise does not reorder healthy models), then latency: a backend that fails fast (refused, 401, 429) must not rank as fast.
+        Unobserved models score (0, 0) so they get tried (and measured) early.
+        """
+        return (round(self.field(slot, ERROR_RATE), 1), self.field(slot, LATENCY))
+
+    def max_context_window(self) -> Optional[int]:
+        """
+        Largest declared context window (None if any model is undeclared, i.e. unbounded).
+        """
+        if any(c.context_window is None for c in self.candidates):
+            return None
+        return max((cast(int, c.context_window) for c in self.candidates), default=None)
+
+    def order(
+        self, offset: int = 0, prompt_tokens: Optional[int] = None
+    ) -> List[Candidate[ClientT]]:
+        """
+        Returns the candidates to try, healthiest first.
+        Models whose declared context window cannot fit prompt_tokens (plus LLM_COMPLETION_RESERVE) are left out; ContextWindowExceeded is raised if none can.
+        Open circuits are skipped until their cooldown passes; the first caller after that claims a single half-open probe.
+        offset rotates candidates whose scores are comparable to the best one (to spread concurrent calls).
+        """
+        fitting_candidates = [c for c in self.candidates if c.fits(prompt_tokens)]
+        if len(fitting_candidates) == 0 and len(self.candidates) > 0:
+            raise ContextWindowExceeded(
+                f"Prompt ({prompt_tokens} tokens + {LLM_COMPLETION_RESERVE} reserved for the completion) exceeds the context window of every model (largest: {self.max_context_window()})"
+            )
+
+        now = time()
+        available = []
+        skipped = []
+
+        with self.health.get_lock():
+            for candidate in fitting_candidates:
+                slot = candidate.slot
+                state = self.field(slot, STATE)
+
+                if state == OPEN and now - self.field(
+                    slot, OPENED_AT
+                ) >= self.field(slot, COOLDOWN):
+                    self.set_field(slot, STATE, HALF_OPEN)
+                    self.set_field(slot, PROBE_STARTED_AT, now)
+                    available.append(candidate)
+                elif state == HALF_OPEN and now - self.field(
+                    slot, PROBE_STARTED_AT
+                ) >= LLM_TIMEOUT:  # *Probe holder died or hung, reclaim
+                    self.set_field(slot, PROBE_STARTED_AT, now)
+                    available.append(candidate)
+                elif state == CLOSED:
+                    available.append(candidate)
+                else:
+                    skipped.append(candidate)
+
+            available.sort(key=lambda c: self.score(c.slot))
+
+            if len(available) > 1 and offset:
+                best_error_rate, best_latency = self.score(available[0].slot)
+                comparable = [
+                    c
+                    for c in available
+                    if self.score(c.slot)[0] == best_error_rate
+                    and self.score(c.slot)[1] <= best_latency * 1.5
+                ]
+                if len(comparable) > 1:
+                    offset %= len(comparable)
+                    available = (
+                        comparable[offset:]
+                        + comparable[:offset]
+                        + available[len(comparable) :]
+                    )
+
+        # *Every circuit open: try them anyway (oldest failure first) rather than fail outright
+        if len(available) == 0:
+            skipped.sort(key=lambda c: self.field(c.slot, OPENED_AT))
+            return skipped
+
+        return available
+
+    def record_success(self, candidate: Candidate[ClientT], latency: float) -> None:
+        slot = candidate.slot
+
+        with self.health.get_lock():
+            previous_latency = self.field(slot, LATENCY)
+            self.set_field(
+                slot,
+                LATENCY,
+                (
+                    latency
+                    if previous_latency == 0
+                    else LLM_EWMA_ALPHA * latency
+                    + (1 - LLM_EWMA_ALPHA) * previous_latency
+                ),
+            )
+            self.set_field(
+                slot,
+                ERROR_RATE,
+                (1 - LLM_EWMA_ALPHA) * self.field(slot, ERROR_RATE),
+            )
+            self.set_field(slot, CONSECUTIVE_FAILURES, 0)
+            self.set_field(slot, STATE, CLOSED)
+            self.set_field(slot, COOLDOWN, 0)
+            self.set_field(slot, NO_CALLS, self.field(slot, NO_CALLS) + 1)
+
+    def record_failure(self, candidate: Candidate[ClientT], latency: float) -> None:
+        slot = candidate.slot
+
+        with self.health.get_lock():
+            # *Failures count towards latency as well (a timeout is as slow as it gets)
+            previous_latency = self.field(slot, LATENCY)
+            self.set_field(
+                slot,
+                LATENCY,
+                max(
+                    previous_latency,
+                    LLM_EWMA_ALPHA * latency + (1 - LLM_EWMA_ALPHA) * previous_latency,
+                ),
+            )
+            self.set_field(
+                slot,
+                ERROR_RATE,
+                LLM_EWMA_ALPHA + (1 - LLM_EWMA_ALPHA) * self.field(slot, ERROR_RATE),
+            )
+            consecutive_failures = self.field(slot, CONSECUTIVE_FAILURES) + 1
+            self.set_field(slot, CONSECUTIVE_FAILURES, consecutive_failures)
+            self.set_field(slot, NO_CALLS, self.field(slot, NO_CALLS) + 1)
+            self.set_field(slot, NO_FAILURES, self.field(slot, NO_FAILURES) + 1)
+
+            state = self.field(slot, STATE)
+            if state == HALF_OPEN:  # *Probe failed, back off further
+                self.set_field(slot, STATE, OPEN)
+                self.set_field(slot, OPENED_AT, time())
+                self.set_field(
+                    slot,
+                    COOLDOWN,
+                    min(self.field(slot, COOLDOWN) * 2, LLM_CIRCUIT_MAX_COOLDOWN),
+                )
+            elif state == CLOSED and consecutive_failures >= LLM_CIRCUIT_FAILURES:
+                self.set_field(slot, STATE, OPEN)
+                self.set_field(slot, OPENED_AT, time())
+                self.set_field(slot, COOLDOWN, LLM_CIRCUIT_COOLDOWN)
+
+    def record_censored_latency(
+        self, candidate: Candidate[ClientT], latency: float
+    ) -> None:
+        """
+        For requests cancelled before finishing (e.g. a hedged primary that lost): the true latency is at least this.
+        """
+        slot = candidate.slot
+
+        with self.health.get_lock():
+            previous_latency = self.field(slot, LATENCY)
+            if latency > previous_latency:
+                self.set_field(
+                    slot,
+                    LATENCY,
+                    LLM_EWMA_ALPHA * latency + (1 - LLM_EWMA_ALPHA) * previous_latency,
+                )
+
+    def record_first_token(self, candidate: Candidate[ClientT], ttft: float) -> None:
+        slot = candidate.slot
+
+        with self.health.get_lock():
+            no_samples = int(self.field(slot, NO_TTFT_SAMPLES))
+            self.ttft_samples[slot * TTFT_WINDOW + no_samples % TTFT_WINDOW] = ttft
+            self.set_field(slot, NO_TTFT_SAMPLES, no_samples + 1)
+
+    def ttft_samples_of(self, slot: int) -> np.ndarray:
+        # *Caller holds the health lock
+        no_samples = min(int(self.field(slot, NO_TTFT_SAMPLES)), TTFT_WINDOW)
+        return np.array(
+            self.ttft_samples[slot * TTFT_WINDOW : slot * TTFT_WINDOW + no_samples]
+        )
+
+    def hedge_delay(self, candidate: Candidate[ClientT]) -> float:
+        """
+        How long to wait for the first token before hedging (LLM_HEDGE_PERCENTILE of recent time-to-first-token samples).
+        """
+        slot = candidate.slot
+
+        with self.health.get_lock():
+            samples = self.ttft_samples_of(slot)
+
+        if len(samples) < LLM_HEDGE_MIN_SAMPLES:
+            return LLM_HEDGE_DEFAULT_DELAY
+
+        return float(np.percentile(samples, LLM_HEDGE_PERCENTILE))
+
+    def expected_latency(self, candidate: Candidate[ClientT]) -> float:
+        return self.field(candidate.slot, LATENCY)
+
+    def record_hedged_call(self) -> None:
+        with self.hedging.get_lock():
+            self.hedging[HEDGED_CALLS] += 1
+
+    def record_hedge_fired(self) -> None:
+        with self.hedging.get_lock():
+            self.hedging[HEDGES_FIRED] += 1
+
+    def record_hedge_outcome(
+        self,
+        won: bool,
+        latency_saved: float,
+        extra_prompt_tokens: int,
+        extra_completion_tokens: int,
+    ) -> None:
+        with self.hedging.get_lock():
+            self.hedging[HEDGE_WINS] += 1 if won else 0
+            self.hedging[LATENCY_SAVED] += latency_saved
+            self.hedging[EXTRA_PROMPT_TOKENS] += extra_prompt_tokens
+            self.hedging[EXTRA_COMPLETION_TOKENS] += extra_completion_tokens
+
+    def hedging_stats(self) -> Dict[str, Any]:
+        with self.hedging.get_lock():
+            return {
+                "hedged_calls": int(self.hedging[HEDGED_CALLS]),
+                "hedges_fired": int(self.hedging[HEDGES_FIRED]),
+                "hedge_wins": int(self.hedging[HEDGE_WINS]),
+                "estimated_latency_saved": self.hedging[LATENCY_SAVED],
+                "extra_prompt_tokens": int(self.hedging[EXTRA_PROMPT_TOKENS]),
+                "extra_completion_tokens": int(self.hedging[EXTRA_COMPLETION_TOKENS]),
+            }
+
+    def stats(self) -> List[Dict[str, Any]]:
+        with self.health.get_lock():
+            return [
+                {
+                    "backend": candidate.name,
+                    "model": candidate.model,
+                    "context_window": candidate.context_window,
+                    "state": STATE_NAMES[self.field(candidate.slot, STATE)],
+                    "latency_ewma": self.field(candidate.slot, LATENCY),
+                    "error_rate_ewma": self.field(candidate.slot, ERROR_RATE),
+                    "ttft_p50": (
+                        float(np.median(samples))
+                        if len(samples := self.ttft_samples_of(candidate.slot)) > 0
+                        else None
+                    ),
+                    "no_calls": int(self.field(candidate.slot, NO_CALLS)),
+                    "no_failures": int(self.field(candidate.slot, NO_FAILURES)),
+                }
+                for candidate in self.candidates
+            ]
@@ -0,0 +1,66 @@
+from typing import Any, Dict, List, Literal, Optional
+
+import db
+from llm import LLMResponse
+
+
+def record_parse_result(
+    response: LLMResponse,
+    success: bool,
+    repair: Optional[Literal["deterministic", "llm"]] = None,
+) -> None:
+    """
+    Counts agent output parse/validation results per backend, model and output mode (structured vs free-form YAML).
+    repair records how a failed output was salvaged (if it was).
+    """
+    if response.backend is None:
+        return
+
+    try:
+        db.write(
+            """
+            INSERT INTO llm_parse_stats (backend, model, structured, attempts, failures, deterministic_repairs, llm_repairs)
+            VALUES (%s, %s, %s, 1, %s, %s, %s)
+            ON CONFLICT (backend, model, structured) DO UPDATE SET
+                attempts = llm_parse_stats.attempts + 1,
+                failures = llm_parse_stats.failures + EXCLUDED.failures,
+                deterministic_repairs = llm_parse_stats.deterministic_repairs + EXCLUDED.deterministic_repairs,
+                llm_repairs = llm_parse_stats.llm_repairs + EXCLUDED.llm_repairs;
+            """,
+            (
+                response.backend,
+                response.model,
+                response.structured,
+                0 if success else 1,
+                1 if repair == "deterministic" else 0,
+                1 if repair == "llm" else 0,
+            ),
+        )
+    except Exception as e:
+        print(f"Recording parse result failed: {e}", flush=True)
+
+
+def parse_stats() -> List[Dict[str, Any]]:
+    return [
+        {
+            "backend": backend,
+            "model": model,
+            "structured": structured,
+            "attempts": attempts,
+            "failures": failures,
+            "failure_rate": failures / attempts if attempts > 0 else None,
+            "deterministic_repairs": deterministic_repairs,
+            "llm_repairs": llm_repairs,
+        }
+        for (
+            backend,
+            model,
+            structured,
+            attempts,
+            failures,
+            deterministic_repairs,
+            llm_repairs,
+        ) in db.read(
+            "SELECT backend, model, structured, attempts, failures, deterministic_repairs, llm_repairs FROM llm_parse_stats ORDER BY backend, model, structured;"
+        )
+    ]
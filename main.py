@@ -23,6 +23,11 @@ from starlette.websockets import WebSocketDisconnect, WebSocketState
 import agent
 import db
 import doc_upload
+import function_sets
+import llm
+import llm_cache
+import llm_ledger
+import llm_stats
 import persona_gen
 from communication import (
     AgentToParentMessage,
@@ -68,11 +73,43 @@ def list_optional_function_sets():
     return agent.list_optional_function_sets()
 
 
+@app.get("/api/llm-backends")
+def get_llm_backend_health():
+    return {
+        "llm": llm.llm_router.stats(),
+        "vlm": llm.vlm_router.stats(),
+        "hedging": llm.llm_router.hedging_stats(),
+        "limits": {
+            "llm": llm.llm_limiter.stats(),
+            "vlm": llm.vlm_limiter.stats(),
+            "repair": llm.repair_limiter.stats(),
+        },
+        "cache": llm_cache.cache_stats(),
+        "parse": llm_stats.parse_stats(),
+        "usage": llm_ledger.usage_per_backend(),
+    }
+
+
+@app.get("/api/agent-workers")
+def get_agent_worker_pool_stats():
+    return agent.agent_worker_pool.stats()
+
+
 @app.get("/api/agents")  # TODO: return json obj instead
 def get_agents():
     return agent.get_agents()
 
 
+@app.get("/api/agents/{agent_id}/llm-usage")
+def get_agent_llm_usage(agent_id: str):
+    return llm_ledger.usage_per_agent(agent_id)
+
+
+@app.get("/api/agents/{agent_id}/function-schemas")
+def get_agent_function_schemas(agent_id: str):
+    return function_sets.FunctionSets(agent_id=agent_id).schema_stats()
+
+
 @app.delete("/api/agents/{agent_id}")
 async def delete_agent(agent_id: str):
     async with agent_semaphores[agent_id]:
@@ -138,8 +175,16 @@ async def heartbeat_query(agent_id: str):
             ),
         )
 
-        for _ in agent.call_agent(agent_id, False):
-            await asyncio.sleep(0.01)
+        async with agent.call_agent(agent_id, False) as agent_turn:
+            async for _ in agent_turn:
+                pass
+
+
+async def forward_commands(
+    agent_turn: agent.AgentTurn, command_queue: asyncio.Queue[str]
+) -> None:
+    while True:
+        agent_turn.send(await command_queue.get())
 
 
 @app.websocket("/api/agents/{agent_id}/chat")
@@ -259,10 +304,12 @@ async def chat(agent_id: str, websocket: WebSocket):
                                         processed_file_text = doc_upload.process_file(
                                             file_bytes, content_type
                                         )
-                                        memory.archival_storage.archival_insert(
-                                            processed_file_text, current_filename
+                                        no_inserted, no_deduplicated = (
+                                            memory.archival_storage.archival_insert(
+                                                processed_file_text, current_filename
+                                            )
                                         )
-                                        system_msg = f"File {current_filename} has been uploaded by the user into your Archival Storage. You should explore this file to better answer relevant user queries."
+                                        system_msg = f"File {current_filename} has been uploaded by the user into your Archival Storage ({no_inserted} chunk(s) inserted, {no_deduplicated} near-duplicate chunk(s) skipped). You should explore this file to better answer relevant user queries."
                                         await user_or_system_message_queue.put(
                                             UserOrSystemMessage(
                                                 message_type="system",
@@ -346,27 +393,18 @@ async def chat(agent_id: str, websocket: WebSocket):
                     break
 
                 send_message(agent_id, True, user_or_system_message)
-                agent_gen = agent.call_agent(agent_id, True)
-                just_started = True
-
-                while True:  # *Single agent heartbeat loop
-                    try:
-                        if just_started or command_queue.empty():
-                            atpm = next(agent_gen)
-                            just_started = False
-                        else:
-                            received_command = await command_queue.get()
-                            atpm = agent_gen.send(received_command)
-
-                        # print(f"Got atpm {atpm}", flush=True)
-                        if atpm:
+                async with agent.call_agent(agent_id, True) as agent_turn:
+                    forward_commands_task = asyncio.create_task(
+                        forward_commands(agent_turn, command_queue)
+                    )
+                    try:  # *Single agent heartbeat loop
+                        async for atpm in agent_turn:
+                            # print(f"Got atpm {atpm}", flush=True)
                             await websocket.send_text(atpm.model_dump_json())
-
-                        await asyncio.sleep(0.01)
-                    except StopIteration:
-                        break
                     except WebSocketDisconnect:
-                        break
+                        pass
+                    finally:
+                        forward_commands_task.cancel()
 
                 while not command_queue.empty():
                     _ = command_queue.get_nowait()
@@ -410,8 +448,9 @@ async def chat(agent_id: str, websocket: WebSocket):
                 ),
             )
 
-            for _ in agent.call_agent(agent_id, False):
-                await asyncio.sleep(0.01)
+            async with agent.call_agent(agent_id, False) as agent_turn:
+                async for _ in agent_turn:
+                    pass
 
             print("Setting heartbeat job...", flush=True)
             scheduler.add_job(
@@ -487,7 +526,7 @@ def chat_page(agent_id: str, request: Request):
     )
 
 
-# * Scheduler start/stop
+# * Scheduler and agent worker pool start/stop
 
 
 @app.on_event("startup")
@@ -495,6 +534,16 @@ async def start_scheduler():
     scheduler.start()
 
 
+@app.on_event("startup")
+async def start_agent_worker_pool():
+    agent.agent_worker_pool.start()
+
+
 @app.on_event("shutdown")
 async def shutdown_scheduler():
     scheduler.shutdown()
+
+
+@app.on_event("shutdown")
+async def shutdown_agent_worker_pool():
+    agent.agent_worker_pool.stop()
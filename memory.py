@@ -1,9 +1,13 @@
-from dataclasses import dataclass, field
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
 from datetime import datetime
 from os import path
-from typing import Any, Dict, List, Literal, Optional, Tuple, Union
+from threading import Thread
+from typing import Any, Callable, Dict, List, Literal, Optional, Set, Tuple, Union
 from uuid import UUID, uuid4
 
+import numpy as np
 import yaml
 from pocketflow import Node
 from psycopg.types.json import Jsonb
@@ -12,16 +16,38 @@ from semantic_text_splitter import TextSplitter
 
 import db
 from config import (
+    ARCHIVAL_DEDUP_SIMILARITY,
+    ARCHIVAL_RRF_K,
     ARCHIVAL_STORAGE_MAX_NO_RESULTS,
     CHUNK_MAX_TOKENS,
     CTX_WINDOW,
     FLUSH_MIN_FIFO_QUEUE_LEN,
     FLUSH_TGT_TOK_FRAC,
     PERSONA_MAX_WORDS,
+    SUMMARY_CHUNK_TOK_FRAC,
+    SUMMARY_MAX_CONCURRENCY,
+    SUMMARY_MAX_RETRIES,
+    SUMMARY_ROLLUP_FANOUT,
+    SUMMARY_TOK_FRAC,
 )
 from function_sets import FunctionSets
-from llm import call_llm, extract_yaml, llm_tokenise
-from prompts import RECURSIVE_SUMMARY_PROMPT, SYSTEM_PROMPT
+from lexical import (
+    bm25_from_statistics,
+    lexical_tokenise,
+    reciprocal_rank_fusion,
+    simhash,
+    simhash_similarities,
+    term_frequencies,
+)
+from llm import (
+    call_llm,
+    extract_yaml,
+    llm_count_tokens,
+    llm_split_tokens,
+    llm_tokenise,
+)
+from llm_ledger import flush_llm_calls
+from prompts import BATCH_SUMMARY_PROMPT, SUMMARY_ROLLUP_PROMPT, SYSTEM_PROMPT
 
 
 # *Messages
@@ -172,6 +198,23 @@ class ChatLogMessage:
 # * Memory modules
 
 
+def bump_memory_version(agent_id: str, section: str) -> None:
+    """
+    Postgres-backed sections are bumped by triggers (see db.py); other stores bump explicitly.
+    """
+    db.write(
+        """
+        INSERT INTO memory_versions (agent_id, section, version)
+        VALUES (%s, %s, 1)
+        ON CONFLICT (agent_id, section) DO UPDATE SET version = memory_versions.version + 1;
+        """,
+        (agent_id, section),
+    )
+
+
+PERSONA_COLUMNS = {"agent": "agent_persona", "user": "user_persona"}
+
+
 @dataclass
 class WorkingContext:
     agent_id: str
@@ -222,45 +265,151 @@ class WorkingContext:
             ),
         )
 
-    @property
-    def tasks(self) -> Union[List[str], Any]:
+    def persona_append(
+        self, section: Literal["agent", "user"], text: str
+    ) -> Tuple[str, int]:
+        """
+        Appends to a persona in a single statement (word limit enforced in the database).
+        Returns (new persona, token count).
+        """
+        column = PERSONA_COLUMNS[section]
+
+        db_res = db.read(
+            f"""
+UPDATE working_context
+SET {column} = {column} || %s
+WHERE agent_id = %s
+    AND (SELECT count(*) FROM regexp_matches({column} || %s, '[^[:space:]]+', 'g')) <= %s  -- *Same count as str.split()
+RETURNING {column};
+""",
+            (
+                text,
+                self.agent_id,
+                text,
+                PERSONA_MAX_WORDS,
+            ),
+        )
+
+        if len(db_res) == 0:
+            new_persona_length = len((self.get_persona(section) + text).split())
+            raise ValueError(
+                f"New persona too long (maximum length {PERSONA_MAX_WORDS} words, requested length {new_persona_length} words)"
+            )
+
+        new_persona = db_res[0][0]
+
+        return new_persona, llm_count_tokens(new_persona)
+
+    def persona_replace(
+        self, section: Literal["agent", "user"], old_text: str, new_text: str
+    ) -> Tuple[str, int]:
+        """
+        Replaces all occurrences of old_text in a persona in a single statement (word limit enforced in the database).
+        Returns (new persona, token count).
+        """
+        column = PERSONA_COLUMNS[section]
+
+        db_res = db.read(
+            f"""
+UPDATE working_context
+SET {column} = replace({column}, %s, %s)
+WHERE agent_id = %s
+    AND strpos({column}, %s) > 0
+    AND (SELECT count(*) FROM regexp_matches(replace({column}, %s, %s), '[^[:space:]]+', 'g')) <= %s
+RETURNING {column};
+""",
+            (
+                old_text,
+                new_text,
+                self.agent_id,
+                old_text,
+                old_text,
+                new_text,
+                PERSONA_MAX_WORDS,
+            ),
+        )
+
+        if len(db_res) == 0:
+            old_persona = self.get_persona(section)
+            if old_text not in old_persona:
+                raise ValueError(
+                    f"old_text does not exist in {section.capitalize()} persona"
+                )
+
+            new_persona_length = len(old_persona.replace(old_text, new_text).split())
+            raise ValueError(
+                f"New persona too long (maximum length {PERSONA_MAX_WORDS} words, requested length {new_persona_length} words)"
+            )
+
+        new_persona = db_res[0][0]
+
+        return new_persona, llm_count_tokens(new_persona)
+
+    def get_persona(self, section: Literal["agent", "user"]) -> str:
         return db.read(
-            "SELECT tasks FROM working_context WHERE agent_id = %s;",
+            f"SELECT {PERSONA_COLUMNS[section]} FROM working_context WHERE agent_id = %s;",
             (self.agent_id,),
         )[0][0]
 
-    def push_task(self, task: str) -> None:
+    @property
+    def tasks(self) -> List[str]:
+        return [
+            row[0]
+            for row in db.read(
+                "SELECT task FROM tasks WHERE agent_id = %s ORDER BY priority DESC, position ASC;",
+                (self.agent_id,),
+            )
+        ]
+
+    def push_task(self, task: str, priority: int = 0) -> None:
         db.write(
-            "UPDATE working_context SET tasks = array_append(tasks, %s) WHERE agent_id = %s",
+            "INSERT INTO tasks (id, agent_id, priority, task) VALUES (%s, %s, %s, %s);",
             (
-                task,
+                uuid4(),
                 self.agent_id,
+                priority,
+                task,
             ),
         )
 
-    def pop_task(self) -> str:
-        if len(self.tasks) == 0:
+    def peek_task(self) -> str:
+        db_res = db.read(
+            "SELECT task FROM tasks WHERE agent_id = %s ORDER BY priority DESC, position ASC LIMIT 1;",
+            (self.agent_id,),
+        )
+
+        if len(db_res) == 0:
             raise ValueError("Task queue empty!")
 
-        popped_task = db.read(
-            """
-WITH popped AS (
-    SELECT tasks[1] AS task_to_return
-    FROM working_context
+        return db_res[0][0]
+
+    def pop_task(self) -> str:
+        while True:
+            db_res = db.read(
+                """
+DELETE FROM tasks
+WHERE id = (
+    SELECT id
+    FROM tasks
     WHERE agent_id = %s
+    ORDER BY priority DESC, position ASC
+    LIMIT 1
+    FOR UPDATE
 )
-UPDATE working_context
-SET tasks = tasks[2:array_length(tasks,1)]
-WHERE agent_id = %s
-RETURNING (SELECT task_to_return FROM popped);
-    """,
-            (
-                self.agent_id,
-                self.agent_id,
-            ),
-        )[0][0]
+RETURNING task;
+""",
+                (self.agent_id,),
+            )
 
-        return popped_task
+            if len(db_res) > 0:
+                return db_res[0][0]
+
+            # *A concurrent pop can delete the row the subquery waited on, so only report empty if it is
+            if not db.read(
+                "SELECT EXISTS (SELECT 1 FROM tasks WHERE agent_id = %s);",
+                (self.agent_id,),
+            )[0][0]:
+                raise ValueError("Task queue empty!")
 
     def __repr__(self) -> str:
         return f"""
@@ -278,67 +427,301 @@ RETURNING (SELECT task_to_return FROM popped);
 """.strip()
 
 
+# *Agents whose archival chunks all have BM25 statistics; new chunks are indexed on insert, so this stays true
+lexically_indexed_agents: Set[str] = set()
+
+
 @dataclass
 class ArchivalStorage:
     agent_id: str
-    collection: Any = field(init=False, default=None)
-
-    def __post_init__(self) -> None:
-        self.collection = db.create_chromadb_client().get_or_create_collection(
-            name=self.agent_id
-        )
-        # self.collection = chromadb.PersistentClient(
-        #     path=path.dirname(__file__),
-        #     settings=chromadb.config.Settings(anonymized_telemetry=False),
-        # ).get_or_create_collection(name=self.agent_id)
 
     def __len__(self) -> Union[int, Any]:
-        return self.collection.count()
+        with db.archival_collection(self.agent_id) as collection:
+            return collection.count()
 
     @property
     def categories(self) -> List[str]:
         categories_set = set()
 
-        batch_size = 50
-        for i in range(0, len(self), batch_size):
-            batch = self.collection.get(
-                include=["metadatas"],
-                limit=batch_size,
-                offset=i,
-            )
-            categories_set |= set(map(lambda m: m["category"], batch["metadatas"]))
+        with db.archival_collection(self.agent_id) as collection:
+            batch_size = 50
+            for i in range(0, collection.count(), batch_size):
+                batch = collection.get(
+                    include=["metadatas"],
+                    limit=batch_size,
+                    offset=i,
+                )
+                categories_set |= set(map(lambda m: m["category"], batch["metadatas"]))
 
         return list(categories_set)
 
-    def archival_insert(self, content: str, category: str) -> None:
+    @property
+    def signatures(self) -> np.ndarray:
+        return np.array(
+            [
+                row[0]
+                for row in db.read(
+                    "SELECT signature FROM archival_signatures WHERE agent_id = %s;",
+                    (self.agent_id,),
+                )
+            ],
+            dtype=np.int64,
+        ).view(np.uint64)
+
+    def archival_insert(self, content: str, category: str) -> Tuple[int, int]:
+        """
+        Returns (number of chunks inserted, number of near-duplicate chunks skipped).
+        """
         splitter = TextSplitter.from_tiktoken_model("gpt-3.5-turbo", CHUNK_MAX_TOKENS)
         chunks = splitter.chunks(content)
 
-        self.collection.add(
-            ids=[str(uuid4()) for _ in range(len(chunks))],
-            documents=chunks,
-            metadatas=[
-                {"category": category, "timestamp": datetime.now().isoformat()},
-            ]
-            * len(chunks),
+        # *Near-duplicate suppression (SimHash)
+        existing_signatures = self.signatures
+        new_chunks: List[str] = []
+        new_signatures: List[int] = []
+        for chunk in chunks:
+            signature = simhash(chunk)
+            candidate_signatures = np.concatenate(
+                [existing_signatures, np.array(new_signatures, dtype=np.uint64)]
+            )
+            if np.any(
+                simhash_similarities(signature, candidate_signatures)
+                >= ARCHIVAL_DEDUP_SIMILARITY
+            ):
+                continue
+
+            new_chunks.append(chunk)
+            new_signatures.append(signature)
+
+        if len(new_chunks) == 0:
+            return 0, len(chunks)
+
+        ids = [str(uuid4()) for _ in range(len(new_chunks))]
+
+        with db.archival_collection(self.agent_id, write=True) as collection:
+            collection.add(
+                ids=ids,
+                documents=new_chunks,
+                metadatas=[
+                    {"category": category, "timestamp": datetime.now().isoformat()},
+                ]
+                * len(new_chunks),
+            )
+
+        self.store_lexical_statistics(ids, new_chunks, category, new_signatures)
+
+        return len(new_chunks), len(chunks) - len(new_chunks)
+
+    def store_lexical_statistics(
+        self, ids: List[str], chunks: List[str], category: str, signatures: List[int]
+    ) -> None:
+        term_counts = [term_frequencies(chunk) for chunk in chunks]
+
+        db.write(
+            """
+            INSERT INTO archival_signatures (id, agent_id, signature, category, no_tokens)
+            SELECT unnest(%s::uuid[]), %s, unnest(%s::bigint[]), %s, unnest(%s::integer[])
+            ON CONFLICT (id) DO UPDATE
+            SET category = EXCLUDED.category, no_tokens = EXCLUDED.no_tokens;
+            """,
+            (
+                ids,
+                self.agent_id,
+                np.array(signatures, dtype=np.uint64).view(np.int64).tolist(),
+                category,
+                [counts.total() for counts in term_counts],
+            ),
         )
 
+        db.write(
+            """
+            INSERT INTO archival_terms (chunk_id, agent_id, term, tf)
+            SELECT unnest(%s::uuid[]), %s, unnest(%s::text[]), unnest(%s::integer[])
+            ON CONFLICT DO NOTHING;
+            """,
+            (
+                [i for i, counts in zip(ids, term_counts) for _ in counts],
+                self.agent_id,
+                [term for counts in term_counts for term in counts],
+                [tf for counts in term_counts for tf in counts.values()],
+            ),
+        )
+
+    def backfill_lexical_statistics(self) -> None:
+        """
+        Indexes chunks stored before BM25 statistics were persisted (once per agent per process).
+        """
+        if self.agent_id in lexically_indexed_agents:
+            return
+
+        no_entries = len(self)
+        no_indexed = db.read(
+            "SELECT COUNT(*) FROM archival_signatures WHERE agent_id = %s AND no_tokens IS NOT NULL;",
+            (self.agent_id,),
+        )[0][0]
+        if no_indexed >= no_entries:
+            lexically_indexed_agents.add(self.agent_id)
+            return
+
+        indexed_ids = {
+            str(row[0])
+            for row in db.read(
+                "SELECT id FROM archival_signatures WHERE agent_id = %s AND no_tokens IS NOT NULL;",
+                (self.agent_id,),
+            )
+        }
+
+        unindexed: List[Tuple[str, str, Dict[str, Any]]] = []
+        with db.archival_collection(self.agent_id) as collection:
+            batch_size = 50
+            for i in range(0, no_entries, batch_size):
+                batch = collection.get(
+                    include=["documents", "metadatas"],
+                    limit=batch_size,
+                    offset=i,
+                )
+                unindexed.extend(
+                    entry
+                    for entry in zip(batch["ids"], batch["documents"], batch["metadatas"])
+                    if entry[0] not in indexed_ids
+                )
+
+        by_category: Dict[str, List[Tuple[str, str]]] = {}
+        for chunk_id, document, metadata in unindexed:
+            by_category.setdefault(metadata["category"], []).append((chunk_id, document))
+
+        for category, entries in by_category.items():
+            ids, documents = zip(*entries)
+            self.store_lexical_statistics(
+                list(ids),
+                list(documents),
+                category,
+                [simhash(document) for document in documents],
+            )
+
+        lexically_indexed_agents.add(self.agent_id)
+
+    def lexical_search(self, query: str, category: Optional[str]) -> List[str]:
+        """
+        Ranks chunk ids by BM25 from the persisted postings (best first).
+        """
+        query_terms = list(dict.fromkeys(lexical_tokenise(query)))
+        if len(query_terms) == 0:
+            return []
+
+        self.backfill_lexical_statistics()
+
+        category_values = (category,) if category else ()
+
+        no_docs, avg_doc_length = db.read(
+            f"""
+            SELECT COUNT(*), COALESCE(AVG(no_tokens), 0) FROM archival_signatures
+            WHERE agent_id = %s AND no_tokens IS NOT NULL
+            {"AND category = %s" if category else ""};
+            """,
+            (self.agent_id, *category_values),
+        )[0]
+
+        postings = db.read(
+            f"""
+            SELECT t.chunk_id, t.term, t.tf, s.no_tokens
+            FROM archival_terms t
+            JOIN archival_signatures s ON s.id = t.chunk_id
+            WHERE t.agent_id = %s AND t.term = ANY(%s)
+            {"AND s.category = %s" if category else ""};
+            """,
+            (self.agent_id, query_terms, *category_values),
+        )
+        if len(postings) == 0:
+            return []
+
+        term_index = {term: i for i, term in enumerate(query_terms)}
+        chunk_ids = list(dict.fromkeys(str(row[0]) for row in postings))
+        chunk_index = {chunk_id: i for i, chunk_id in enumerate(chunk_ids)}
+
+        # *Term frequency matrix (matching chunks x query terms)
+        tf = np.zeros((len(chunk_ids), len(query_terms)), dtype=np.float64)
+        doc_lengths = np.zeros(len(chunk_ids), dtype=np.float64)
+        for chunk_id, term, count, no_tokens in postings:
+            tf[chunk_index[str(chunk_id)], term_index[term]] = count
+            doc_lengths[chunk_index[str(chunk_id)]] = no_tokens
+
+        scores = bm25_from_statistics(
+            tf,
+            doc_lengths,
+            np.count_nonzero(tf, axis=0),
+            no_docs,
+            float(avg_doc_length),
+        )
+        order = np.argsort(-scores, kind="stable")[:ARCHIVAL_STORAGE_MAX_NO_RESULTS]
+
+        return [chunk_ids[i] for i in order]
+
     def archival_search(
-        self, query: str, offset: int, count: int, category: Optional[str]
+        self,
+        query: str,
+        offset: int,
+        count: int,
+        category: Optional[str],
+        mode: Literal["vector", "hybrid"] = "vector",
     ) -> Tuple[List[Dict[str, Any]], int]:
-        query_res = self.collection.query(
-            query_texts=[query],
-            include=["documents", "metadatas"],
-            n_results=ARCHIVAL_STORAGE_MAX_NO_RESULTS,
-            where=({"category": category} if category else None),
-        )
+        with db.archival_collection(self.agent_id) as collection:
+            query_res = collection.query(
+                query_texts=[query],
+                include=["documents", "metadatas"],
+                n_results=ARCHIVAL_STORAGE_MAX_NO_RESULTS,
+                where=({"category": category} if category else None),
+            )
 
+        ids = query_res.get("ids", [[]])[0]
         documents = query_res.get("documents", [[]])[0]
         metadatas = query_res.get("metadatas", [[]])[0]
 
+        if mode == "vector":
+            results = [
+                {"document": doc, "metadata": meta}
+                for doc, meta in zip(documents, metadatas)
+            ]
+
+            return results[offset : offset + count], len(results)
+
+        # *Hybrid search: BM25 over archival chunks fused with vector ranking (RRF)
+        lexical_ids = self.lexical_search(query, category)
+
+        candidates = dict(zip(ids, zip(documents, metadatas)))
+        missing_ids = [i for i in lexical_ids if i not in candidates]
+        if len(missing_ids) > 0:
+            with db.archival_collection(self.agent_id) as collection:
+                missing = collection.get(
+                    ids=missing_ids, include=["documents", "metadatas"]
+                )
+            candidates |= dict(
+                zip(missing["ids"], zip(missing["documents"], missing["metadatas"]))
+            )
+
+        lexical_ids = [i for i in lexical_ids if i in candidates]
+        candidate_ids = list(candidates.keys())
+        candidate_positions = {i: pos for pos, i in enumerate(candidate_ids)}
+
+        fused_scores = reciprocal_rank_fusion(
+            [
+                np.array([candidate_positions[i] for i in ids], dtype=np.int64),
+                np.array(
+                    [candidate_positions[i] for i in lexical_ids], dtype=np.int64
+                ),
+            ],
+            k=ARCHIVAL_RRF_K,
+        )
+        fused_order = np.argsort(-fused_scores, kind="stable")[
+            : min(np.count_nonzero(fused_scores), ARCHIVAL_STORAGE_MAX_NO_RESULTS)
+        ]
+
         results = [
-            {"document": doc, "metadata": meta}
-            for doc, meta in zip(documents, metadatas)
+            {
+                "document": candidates[candidate_ids[pos]][0],
+                "metadata": candidates[candidate_ids[pos]][1],
+            }
+            for pos in fused_order
         ]
 
         return results[offset : offset + count], len(results)
@@ -479,7 +862,7 @@ class FIFOQueue:
     def messages(self) -> List[Message]:
         message_list = []
         for message_type, timestamp, content in db.read(
-            "SELECT message_type, timestamp, content FROM fifo_queue WHERE agent_id = %s",
+            "SELECT message_type, timestamp, content FROM fifo_queue WHERE agent_id = %s AND NOT summary_pending ORDER BY timestamp ASC",
             (self.agent_id,),
         ):
             message_dict = {
@@ -494,10 +877,36 @@ class FIFOQueue:
 
     def __len__(self) -> int:
         return db.read(
-            "SELECT COUNT(*) FROM fifo_queue WHERE agent_id = %s",
+            "SELECT COUNT(*) FROM fifo_queue WHERE agent_id = %s AND NOT summary_pending",
             (self.agent_id,),
         )[0][0]
 
+    @property
+    def pending_summary_messages(self) -> List[Tuple[UUID, Message]]:
+        message_list = []
+        for id, message_type, timestamp, content in db.read(
+            "SELECT id, message_type, timestamp, content FROM fifo_queue WHERE agent_id = %s AND summary_pending ORDER BY timestamp ASC",
+            (self.agent_id,),
+        ):
+            message_dict = {
+                "message_type": message_type,
+                "timestamp": timestamp.isoformat(),
+                "content": content,
+            }
+
+            message_list.append((id, Message.from_intermediate_repr(message_dict)))
+
+        return message_list
+
+    @property
+    def pending_summary_info(self) -> Tuple[int, Optional[datetime], Optional[datetime]]:
+        no_pending, first_timestamp, last_timestamp = db.read(
+            "SELECT COUNT(*), MIN(timestamp), MAX(timestamp) FROM fifo_queue WHERE agent_id = %s AND summary_pending",
+            (self.agent_id,),
+        )[0]
+
+        return no_pending, first_timestamp, last_timestamp
+
     def push_message(self, message: Message) -> None:
         message_intermediate = message.to_intermediate_repr()
 
@@ -517,7 +926,7 @@ class FIFOQueue:
 
     def peek_message(self) -> Message:
         db_res = db.read(
-            "SELECT id, agent_id, message_type, timestamp, content FROM fifo_queue WHERE agent_id = %s AND timestamp = (SELECT MIN(timestamp) FROM fifo_queue WHERE agent_id = %s);",
+            "SELECT id, agent_id, message_type, timestamp, content FROM fifo_queue WHERE agent_id = %s AND NOT summary_pending AND timestamp = (SELECT MIN(timestamp) FROM fifo_queue WHERE agent_id = %s AND NOT summary_pending);",
             (
                 self.agent_id,
                 self.agent_id,
@@ -547,7 +956,7 @@ DELETE FROM fifo_queue
 WHERE id = (
     SELECT id
     FROM fifo_queue
-    WHERE agent_id = %s
+    WHERE agent_id = %s AND NOT summary_pending
     ORDER BY timestamp ASC
     LIMIT 1
 )
@@ -557,6 +966,42 @@ WHERE id = (
 
         return last_message
 
+    def evict_message(self) -> Message:
+        """
+        Moves the oldest message into the pending-summary buffer (kept until it has been summarised).
+        """
+        db_res = db.read(
+            """
+UPDATE fifo_queue
+SET summary_pending = TRUE
+WHERE id = (
+    SELECT id
+    FROM fifo_queue
+    WHERE agent_id = %s AND NOT summary_pending
+    ORDER BY timestamp ASC
+    LIMIT 1
+)
+RETURNING message_type, timestamp, content;
+""",
+            (self.agent_id,),
+        )
+
+        if len(db_res) == 0:
+            raise ValueError("Message queue empty!")
+
+        message_type, timestamp, content = db_res[0]
+
+        message_dict = {
+            "message_type": message_type,
+            "timestamp": timestamp.isoformat(),
+            "content": content,
+        }
+
+        return Message.from_intermediate_repr(message_dict)
+
+
+# * Summaries
+
 
 class GenerateNewRecursiveSummaryResult(BaseModel):
     analysis: str
@@ -564,9 +1009,12 @@ class GenerateNewRecursiveSummaryResult(BaseModel):
 
 
 class GenerateNewRecursiveSummary(Node):
-    def prep(self, shared: Dict[str, Any]) -> Tuple[List[str], str, str]:
-        evicted_message_strs = shared["evicted_message_strs"]
-        assert isinstance(evicted_message_strs, list)
+    def prep(self, shared: Dict[str, Any]) -> Tuple[List[str], str, str, str, int]:
+        input_strs = shared["input_strs"]
+        assert isinstance(input_strs, list)
+
+        summary_prompt = shared["summary_prompt"]
+        assert isinstance(summary_prompt, str)
 
         agent_persona = shared["agent_persona"]
         assert isinstance(agent_persona, str)
@@ -574,21 +1022,28 @@ class GenerateNewRecursiveSummary(Node):
         user_persona = shared["user_persona"]
         assert isinstance(user_persona, str)
 
-        return evicted_message_strs, agent_persona, user_persona
+        backend_offset = shared.get("backend_offset", 0)
+        assert isinstance(backend_offset, int)
 
-    def exec(self, inputs: Tuple[List[str], str, str]) -> str:
-        evicted_message_strs, agent_persona, user_persona = inputs
+        return input_strs, summary_prompt, agent_persona, user_persona, backend_offset
+
+    def exec(self, inputs: Tuple[List[str], str, str, str, int]) -> str:
+        input_strs, summary_prompt, agent_persona, user_persona, backend_offset = (
+            inputs
+        )
 
         resp = call_llm(
             [
                 {
                     "role": "system",
-                    "content": RECURSIVE_SUMMARY_PROMPT.format(
-                        agent_persona, user_persona
-                    ),
+                    "content": summary_prompt.format(agent_persona, user_persona),
                 },
-                {"role": "user", "content": "\n\n".join(evicted_message_strs)},
-            ]
+                {"role": "user", "content": "\n\n".join(input_strs)},
+            ],
+            backend_offset=backend_offset,
+            call_site="summary",
+            cache=True,
+            cache_read=self.cur_retry == 0,
         )
 
         result = extract_yaml(resp)
@@ -599,13 +1054,316 @@ class GenerateNewRecursiveSummary(Node):
     def post(
         self,
         shared: Dict[str, Any],
-        prep_res: Tuple[List[str], str, str],
+        prep_res: Tuple[List[str], str, str, str, int],
         exec_res: str,
     ) -> None:
         shared["summary"] = exec_res
 
 
-generate_new_recursive_summary_node = GenerateNewRecursiveSummary(max_retries=10)
+def chunk_summary_inputs(input_strs: List[str], max_tokens: int) -> List[List[str]]:
+    chunks: List[List[str]] = [[]]
+    chunk_tokens = 0
+
+    for input_str in input_strs:
+        for piece in llm_split_tokens(input_str, max_tokens):
+            piece_tokens = llm_count_tokens(piece)
+            if chunk_tokens + piece_tokens > max_tokens and len(chunks[-1]) > 0:
+                chunks.append([])
+                chunk_tokens = 0
+
+            chunks[-1].append(piece)
+            chunk_tokens += piece_tokens
+
+    return chunks
+
+
+MIN_SUMMARY_CHUNK_TOKENS = 256  # *Floor for when the summary prompt itself takes most of the budget
+
+
+def summarise(
+    input_strs: List[str],
+    summary_prompt: str,
+    agent_persona: str,
+    user_persona: str,
+    max_depth: int = 3,
+) -> str:
+    """
+    Token-aware map-reduce summary: context-sized chunks are summarised concurrently
+    (spread across LLM backends), then the partial summaries are reduced with the roll-up prompt.
+    Raises if a chunk cannot be summarised, so callers keep their inputs pending rather than store a bad summary.
+    """
+    max_tokens = max(
+        int(
+            SUMMARY_CHUNK_TOK_FRAC * CTX_WINDOW
+            - llm_count_tokens(summary_prompt.format(agent_persona, user_persona))
+        ),
+        MIN_SUMMARY_CHUNK_TOKENS,
+    )
+    chunks = chunk_summary_inputs(input_strs, max_tokens)
+
+    def summarise_chunk(chunk_no: int, chunk: List[str], prompt: str) -> str:
+        shared = {
+            "input_strs": chunk,
+            "summary_prompt": prompt,
+            "agent_persona": agent_persona,
+            "user_persona": user_persona,
+            "backend_offset": chunk_no,
+        }
+
+        GenerateNewRecursiveSummary(max_retries=SUMMARY_MAX_RETRIES).run(shared)
+
+        return shared["summary"]
+
+    if len(chunks) == 1:
+        return summarise_chunk(0, chunks[0], summary_prompt)
+
+    # *Map
+    with ThreadPoolExecutor(
+        max_workers=min(SUMMARY_MAX_CONCURRENCY, len(chunks))
+    ) as executor:
+        partial_summaries = list(
+            executor.map(
+                lambda args: summarise_chunk(*args, summary_prompt),
+                enumerate(chunks),
+            )
+        )
+
+    if max_depth <= 1:  # *Reduce depth exhausted: keep every part, each truncated to an equal share
+        share = max(max_tokens // len(partial_summaries), 1)
+        return "\n\n".join(
+            (llm_split_tokens(partial_summary, share) or [""])[0]
+            for partial_summary in partial_summaries
+        )
+
+    # *Reduce
+    return summarise(
+        [
+            f"# Summary (part {part_no}/{len(partial_summaries)})\n\n{partial_summary}"
+            for part_no, partial_summary in enumerate(partial_summaries, start=1)
+        ],
+        SUMMARY_ROLLUP_PROMPT,
+        agent_persona,
+        user_persona,
+        max_depth - 1,
+    )
+
+
+@dataclass
+class SummaryNode:
+    id: UUID
+    level: int
+    parent_id: Optional[UUID]
+    content: str
+    token_count: int
+    start_time: datetime
+    end_time: datetime
+
+
+@dataclass
+class SummaryStore:
+    agent_id: str
+
+    @property
+    def nodes(self) -> List[SummaryNode]:
+        summary_nodes = []
+        for (
+            id,
+            level,
+            parent_id,
+            content,
+            token_count,
+            start_time,
+            end_time,
+        ) in db.read(
+            "SELECT id, level, parent_id, content, token_count, start_time, end_time FROM summaries WHERE agent_id = %s ORDER BY start_time ASC, level DESC;",
+            (self.agent_id,),
+        ):
+            if token_count is None:  # *Carried-over summaries are counted lazily
+                token_count = llm_count_tokens(content)
+                db.write(
+                    "UPDATE summaries SET token_count = %s WHERE id = %s;",
+                    (token_count, id),
+                )
+
+            summary_nodes.append(
+                SummaryNode(
+                    id=id,
+                    level=level,
+                    parent_id=parent_id,
+                    content=content,
+                    token_count=token_count,
+                    start_time=start_time,
+                    end_time=end_time,
+                )
+            )
+
+        return summary_nodes
+
+    @property
+    def last_update_time(self) -> datetime:
+        return db.read(
+            "SELECT COALESCE(MAX(summaries.created_at), agents.created_at) FROM agents LEFT JOIN summaries ON summaries.agent_id = agents.id WHERE agents.id = %s GROUP BY agents.created_at;",
+            (self.agent_id,),
+        )[0][0]
+
+    def select(self, token_budget: int) -> List[SummaryNode]:
+        """
+        Picks the combination of summaries covering the most history in the most detail within the token budget.
+        Starts from the top-level summaries, then expands the most recent roll-ups into their children while they fit.
+        """
+        summary_nodes = self.nodes
+
+        children: Dict[UUID, List[SummaryNode]] = {}
+        for summary_node in summary_nodes:
+            if summary_node.parent_id:
+                children.setdefault(summary_node.parent_id, []).append(summary_node)
+
+        selected = [n for n in summary_nodes if n.parent_id is None]
+        total_tokens = sum(n.token_count for n in selected)
+
+        while total_tokens > token_budget and len(selected) > 1:
+            total_tokens -= selected.pop(0).token_count
+
+        expanded = True
+        while expanded:
+            expanded = False
+            for summary_node in sorted(selected, key=lambda n: n.end_time, reverse=True):
+                node_children = children.get(summary_node.id, [])
+                if len(node_children) == 0:
+                    continue
+
+                new_total_tokens = (
+                    total_tokens
+                    - summary_node.token_count
+                    + sum(n.token_count for n in node_children)
+                )
+                if new_total_tokens > token_budget:
+                    continue
+
+                position = selected.index(summary_node)
+                selected[position : position + 1] = node_children
+                total_tokens = new_total_tokens
+                expanded = True
+                break
+
+        return selected
+
+    def add_leaf(
+        self,
+        content: str,
+        start_time: datetime,
+        end_time: datetime,
+        summarised_message_ids: List[UUID],
+    ) -> None:
+        """
+        Inserts a leaf summary and drops the summarised FIFO Queue messages atomically.
+        """
+        db.write(
+            """
+WITH summarised AS (
+    DELETE FROM fifo_queue
+    WHERE id = ANY(%s)
+)
+INSERT INTO summaries (id, agent_id, level, content, token_count, start_time, end_time)
+VALUES (%s, %s, 0, %s, %s, %s, %s);
+""",
+            (
+                summarised_message_ids,
+                uuid4(),
+                self.agent_id,
+                content,
+                llm_count_tokens(content),
+                start_time,
+                end_time,
+            ),
+        )
+
+    def roll_up(self, agent_persona: str, user_persona: str) -> None:
+        """
+        Condenses every SUMMARY_ROLLUP_FANOUT consecutive top-level summaries of the same level into a parent summary.
+        """
+        while True:
+            top_level_nodes = [n for n in self.nodes if n.parent_id is None]
+
+            levels = sorted({n.level for n in top_level_nodes})
+            level_nodes = next(
+                (
+                    nodes
+                    for nodes in (
+                        [n for n in top_level_nodes if n.level == level]
+                        for level in levels
+                    )
+                    if len(nodes) >= SUMMARY_ROLLUP_FANOUT
+                ),
+                None,
+            )
+            if level_nodes is None:
+                return
+
+            rolled_up_nodes = level_nodes[:SUMMARY_ROLLUP_FANOUT]
+
+            content = summarise(
+                [
+                    f"# Summary ({n.start_time.isoformat()} to {n.end_time.isoformat()})\n\n{n.content}"
+                    for n in rolled_up_nodes
+                ],
+                SUMMARY_ROLLUP_PROMPT,
+                agent_persona,
+                user_persona,
+            )
+            parent_id = uuid4()
+
+            db.write(
+                """
+WITH parent AS (
+    INSERT INTO summaries (id, agent_id, level, content, token_count, start_time, end_time)
+    VALUES (%s, %s, %s, %s, %s, %s, %s)
+    RETURNING id
+)
+UPDATE summaries
+SET parent_id = (SELECT id FROM parent)
+WHERE id = ANY(%s);
+""",
+                (
+                    parent_id,
+                    self.agent_id,
+                    rolled_up_nodes[0].level + 1,
+                    content,
+                    llm_count_tokens(content),
+                    rolled_up_nodes[0].start_time,
+                    rolled_up_nodes[-1].end_time,
+                    [n.id for n in rolled_up_nodes],
+                ),
+            )
+
+    def __repr__(self) -> str:
+        selected = self.select(int(SUMMARY_TOK_FRAC * CTX_WINDOW))
+
+        if len(selected) == 0:
+            return "No content in recursive summary yet"
+
+        return "\n\n".join(
+            f"## {n.start_time.isoformat()} to {n.end_time.isoformat()}\n\n{n.content}"
+            for n in selected
+        )
+
+
+# *Background summaries of this process. Nothing waits for them at the end of a turn: summary_pending rows, taken under the
+# *agent's advisory lock, are the only handoff, so a summary that dies with its process is redone by the next summary job
+summary_threads: List[Thread] = []
+
+
+def wait_for_summaries() -> None:
+    """
+    Joins this process's background summaries (one-off agent workers exit after their turn; pooled workers never wait).
+    """
+    for summary_thread in list(summary_threads):
+        summary_thread.join()
+
+
+# *Rendered system prompt sections per (agent_id, section): (memory version, text, token count).
+# *Per process, so pooled agent workers reuse them across turns
+section_cache: Dict[Tuple[str, str], Tuple[int, str, int]] = {}
 
 
 # *Memory obj
@@ -617,67 +1375,151 @@ class Memory:
     chat_log: ChatLog
     function_sets: FunctionSets
     fifo_queue: FIFOQueue
+    summary_store: SummaryStore
     agent_id: str
     in_convo: bool
 
-    def __repr__(self) -> str:
-        return f"""
+    @property
+    def memory_versions(self) -> Dict[str, int]:
+        return {
+            section: version
+            for section, version in db.read(
+                "SELECT section, version FROM memory_versions WHERE agent_id = %s;",
+                (self.agent_id,),
+            )
+        }
+
+    def memoised_section(
+        self, section: str, version: int, render: Callable[[], str]
+    ) -> Tuple[str, int]:
+        """
+        Returns (rendered section, token count), re-rendering only when the section's memory version changes.
+        """
+        cached = section_cache.get((self.agent_id, section))
+        if cached is not None and cached[0] == version:
+            return cached[1], cached[2]
+
+        rendered = render()
+        no_tokens = llm_count_tokens(rendered)
+        section_cache[(self.agent_id, section)] = (version, rendered, no_tokens)
+
+        return rendered, no_tokens
+
+    @property
+    def system_prompt_sections(self) -> List[Tuple[str, int]]:
+        memory_versions = self.memory_versions
+
+        return [
+            self.memoised_section("system_prompt", 0, lambda: SYSTEM_PROMPT),
+            self.memoised_section(
+                "working_context",
+                memory_versions.get("working_context", 0),
+                lambda: f"""
 # Memory information
 
 ## Working Context
 
 {self.working_context}
-
+""".strip(),
+            ),
+            self.memoised_section(
+                "archival_storage",
+                memory_versions.get("archival_storage", 0),
+                lambda: f"""
 ## Archival Storage
 
 {self.archival_storage}
-
+""".strip(),
+            ),
+            self.memoised_section(
+                "conversation",
+                memory_versions.get("conversation", 0),
+                lambda: f"""
 ## Conversational Memory
 
 {len(self.fifo_queue)} messages in FIFO Queue
 {len(self.recall_storage)} messages in Recall Storage ({len(self.recall_storage) - len(self.fifo_queue)} previous messages evicted from FIFO Queue)
 {len(self.chat_log)} messages in Chat Log
+""".strip(),
+            ),
+            self.function_schemas_section,
+        ]
 
-# Function Schemas
+    @property
+    def function_schemas_section(self) -> Tuple[str, int]:
+        # *Rendered and counted once per process and function set combination (see FunctionSets.rendered_schemas)
+        rendered = self.function_sets.rendered_schemas
+        heading, heading_no_tokens = self.memoised_section(
+            "function_schemas_heading", 0, lambda: "# Function Schemas"
+        )
 
-{self.function_sets}
-""".strip()
+        return f"{heading}\n\n{rendered.text}", heading_no_tokens + rendered.no_tokens
+
+    def __repr__(self) -> str:
+        return "\n\n".join(section for section, _ in self.system_prompt_sections[1:])
 
     @property
     def system_prompt(self) -> str:
-        return "\n\n".join([SYSTEM_PROMPT, repr(self)])
+        return "\n\n".join(section for section, _ in self.system_prompt_sections)
 
     @property
-    def recursive_summary_and_summary_timestamp(self) -> Tuple[str, datetime]:
-        rs, rsut_txt = db.read(
-            "SELECT recursive_summary, recursive_summary_update_time FROM agents WHERE id = %s;",
-            (self.agent_id,),
-        )[0]
+    def system_prompt_no_tokens(self) -> int:
+        return sum(no_tokens for _, no_tokens in self.system_prompt_sections)
+
+    @property
+    def recursive_summary_message(self) -> Message:
+        summary_version = self.memory_versions.get("summaries", 0)
 
-        return rs, rsut_txt
+        rendered_summary, _ = self.memoised_section(
+            "summaries", summary_version, lambda: repr(self.summary_store)
+        )
+
+        return Message(
+            message_type="system",
+            timestamp=self.summary_store.last_update_time,
+            content=TextContent(
+                message=f"""
+# Recursive summary (contains conversation history before beginning of context window, if any)
+
+{rendered_summary}
+""".strip()
+            ),
+        )
 
     @property
     def main_ctx(self) -> List[Dict[str, str]]:
-        processed_messages = [{"role": "system", "content": self.system_prompt}]
+        return [
+            {"role": "system", "content": self.system_prompt}
+        ] + self.conversation_ctx
 
-        last_userside_messages = []
+    @property
+    def conversation_ctx(self) -> List[Dict[str, str]]:
+        processed_messages: List[Dict[str, str]] = []
 
-        rs, rsut = self.recursive_summary_and_summary_timestamp
+        last_userside_messages = []
 
-        for msg in (
+        no_pending, first_pending_timestamp, last_pending_timestamp = (
+            self.fifo_queue.pending_summary_info
+        )
+        pending_summary_messages = (
             [
                 Message(
                     message_type="system",
-                    timestamp=rsut,
+                    timestamp=last_pending_timestamp,
                     content=TextContent(
-                        message=f"""
-# Recursive summary (contains conversation history before beginning of context window, if any)
-
-{rs}
-""".strip()
+                        message=f"{no_pending} older messages ({first_pending_timestamp.isoformat()} to {last_pending_timestamp.isoformat()}) have been evicted from the FIFO Queue and are being merged into the recursive summary. They can still be found in Recall Storage."
                     ),
                 )
             ]
+            if no_pending > 0
+            and first_pending_timestamp is not None
+            and last_pending_timestamp is not None
+            else []
+        )
+
+        for msg in (
+            [self.recursive_summary_message]
+            + pending_summary_messages
             + self.fifo_queue.messages
         ):
             msg_intermediate = msg.to_std_message_format()
@@ -701,7 +1543,9 @@ class Memory:
 
     @property
     def in_ctx_no_tokens(self) -> int:
-        return len(llm_tokenise(self.main_ctx))
+        return self.system_prompt_no_tokens + len(
+            llm_tokenise(self.conversation_ctx)
+        )
 
     def push_message(self, message: Message) -> None:
         self.fifo_queue.push_message(message)
@@ -721,29 +1565,14 @@ class Memory:
             )
 
     def flush_fifo_queue(self, tgt_token_frac: float) -> None:
-        rs, rsut = self.recursive_summary_and_summary_timestamp
-
-        evicted_message_strs = [
-            yaml.dump(
-                Message(
-                    message_type="system",
-                    timestamp=rsut,
-                    content=TextContent(
-                        message=f"""
-# Recursive summary (contains conversation history before beginning of context window, if any)
-
-{rs}
-""".strip()
-                    ),
-                ).to_intermediate_repr()
-            ).strip()
-        ]
-
+        """
+        Evicts messages into the pending-summary buffer and summarises them in the background.
+        """
         while True:
             msg = self.fifo_queue.peek_message()
 
             if (
-                self.in_ctx_no_tokens <= FLUSH_TGT_TOK_FRAC * CTX_WINDOW
+                self.in_ctx_no_tokens <= tgt_token_frac * CTX_WINDOW
                 and msg.message_type == "user"
             ):
                 break
@@ -754,25 +1583,58 @@ class Memory:
             ):
                 break
 
-            evicted_message_strs.append(
-                yaml.dump(self.fifo_queue.pop_message().to_intermediate_repr()).strip()
-            )
+            self.fifo_queue.evict_message()
 
-        shared = {
-            "evicted_message_strs": evicted_message_strs,
-            "agent_persona": self.working_context.agent_persona,
-            "user_persona": self.working_context.user_persona,
-        }
+        self.start_summary()
 
-        generate_new_recursive_summary_node.run(shared)
+    def start_summary(self) -> None:
+        summary_thread = Thread(target=self.summarise_pending_messages, daemon=True)
+        summary_thread.start()
+        summary_threads[:] = [t for t in summary_threads if t.is_alive()] + [
+            summary_thread
+        ]
 
-        new_summary = shared["summary"]
+    def resume_pending_summary(self) -> None:
+        """
+        Restarts summarisation of messages left pending by a summary job that died with its process.
+        """
+        if self.fifo_queue.pending_summary_info[0] > 0:
+            self.start_summary()
+
+    def summarise_pending_messages(self) -> None:
+        try:
+            # *One summary job per agent at a time (across processes)
+            with db.advisory_lock(f"recursive_summary:{self.agent_id}"):
+                pending_summary_messages = self.fifo_queue.pending_summary_messages
+                if len(pending_summary_messages) == 0:
+                    return
+
+                agent_persona = self.working_context.agent_persona
+                user_persona = self.working_context.user_persona
+
+                # *Only the new batch is summarised
+                summary = summarise(
+                    [
+                        yaml.dump(msg.to_intermediate_repr()).strip()
+                        for _, msg in pending_summary_messages
+                    ],
+                    BATCH_SUMMARY_PROMPT,
+                    agent_persona,
+                    user_persona,
+                )
 
-        db.write(
-            "UPDATE agents SET recursive_summary = %s, recursive_summary_update_time = %s WHERE id = %s",
-            (
-                new_summary,
-                datetime.now(),
-                self.agent_id,
-            ),
-        )
+                self.summary_store.add_leaf(
+                    summary,
+                    pending_summary_messages[0][1].timestamp,
+                    pending_summary_messages[-1][1].timestamp,
+                    [id for id, _ in pending_summary_messages],
+                )
+
+                self.summary_store.roll_up(agent_persona, user_persona)
+        except Exception:
+            print(
+                f"Recursive summary for agent {self.agent_id} failed: {traceback.format_exc()}",
+                flush=True,
+            )
+        finally:
+            flush_llm_calls()  # *The turn's own flush may have run long before this
@@ -0,0 +1,63 @@
+"""
+Copies Archival Storage collections from the Chroma HTTP server into the embedded backend.
+
+Usage: uv run python migrate_archival.py [agent_id ...]
+(migrates every agent if no agent IDs are given)
+"""
+
+import sys
+from typing import List, Optional
+
+from chromadb.errors import NotFoundError
+
+import db
+
+
+def migrate_agent(agent_id: str, batch_size: int = 50) -> Optional[int]:
+    """
+    Returns the number of entries migrated (None if the agent has no collection on the Chroma server).
+    """
+    try:
+        source = db.create_chromadb_http_client().get_collection(name=agent_id)
+    except NotFoundError:
+        return None
+
+    no_migrated = 0
+    with db.embedded_archival_collection(agent_id, write=True) as target:
+        for i in range(0, source.count(), batch_size):
+            batch = source.get(
+                include=["documents", "metadatas", "embeddings"],
+                limit=batch_size,
+                offset=i,
+            )
+
+            existing_ids = set(target.get(ids=batch["ids"], include=[])["ids"])
+            keep = [j for j, id in enumerate(batch["ids"]) if id not in existing_ids]
+            if len(keep) == 0:
+                continue
+
+            # *Reuse stored embeddings so documents are not re-embedded
+            target.add(
+                ids=[batch["ids"][j] for j in keep],
+                documents=[batch["documents"][j] for j in keep],
+                metadatas=[batch["metadatas"][j] for j in keep],
+                embeddings=[batch["embeddings"][j] for j in keep],
+            )
+            no_migrated += len(keep)
+
+    return no_migrated
+
+
+def migrate(agent_ids: List[str]) -> None:
+    for agent_id in agent_ids:
+        no_migrated = migrate_agent(agent_id)
+        if no_migrated is None:
+            print(f"Agent {agent_id}: no collection on the Chroma server, skipped", flush=True)
+            continue
+        print(f"Agent {agent_id}: migrated {no_migrated} entries", flush=True)
+
+
+if __name__ == "__main__":
+    agent_ids = sys.argv[1:] or [str(row[0]) for row in db.read("SELECT id FROM agents;")]
+
+    migrate(agent_ids)
@@ -0,0 +1,334 @@
+"""
+Stand-in OpenAI-compatible LLM server (/v1/chat/completions, streaming and non-streaming) for offline load and regression testing.
+Agent steps get valid CallAgentResult outputs (JSON under a json_schema response_format, fenced YAML otherwise); summary, persona generation, output repair and SPR (VLM) prompts get matching templated outputs.
+
+Usage: uv run fastapi run mock_llm_server.py --port 8001
+(then point a backend in backends.yaml at base_url http://localhost:8001/v1, with any api_key and model name)
+
+Environment variables:
+- MOCK_LLM_LATENCY: time to first token distribution, one of fixed:S, uniform:MIN,MAX, lognormal:MEDIAN,SIGMA, exponential:MEAN (seconds; default lognormal:0.5,0.5)
+- MOCK_LLM_TOKENS_PER_SECOND: generation speed after the first token (default 50, 0 = instant)
+- MOCK_LLM_STEPS: agent steps per turn; all but the last call noop with do_heartbeat (default 1)
+- MOCK_LLM_SCRIPT: YAML file with a list of agent outputs used in order (cycled) instead of the templates; each entry is either a raw response string or a CallAgentResult mapping
+- MOCK_LLM_ERROR_RATE, MOCK_LLM_RATE_LIMIT_RATE: fraction of requests answered with a 500/429
+- MOCK_LLM_STALL_RATE: fraction of requests that stall for MOCK_LLM_STALL_SECONDS (default 600) before the first token
+- MOCK_LLM_DISCONNECT_RATE: fraction of streams cut off halfway
+- MOCK_LLM_MALFORMED_RATE: fraction of agent outputs that are malformed in a repairable way
+- MOCK_LLM_SEED: random seed
+"""
+
+import asyncio
+import random
+import re
+from itertools import cycle
+from os import getenv
+from time import time
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional
+from uuid import uuid4
+
+import orjson
+import yaml
+from fastapi import FastAPI
+from fastapi.responses import JSONResponse, StreamingResponse
+from pydantic import BaseModel
+
+
+def parse_distribution(spec: str) -> Callable[[random.Random], float]:
+    kind, _, params_str = spec.strip().lower().partition(":")
+    params = [float(p) for p in params_str.split(",") if p.strip()]
+
+    match kind, len(params):
+        case "fixed", 1:
+            return lambda rng: params[0]
+        case "uniform", 2:
+            return lambda rng: rng.uniform(params[0], params[1])
+        case "lognormal", 2:  # *Median and sigma of the underlying normal
+            return lambda rng: params[0] * rng.lognormvariate(0, params[1])
+        case "exponential", 1:
+            return lambda rng: rng.expovariate(1 / params[0])
+        case _:
+            raise ValueError(f"Invalid latency distribution: {spec}")
+
+
+MOCK_LLM_LATENCY = parse_distribution(getenv("MOCK_LLM_LATENCY") or "lognormal:0.5,0.5")
+MOCK_LLM_TOKENS_PER_SECOND = float(getenv("MOCK_LLM_TOKENS_PER_SECOND") or "50")
+MOCK_LLM_STEPS = int(getenv("MOCK_LLM_STEPS") or "1")
+MOCK_LLM_SCRIPT = getenv("MOCK_LLM_SCRIPT")
+MOCK_LLM_ERROR_RATE = float(getenv("MOCK_LLM_ERROR_RATE") or "0")
+MOCK_LLM_RATE_LIMIT_RATE = float(getenv("MOCK_LLM_RATE_LIMIT_RATE") or "0")
+MOCK_LLM_STALL_RATE = float(getenv("MOCK_LLM_STALL_RATE") or "0")
+MOCK_LLM_STALL_SECONDS = float(getenv("MOCK_LLM_STALL_SECONDS") or "600")
+MOCK_LLM_DISCONNECT_RATE = float(getenv("MOCK_LLM_DISCONNECT_RATE") or "0")
+MOCK_LLM_MALFORMED_RATE = float(getenv("MOCK_LLM_MALFORMED_RATE") or "0")
+
+rng = random.Random(getenv("MOCK_LLM_SEED"))
+
+script: Optional[Any] = None
+if MOCK_LLM_SCRIPT:
+    with open(MOCK_LLM_SCRIPT, "r") as f:
+        script_entries = yaml.safe_load(f)
+    assert (
+        isinstance(script_entries, list) and len(script_entries) > 0
+    ), "MOCK_LLM_SCRIPT must contain a non-empty list"
+    script = cycle(script_entries)
+
+TOKEN_PATTERN = re.compile(r"\S+\s*|\s+")  # *Words stand in for tokens
+# *Consecutive user-side messages are joined into one chat message; each is a yaml.dump (sorted keys) starting at column 0 with "content:"
+MESSAGE_START_PATTERN = re.compile(r"^(?=content:)", re.MULTILINE)
+
+app = FastAPI()
+
+
+class ChatCompletionRequest(BaseModel):
+    model: str
+    messages: List[Dict[str, Any]]
+    stream: bool = False
+    response_format: Optional[Dict[str, Any]] = None
+    stream_options: Optional[Dict[str, Any]] = None
+
+    model_config = {"extra": "allow"}
+
+
+# *Response templates
+def message_text(message: Dict[str, Any]) -> str:
+    if isinstance(message["content"], list):
+        return "".join(
+            part.get("text", "") for part in message["content"] if isinstance(part, dict)
+        )
+    return str(message["content"])
+
+
+def fenced_yaml(data: Dict[str, Any]) -> str:
+    return f"```yaml\n{yaml.dump(data, allow_unicode=True, sort_keys=False).strip()}\n```"
+
+
+def user_messages(text: str) -> List[str]:
+    """
+    Texts of the user messages (not system or function results) in a user-side chat message.
+    """
+    texts = []
+    for document in MESSAGE_START_PATTERN.split(text):
+        try:
+            message = yaml.safe_load(document)
+        except yaml.YAMLError:
+            continue
+
+        if (
+            isinstance(message, dict)
+            and message.get("message_type") == "user"
+            and isinstance(message.get("content"), dict)
+            and "message" in message["content"]
+        ):
+            texts.append(str(message["content"]["message"]))
+
+    return texts
+
+
+def call_agent_result(messages: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Takes MOCK_LLM_STEPS - 1 heartbeat steps after the latest user message, then replies to it with send_message; other turns (heartbeats, system messages) end with a noop.
+    """
+    last_user_index = next(
+        (
+            i
+            for i in range(len(messages) - 1, -1, -1)
+            if messages[i]["role"] == "user"
+            and len(user_messages(message_text(messages[i]))) > 0
+        ),
+        None,
+    )
+    replies = (
+        [m for m in messages[last_user_index:] if m["role"] == "assistant"]
+        if last_user_index is not None
+        else []
+    )
+    answered = any("send_message" in message_text(m) for m in replies)
+
+    if last_user_index is not None and not answered and len(replies) + 1 < MOCK_LLM_STEPS:
+        function_call = {"name": "noop", "arguments": {}, "do_heartbeat": True}
+    elif last_user_index is not None and not answered:
+        user_message = user_messages(message_text(messages[last_user_index]))[-1]
+        function_call = {
+            "name": "send_message",
+            "arguments": {"message": f"Got it, you said: {user_message[:80]}"},
+            "do_heartbeat": False,
+        }
+    else:
+        function_call = {"name": "noop", "arguments": {}, "do_heartbeat": False}
+
+    return {
+        "emotions": [["curiosity", rng.randint(3, 8)], ["calm", rng.randint(3, 8)]],
+        "thoughts": [f"Mock step {len(replies) + 1}."],
+        "function_call": function_call,
+    }
+
+
+def malformed(data: Dict[str, Any]) -> str:
+    """
+    Invalid as a CallAgentResult but repairable (see repair.py): stringified emotions and no code fence.
+    """
+    return yaml.dump(
+        {
+            **data,
+            "emotions": [f"{name}: {score}/10" for name, score in data["emotions"]],
+        },
+        allow_unicode=True,
+        sort_keys=False,
+    )
+
+
+def render_response(request: ChatCompletionRequest) -> str:
+    system = message_text(request.messages[0]) if request.messages else ""
+    last = message_text(request.messages[-1]) if request.messages else ""
+    structured = (request.response_format or {}).get("type") == "json_schema"
+
+    # *Matched on the prompt openings in prompts.py
+    if system.startswith("# MISSION") and "Sparse Priming Representation" in system:
+        return "- Mock document content\n- Rendered as a sparse priming representation"
+    if system.startswith("# MISSION") and "Recursive Summary" in system:
+        return fenced_yaml(
+            {
+                "analysis": "Mock analysis.",
+                "summary": f"I went over {len(last.split())} words of conversation; nothing notable happened.",
+            }
+        )
+    if last.startswith("AGENT GOALS:"):
+        return fenced_yaml(
+            {
+                "analysis": "Mock analysis.",
+                "personality_traits": "Calm, curious, terse.",
+                "persona": "I'm Mock. I keep my texts short and I like tidy answers.",
+            }
+        )
+
+    if last.startswith("The response below was supposed to be"):  # *Output repair (answered with a valid noop)
+        return fenced_yaml(call_agent_result([]))
+
+    if script is not None:
+        entry = next(script)
+        if isinstance(entry, str):
+            return entry
+        return orjson.dumps(entry).decode("utf-8") if structured else fenced_yaml(entry)
+
+    data = call_agent_result(request.messages)
+    if rng.random() < MOCK_LLM_MALFORMED_RATE:
+        return malformed(data)
+    return orjson.dumps(data).decode("utf-8") if structured else fenced_yaml(data)
+
+
+# *Endpoints
+def injected_error() -> Optional[JSONResponse]:
+    if rng.random() < MOCK_LLM_RATE_LIMIT_RATE:
+        return JSONResponse(
+            {"error": {"message": "Mock rate limit", "type": "rate_limit_error"}},
+            status_code=429,
+            headers={"Retry-After": "1"},
+        )
+    if rng.random() < MOCK_LLM_ERROR_RATE:
+        return JSONResponse(
+            {"error": {"message": "Mock server error", "type": "server_error"}},
+            status_code=500,
+        )
+    return None
+
+
+async def first_token_delay() -> None:
+    if rng.random() < MOCK_LLM_STALL_RATE:
+        await asyncio.sleep(MOCK_LLM_STALL_SECONDS)
+    await asyncio.sleep(max(MOCK_LLM_LATENCY(rng), 0))
+
+
+def usage(request: ChatCompletionRequest, tokens: List[str]) -> Dict[str, int]:
+    prompt_tokens = sum(len(message_text(m)) for m in request.messages) // 4
+    return {
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": len(tokens),
+        "total_tokens": prompt_tokens + len(tokens),
+    }
+
+
+@app.get("/v1/models")
+def list_models():
+    return {"object": "list", "data": [{"id": "mock", "object": "model"}]}
+
+
+@app.post("/v1/chat/completions")
+async def chat_completions(request: ChatCompletionRequest):
+    if (error := injected_error()) is not None:
+        return error
+
+    text = render_response(request)
+    tokens = TOKEN_PATTERN.findall(text)
+    completion_id = f"chatcmpl-{uuid4().hex}"
+    created = int(time())
+
+    if not request.stream:
+        await first_token_delay()
+        if MOCK_LLM_TOKENS_PER_SECOND > 0:
+            await asyncio.sleep(len(tokens) / MOCK_LLM_TOKENS_PER_SECOND)
+
+        return {
+            "id": completion_id,
+            "object": "chat.completion",
+            "created": created,
+            "model": request.model,
+            "choices": [
+                {
+                    "index": 0,
+                    "message": {"role": "assistant", "content": text},
+                    "finish_reason": "stop",
+                }
+            ],
+            "usage": usage(request, tokens),
+        }
+
+    def chunk(delta: Dict[str, Any], finish_reason: Optional[str] = None) -> bytes:
+        return (
+            b"data: "
+            + orjson.dumps(
+                {
+                    "id": completion_id,
+                    "object": "chat.completion.chunk",
+                    "created": created,
+                    "model": request.model,
+                    "choices": [
+                        {"index": 0, "delta": delta, "finish_reason": finish_reason}
+                    ],
+                }
+            )
+            + b"\n\n"
+        )
+
+    async def stream() -> AsyncIterator[bytes]:
+        await first_token_delay()
+        disconnect_at = (
+            len(tokens) // 2 if rng.random() < MOCK_LLM_DISCONNECT_RATE else None
+        )
+
+        yield chunk({"role": "assistant", "content": ""})
+        for i, token in enumerate(tokens):
+            if i == disconnect_at:
+                raise ConnectionError("Mock disconnect")  # *Aborts the response mid-stream
+            if MOCK_LLM_TOKENS_PER_SECOND > 0:
+                await asyncio.sleep(1 / MOCK_LLM_TOKENS_PER_SECOND)
+            yield chunk({"content": token})
+        yield chunk({}, "stop")
+
+        if (request.stream_options or {}).get("include_usage"):
+            yield (
+                b"data: "
+                + orjson.dumps(
+                    {
+                        "id": completion_id,
+                        "object": "chat.completion.chunk",
+                        "created": created,
+                        "model": request.model,
+                        "choices": [],
+                        "usage": usage(request, tokens),
+                    }
+                )
+                + b"\n\n"
+            )
+        yield b"data: [DONE]\n\n"
+
+    return StreamingResponse(stream(), media_type="text/event-stream")
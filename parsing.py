@@ -0,0 +1,59 @@
+import re
+from typing import Any, Dict
+
+import yaml
+
+# *libyaml is several times faster; the pure-Python loader is the fallback (and the tie-breaker for inputs libyaml rejects)
+SafeLoader = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+
+FENCE_PATTERN = re.compile(r"```(?:ya?ml)?\s*([\s\S]*?)```", re.IGNORECASE)
+THINK_PATTERN = re.compile(r"^<think>.*?</think>", re.DOTALL)
+SURROGATE_PATTERN = re.compile(r"[\ud800-\udfff]")
+SURROGATE_ESCAPE_PATTERN = re.compile(r"\\(?:u|U0000)[dD][89a-fA-F][0-9a-fA-F]{2}")
+
+# *Lenient variants for repairing malformed outputs: think blocks anywhere, JSON fences and an unclosed last fence
+LENIENT_THINK_PATTERN = re.compile(r"<think>[\s\S]*?</think>", re.IGNORECASE)
+LENIENT_FENCE_PATTERN = re.compile(
+    r"```(?:ya?ml|json)?[ \t]*\n?([\s\S]*?)(?:```|$)", re.IGNORECASE
+)
+
+
+def deep_clean(obj: Any) -> Any:
+    if isinstance(obj, str):
+        return SURROGATE_PATTERN.sub("", obj)
+    elif isinstance(obj, list):
+        return [deep_clean(i) for i in obj]
+    elif isinstance(obj, dict):
+        return {k: deep_clean(v) for k, v in obj.items()}
+    else:
+        return obj
+
+
+def load_yaml(yaml_str: str) -> Any:
+    try:
+        return yaml.load(yaml_str, Loader=SafeLoader)
+    except yaml.YAMLError:
+        if SafeLoader is yaml.SafeLoader:
+            raise
+        return yaml.safe_load(yaml_str)
+
+
+def extract_yaml(resp: str) -> Dict[str, Any]:
+    """
+    Loads the last fenced YAML block of a response (or the whole response, minus a leading <think> block), with lone surrogates removed.
+    """
+    last_match = None
+    for last_match in FENCE_PATTERN.finditer(resp):
+        pass
+
+    if last_match is not None:
+        yaml_str = last_match.group(1).strip()
+    else:
+        yaml_str = THINK_PATTERN.sub("", resp, count=1).strip()
+
+    yaml_str = SURROGATE_PATTERN.sub("", yaml_str)
+
+    # *Surrogates can only reappear through escapes in double-quoted scalars (which libyaml rejects)
+    if SURROGATE_ESCAPE_PATTERN.search(yaml_str):
+        return deep_clean(yaml.safe_load(yaml_str))
+    return load_yaml(yaml_str)
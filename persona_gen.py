@@ -39,7 +39,10 @@ class GeneratePersona(Node):
                     "role": "user",
                     "content": PERSONA_GEN_PROMPT.format(goals, PERSONA_MAX_WORDS),
                 }
-            ]
+            ],
+            call_site="persona_gen",
+            cache=True,
+            cache_read=self.cur_retry == 0,  # *Cached persona failed validation
         )
 
         result = extract_yaml(resp)
@@ -117,7 +117,7 @@ properties:
         description: "Name of the function to call"
       arguments:
         type: object
-        description: "Arguments for the function matching its JSON schema"
+        description: "Arguments for the function matching its schema (see Function Schemas)"
       do_heartbeat:
         type: boolean
         description: "Whether you want to run another time after this response (e.g. to perform more function calls before sending the user a response). ONLY call heartbeats when necessary."
@@ -174,12 +174,12 @@ LLMs are a kind of deep neural network. They have been demonstrated to embed kno
 Render the input as a distilled list of succinct statements, assertions, associations, concepts, analogies, and metaphors. The idea is to capture as much, conceptually, as possible but with as few words as possible. Write it in a way that makes sense to you, as the future audience will be another language model, not a human.
 """.strip()
 
-RECURSIVE_SUMMARY_PROMPT = """
+BATCH_SUMMARY_PROMPT = """
 # MISSION
-You are writing a Recursive Summary for an advanced conversational agent. The summary is a compact, evolving record of the dialogue and meaningful events, preserving continuity and the agent's concise, humanlike cognitive voice.
+You are writing a Recursive Summary entry for an advanced conversational agent. Each entry is a compact record of one batch of dialogue and meaningful events evicted from the agent's context window, preserving continuity and the agent's concise, humanlike cognitive voice. Entries are later read in chronological order alongside older entries.
 
 # CONTEXT
-Use the given Agent Persona and User Persona to interpret new dialogue and events. Do not reconstruct the personas in the Recursive Summary. Incorporate prior Recursive Summary and all new relevant input, updating only what meaningfully changes understanding or behavior.
+Use the given Agent Persona and User Persona to interpret the dialogue and events. Do not reconstruct the personas in the summary. Summarise ONLY the given batch; do not restate earlier history.
 
 # HUMANLIKE COGNITIVE VOICE
 Maintain a brief internal-monologue tone: reflective, coherent, and humanlike. Keep language compact while preserving emotional nuance, uncertainty, and subjective interpretation when they shape understanding.
@@ -194,12 +194,10 @@ Retain only elements that affect:
 Discard all other details.
 
 # METHOD
-- Begin with the previous Recursive Summary as the base.
-- Integrate new dialogue and relevant events sequentially.
-- Update or replace only what meaningfully changes the situation.
+- Integrate the batch's dialogue and relevant events sequentially.
 - Compress aggressively while preserving humanlike cognitive tone.
 - Summarise concepts and interactions; quote full dialogue only if it is crucial for continuity or understanding.
-- Merge old and new into a single coherent first-person narrative.
+- Write a single coherent first-person narrative.
 
 # PERSONA FILES
 ## Agent Persona
@@ -212,9 +210,50 @@ Discard all other details.
 Output in yaml (including starting "```yaml" and closing "```" at start and end of your response respectively):
 ```yaml
 analysis: |
-    detailed step-by-step analysis of the conversation history (ONE string, will be discarded)
+    detailed step-by-step analysis of the conversation batch (ONE string, will be discarded)
 summary: |
-    new recursive summary (ONE string, final output to be used)
+    summary of the batch (ONE string, final output to be used)
+```
+""".strip()
+
+SUMMARY_ROLLUP_PROMPT = """
+# MISSION
+You are condensing consecutive Recursive Summary entries of an advanced conversational agent into one higher-level entry. The entry is a compact record of the covered period, preserving continuity and the agent's concise, humanlike cognitive voice.
+
+# CONTEXT
+Use the given Agent Persona and User Persona to interpret the entries. Do not reconstruct the personas in the summary. The entries are given in chronological order; later entries take precedence where they correct or update earlier ones.
+
+# HUMANLIKE COGNITIVE VOICE
+Maintain a brief internal-monologue tone: reflective, coherent, and humanlike. Keep language compact while preserving emotional nuance, uncertainty, and subjective interpretation when they shape understanding.
+
+# ESSENTIAL INFORMATION RULE
+Retain only elements that affect:
+- goals, decisions, or reasoning paths  
+- corrections or clarifications  
+- long-term user traits or preferences  
+- task progress, constraints, or misunderstandings  
+- emotionally or relationally significant shifts  
+Discard all other details.
+
+# METHOD
+- Merge the entries into a single coherent first-person narrative.
+- Keep what still matters by the end of the period; drop what was superseded.
+- Compress aggressively while preserving humanlike cognitive tone.
+
+# PERSONA FILES
+## Agent Persona
+{}
+
+## User Persona
+{}
+
+# FORMAT
+Output in yaml (including starting "```yaml" and closing "```" at start and end of your response respectively):
+```yaml
+analysis: |
+    detailed step-by-step analysis of the entries (ONE string, will be discarded)
+summary: |
+    condensed summary of the period (ONE string, final output to be used)
 ```
 """.strip()
 
@@ -239,3 +278,20 @@ persona: |
     output persona file (ONE string, final output to be used)
 ```
 """.strip()
+
+OUTPUT_REPAIR_PROMPT = """
+The response below was supposed to be a single yaml object with exactly these top-level fields, but it could not be parsed/validated.
+- emotions: list of [emotion name, intensity (integer 1-10)] pairs
+- thoughts: list of strings
+- function_call: object with name (string), arguments (object) and do_heartbeat (boolean)
+
+# ERROR
+{}
+
+# RESPONSE
+{}
+
+Fix ONLY the formatting so that it conforms to the fields above. Do not change the meaning, wording, function name or arguments unless required by the fix.
+
+Output in yaml (including starting "```yaml" and closing "```" at start and end of your response respectively).
+""".strip()
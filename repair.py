@@ -0,0 +1,227 @@
+import re
+from typing import Any, Callable, Iterator, List, Literal, Optional, Tuple, TypeVar
+
+import orjson
+import yaml
+
+from config import OUTPUT_REPAIR
+from llm import call_repair_llm, extract_yaml
+from parsing import (
+    LENIENT_FENCE_PATTERN,
+    LENIENT_THINK_PATTERN,
+    SURROGATE_PATTERN,
+    load_yaml,
+)
+from prompts import OUTPUT_REPAIR_PROMPT
+
+T = TypeVar("T")
+
+TOP_LEVEL_KEY_PATTERN = re.compile(
+    r"^(?:emotions|thoughts|function_call)\s*:", re.MULTILINE
+)
+EMOTION_STR_PATTERN = re.compile(r"^\s*(.*?)[\s:,(=-]+(\d+(?:\.\d+)?)\s*(?:/\s*10)?\)?\s*$")
+WHITESPACE_PATTERN = re.compile(r"\s+")
+
+REPAIR_MAX_OUTPUT_CHARS = 8000
+
+
+# *Deterministic repairs
+def candidate_documents(text: str) -> List[str]:
+    """
+    Plausible YAML/JSON documents in a malformed response, most likely first.
+    """
+    text = SURROGATE_PATTERN.sub("", LENIENT_THINK_PATTERN.sub("", text))
+
+    documents = [
+        match.group(1) for match in LENIENT_FENCE_PATTERN.finditer(text)
+    ][::-1]
+
+    if top_level_key_match := TOP_LEVEL_KEY_PATTERN.search(text):
+        documents.append(text[top_level_key_match.start() :].split("```")[0])
+
+    if "{" in text and "}" in text:
+        documents.append(text[text.index("{") : text.rindex("}") + 1])
+
+    documents.append(text)
+
+    return list(dict.fromkeys(d.strip() for d in documents if d.strip()))
+
+
+def lenient_load(document: str) -> Any:
+    for variant in (document, document.replace("\t", "    ")):
+        try:
+            return load_yaml(variant)
+        except yaml.YAMLError:
+            pass
+
+    return orjson.loads(document)
+
+
+def coerce_emotion(emotion: Any) -> Optional[List[Any]]:
+    if isinstance(emotion, dict) and len(emotion) == 1:
+        emotion = next(iter(emotion.items()))
+
+    if isinstance(emotion, str):
+        if not (emotion_match := EMOTION_STR_PATTERN.match(emotion)):
+            return None
+        emotion = emotion_match.groups()
+
+    if not isinstance(emotion, (list, tuple)) or len(emotion) != 2:
+        return None
+
+    name, score = emotion
+    try:
+        score = float(str(score).split("/")[0].strip())
+    except ValueError:
+        return None
+
+    return [str(name).strip(), min(max(round(score), 1), 10)]
+
+
+def coerce_call_agent_result(data: Any) -> Any:
+    if not isinstance(data, dict):
+        return data
+
+    # *The LLM sometimes nests its output (e.g. mirroring the input message schema)
+    if "function_call" not in data:
+        for key in ("content", "response", "output"):
+            if isinstance(data.get(key), dict) and "function_call" in data[key]:
+                data = data[key]
+                break
+
+    data = dict(data)
+
+    emotions = data.get("emotions")
+    if isinstance(emotions, dict):
+        emotions = list(emotions.items())
+    if isinstance(emotions, list):
+        data["emotions"] = [
+            coerced for e in emotions if (coerced := coerce_emotion(e)) is not None
+        ]
+
+    thoughts = data.get("thoughts")
+    if isinstance(thoughts, str):
+        data["thoughts"] = [thoughts]
+    elif isinstance(thoughts, list):
+        data["thoughts"] = [t if isinstance(t, str) else str(t) for t in thoughts]
+
+    function_call = data.get("function_call")
+    if isinstance(function_call, dict):
+        function_call = dict(function_call)
+
+        if function_call.get("arguments") is None:
+            function_call["arguments"] = {}
+
+        do_heartbeat = function_call.get("do_heartbeat", False)
+        if isinstance(do_heartbeat, str):
+            do_heartbeat = do_heartbeat.strip().lower() in ("true", "yes", "1")
+        function_call["do_heartbeat"] = bool(do_heartbeat)
+
+        data["function_call"] = function_call
+
+    return data
+
+
+def deterministic_repair(text: str, validate: Callable[[Any], T]) -> Optional[T]:
+    for document in candidate_documents(text):
+        try:
+            return validate(coerce_call_agent_result(lenient_load(document)))
+        except Exception:
+            continue
+
+    return None
+
+
+# *LLM repair
+def normalise_whitespace(text: str) -> str:
+    return WHITESPACE_PATTERN.sub(" ", text).strip()
+
+
+def argument_values(value: Any) -> Iterator[str]:
+    if isinstance(value, dict):
+        for v in value.values():
+            yield from argument_values(v)
+    elif isinstance(value, list):
+        for v in value:
+            yield from argument_values(v)
+    elif isinstance(value, str):
+        yield value
+    elif isinstance(value, (int, float)) and not isinstance(value, bool):
+        yield str(value)
+
+
+def arguments_from_original(data: Any, text: str) -> bool:
+    """
+    Whether the function name and every argument value of a repaired output occur in the original output (modulo whitespace and quote escaping).
+    The repair model may only fix structure, not rewrite what the agent decided to say or store.
+    """
+    if not isinstance(data, dict) or not isinstance(data.get("function_call"), dict):
+        return True  # *Rejected by validation anyway
+
+    originals = [
+        normalise_whitespace(variant)
+        for variant in (
+            text,
+            text.replace('\\"', '"').replace("\\n", "\n").replace("''", "'"),
+        )
+    ]
+
+    function_call = data["function_call"]
+    return all(
+        any(normalise_whitespace(value) in original for original in originals)
+        for value in (
+            str(function_call.get("name", "")),
+            *argument_values(function_call.get("arguments")),
+        )
+    )
+
+
+def llm_repair(text: str, error: Exception, validate: Callable[[Any], T]) -> Optional[T]:
+    """
+    Sends only the malformed output and the error to the repair model (much cheaper than regenerating from the full context).
+    """
+    try:
+        resp = call_repair_llm(
+            [
+                {
+                    "role": "user",
+                    "content": OUTPUT_REPAIR_PROMPT.format(
+                        str(error)[:REPAIR_MAX_OUTPUT_CHARS // 4],
+                        text[-REPAIR_MAX_OUTPUT_CHARS:],
+                    ),
+                }
+            ]
+        )
+    except Exception as e:
+        print(f"Output repair LLM call failed: {e}", flush=True)
+        return None
+
+    def validate_against_original(data: Any) -> T:
+        if not arguments_from_original(data, text):
+            raise ValueError("Repair changed the function call")
+        return validate(data)
+
+    try:
+        return validate_against_original(coerce_call_agent_result(extract_yaml(resp)))
+    except Exception:
+        return deterministic_repair(resp, validate_against_original)
+
+
+def repair_call_agent_output(
+    text: str, error: Exception, validate: Callable[[Any], T]
+) -> Optional[Tuple[T, Literal["deterministic", "llm"]]]:
+    """
+    Returns (validated result, repair kind), or None if the output could not be repaired (the caller should then regenerate).
+    """
+    if OUTPUT_REPAIR == "off":
+        return None
+
+    if (result := deterministic_repair(text, validate)) is not None:
+        return result, "deterministic"
+
+    if OUTPUT_REPAIR == "llm" and (
+        result := llm_repair(text, error, validate)
+    ) is not None:
+        return result, "llm"
+
+    return None
@@ -0,0 +1,216 @@
+import re
+from typing import Any, Dict, Optional, Tuple
+
+FUNCTION_CALL_PATTERN = re.compile(r"""["']?function_call["']?\s*:""")
+SEND_MESSAGE_NAME_PATTERN = re.compile(
+    r"""["']?name["']?\s*:\s*["']?send_message(?![\w])"""
+)
+MESSAGE_KEY_PATTERN = re.compile(r"""["']?message["']?\s*:[ \t]*""")
+BLOCK_SCALAR_HEADER_PATTERN = re.compile(r"[|>][+-]?[0-9]?[ \t]*\n")
+FENCE_HEADER_PATTERN = re.compile(r"(?:ya?ml)?\s*", re.IGNORECASE)  # *As in parsing.FENCE_PATTERN
+
+JSON_ESCAPES = {
+    '"': '"',
+    "\\": "\\",
+    "/": "/",
+    "b": "\b",
+    "f": "\f",
+    "n": "\n",
+    "r": "\r",
+    "t": "\t",
+}
+
+
+def parse_partial_double_quoted(text: str) -> Tuple[str, bool]:
+    chars = []
+    i = 0
+    while i < len(text):
+        char = text[i]
+        if char == '"':
+            return "".join(chars), True
+        if char == "\\":
+            if i + 1 >= len(text):
+                break  # *Incomplete escape, wait for more tokens
+            escape = text[i + 1]
+            if escape == "u":
+                if i + 6 > len(text):
+                    break
+                try:
+                    chars.append(chr(int(text[i + 2 : i + 6], 16)))
+                except ValueError:
+                    pass
+                i += 6
+                continue
+            chars.append(JSON_ESCAPES.get(escape, escape))
+            i += 2
+            continue
+        chars.append(char)
+        i += 1
+
+    return "".join(chars), False
+
+
+def parse_partial_single_quoted(text: str) -> Tuple[str, bool]:
+    chars = []
+    i = 0
+    while i < len(text):
+        char = text[i]
+        if char == "'":
+            if i + 1 >= len(text):
+                break  # *Could be an escaped quote ('')
+            if text[i + 1] == "'":
+                chars.append("'")
+                i += 2
+                continue
+            return "".join(chars), True
+        chars.append(char)
+        i += 1
+
+    return "".join(chars), False
+
+
+def parse_partial_block_scalar(text: str, folded: bool) -> Tuple[str, bool]:
+    lines = text.split("\n")
+    complete_lines, last_line = lines[:-1], lines[-1]
+
+    indent: Optional[int] = None
+    content_lines = []
+    for line in complete_lines:
+        if line.strip() == "":
+            content_lines.append("")
+            continue
+
+        line_indent = len(line) - len(line.lstrip(" "))
+        if indent is None:
+            indent = line_indent
+        if line_indent < indent or indent == 0:
+            return join_block_lines(content_lines, folded).rstrip("\n"), True
+
+        content_lines.append(line[indent:])
+
+    if last_line.strip() != "" and indent is not None:
+        last_line_indent = len(last_line) - len(last_line.lstrip(" "))
+        if last_line_indent < indent:
+            return join_block_lines(content_lines, folded).rstrip("\n"), True
+        content_lines.append(last_line[indent:])
+
+    return join_block_lines(content_lines, folded).rstrip("\n"), False
+
+
+def join_block_lines(lines: list, folded: bool) -> str:
+    if not folded:
+        return "\n".join(lines)
+
+    text = ""
+    for line in lines:
+        if line == "":
+            text += "\n"
+        elif text == "" or text.endswith("\n"):
+            text += line
+        else:
+            text += " " + line
+
+    return text
+
+
+def partial_document(resp: str) -> Optional[str]:
+    """
+    The part of a partially generated output that extract_yaml will load: the last (possibly still open) fenced block, or the whole output.
+    A leading <think> block is skipped; None while it (or a fence marker) is still incomplete.
+    """
+    if resp.startswith("<think>"):
+        think_end = resp.find("</think>")
+        if think_end == -1:
+            return None
+        resp = resp[think_end + len("</think>") :]
+
+    if (len(resp) - len(resp.rstrip("`"))) % 3 != 0:
+        return None  # *Could be the start of a fence
+
+    parts = resp.split("```")
+    if len(parts) == 1:
+        return resp
+
+    # *An odd number of fences means the last one is still open
+    fenced = parts[-1] if len(parts) % 2 == 0 else parts[-2]
+    return fenced[FENCE_HEADER_PATTERN.match(fenced).end() :]
+
+
+def partial_send_message(resp: str) -> Optional[Tuple[str, bool]]:
+    """
+    Extracts the (possibly incomplete) send_message text from a partially generated agent output (YAML or JSON).
+    Returns (message text so far, whether the message is complete), or None if no send_message call has been detected yet.
+    """
+    document = partial_document(resp)
+    if document is None:
+        return None
+    resp = document
+
+    function_call_match = FUNCTION_CALL_PATTERN.search(resp)
+    if not function_call_match:
+        return None
+
+    name_match = SEND_MESSAGE_NAME_PATTERN.search(resp, function_call_match.end())
+    if not name_match:
+        return None
+
+    message_match = MESSAGE_KEY_PATTERN.search(resp, name_match.end())
+    if not message_match:
+        return None
+
+    value = resp[message_match.end() :]
+    if value == "":
+        return None
+
+    match value[0]:
+        case '"':
+            return parse_partial_double_quoted(value[1:])
+        case "'":
+            return parse_partial_single_quoted(value[1:])
+        case "|" | ">":
+            header_match = BLOCK_SCALAR_HEADER_PATTERN.match(value)
+            if not header_match:
+                return None
+            return parse_partial_block_scalar(
+                value[header_match.end() :], value[0] == ">"
+            )
+        case _:
+            line, newline, _ = value.partition("\n")
+            return line.strip(), bool(newline)
+
+
+class SendMessageStream:
+    """
+    Feeds streamed agent output and returns newly available send_message text (to be forwarded as deltas).
+    """
+
+    def __init__(self) -> None:
+        self.resp = ""
+        self.sent = ""
+
+    def feed(self, delta: str) -> str:
+        self.resp += delta
+
+        partial = partial_send_message(self.resp)
+        if partial is None:
+            return ""
+
+        message, _ = partial
+        if not message.startswith(self.sent) or len(message) <= len(self.sent):
+            return ""
+
+        new_text = message[len(self.sent) :]
+        self.sent = message
+
+        return new_text
+
+    def delivered(self, function_call: Dict[str, Any]) -> bool:
+        """
+        Whether the text streamed so far is a prefix of the send_message call parsed from the full output (otherwise the client must discard it).
+        """
+        message = (function_call.get("arguments") or {}).get("message")
+        return (
+            function_call.get("name") == "send_message"
+            and isinstance(message, str)
+            and message.startswith(self.sent)
+        )
@@ -0,0 +1,17 @@
+import sys
+from os import environ, path, remove
+from tempfile import NamedTemporaryFile
+
+# *The modules under test are flat top-level modules of the repository
+sys.path.insert(0, path.dirname(path.dirname(path.abspath(__file__))))
+
+# *config reads the backends file at import: point it at an empty one unless one is given
+if "BACKENDS_CONFIG" not in environ:
+    with NamedTemporaryFile(
+        "w", prefix="backends-", suffix=".yaml", delete=False
+    ) as backends_file:
+        backends_file.write("llm_backends: []\nvlm_backends: []\n")
+    environ["BACKENDS_CONFIG"] = backends_file.name
+
+    def pytest_unconfigure() -> None:
+        remove(backends_file.name)
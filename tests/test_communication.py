@@ -0,0 +1,39 @@
+from multiprocessing import Pipe
+
+from communication import CommandMailbox
+
+
+def test_mailbox_collects_without_waiting():
+    parent_conn, child_conn = Pipe()
+    mailbox = CommandMailbox(child_conn)
+
+    assert not mailbox.check()
+    assert mailbox.take() == []
+
+    parent_conn.send("halt_soon")
+    parent_conn.send("halt_soon")
+    assert mailbox.take() == ["halt_soon"]
+
+
+def test_halt_supersedes_halt_soon():
+    parent_conn, child_conn = Pipe()
+    mailbox = CommandMailbox(child_conn)
+
+    parent_conn.send("halt_soon")
+    parent_conn.send("halt")
+
+    assert mailbox.halt_requested()
+    assert mailbox.halt_requested()  # *Checking does not consume
+    assert mailbox.take() == ["halt"]
+    assert not mailbox.halt_requested()
+
+
+def test_mailbox_survives_a_closed_parent():
+    parent_conn, child_conn = Pipe()
+    mailbox = CommandMailbox(child_conn)
+
+    parent_conn.send("halt")
+    parent_conn.close()
+
+    assert mailbox.take() == ["halt"]
+    assert mailbox.take() == []
@@ -0,0 +1,81 @@
+from typing import List, Literal, Optional, Union
+
+import orjson
+import yaml
+from pydantic import BaseModel, Field
+
+from function_schemas import (
+    SCHEMA_RENDERERS,
+    render_json_schema,
+    render_typescript_schema,
+    render_yaml_schema,
+)
+
+
+class Filter(BaseModel):
+    category: str
+    limit: int = 10
+
+
+class recall_search(BaseModel):
+    """Searches Recall Storage by text (exact match)."""
+
+    query: str = Field(description="Search query.")
+    page: Optional[int] = Field(default=0, ge=0, description="Result list page number.")
+    mode: Literal["exact", "fuzzy"] = "exact"
+    tags: List[Union[str, int]] = []
+    filter: Optional[Filter] = None
+
+
+class no_arguments(BaseModel):
+    pass
+
+
+def test_render_typescript_schema():
+    assert (
+        render_typescript_schema(recall_search.model_json_schema())
+        == """// Searches Recall Storage by text (exact match).
+recall_search({
+  query: string, // Search query.
+  page?: integer, // minimum: 0, default: 0. Result list page number.
+  mode?: "exact" | "fuzzy", // default: "exact"
+  tags?: (string | integer)[], // default: []
+  filter?: { category: string, limit?: integer },
+})"""
+    )
+
+
+def test_render_typescript_schema_without_arguments():
+    assert render_typescript_schema(no_arguments.model_json_schema()) == "no_arguments({})"
+
+
+def test_render_json_schema_is_minimal():
+    rendered = orjson.loads(render_json_schema(recall_search.model_json_schema()))
+
+    assert rendered["name"] == "recall_search"
+    assert rendered["description"] == "Searches Recall Storage by text (exact match)."
+    assert rendered["parameters"]["required"] == ["query"]
+    assert "type" not in rendered["parameters"]
+    assert "title" not in orjson.dumps(rendered).decode("utf-8")
+
+    # *Optional fields lose their null branch; required nullable fields would keep it
+    assert rendered["parameters"]["properties"]["page"] == {
+        "type": "integer",
+        "minimum": 0,
+        "default": 0,
+        "description": "Result list page number.",
+    }
+
+
+def test_render_yaml_schema_round_trips():
+    schema = recall_search.model_json_schema()
+
+    assert yaml.safe_load(render_yaml_schema(schema)) == schema
+
+
+def test_renderers_are_shorter_than_yaml():
+    schema = recall_search.model_json_schema()
+    yaml_length = len(SCHEMA_RENDERERS["yaml"](schema))
+
+    assert len(SCHEMA_RENDERERS["typescript"](schema)) < yaml_length
+    assert len(SCHEMA_RENDERERS["json"](schema)) < yaml_length
@@ -0,0 +1,157 @@
+from typing import Dict, Sequence
+
+import numpy as np
+
+from lexical import (
+    bm25_from_statistics,
+    lexical_tokenise,
+    reciprocal_rank_fusion,
+    simhash,
+    simhash_similarities,
+    term_frequencies,
+)
+
+DOCUMENTS = [
+    "The cat sat on the mat.",
+    "Dogs chase cats around the garden.",
+    "A cat, a cat and another cat!",
+    "",
+    "Nothing relevant here.",
+]
+
+
+def bm25_scores(
+    query: str, documents: Sequence[str], k1: float = 1.5, b: float = 0.75
+) -> np.ndarray:
+    """
+    Reference BM25 that tokenises the whole corpus, to check bm25_from_statistics against.
+    """
+    query_terms = list(dict.fromkeys(lexical_tokenise(query)))
+    if len(documents) == 0 or len(query_terms) == 0:
+        return np.zeros(len(documents), dtype=np.float64)
+
+    term_index: Dict[str, int] = {term: i for i, term in enumerate(query_terms)}
+
+    # *Term frequency matrix (documents x query terms)
+    tf = np.zeros((len(documents), len(query_terms)), dtype=np.float64)
+    doc_lengths = np.zeros(len(documents), dtype=np.float64)
+    for doc_no, document in enumerate(documents):
+        counts = term_frequencies(document)
+        doc_lengths[doc_no] = counts.total()
+        for term, count in counts.items():
+            if (term_no := term_index.get(term)) is not None:
+                tf[doc_no, term_no] = count
+
+    return bm25_from_statistics(
+        tf,
+        doc_lengths,
+        np.count_nonzero(tf, axis=0),
+        len(documents),
+        float(doc_lengths.mean()),
+        k1,
+        b,
+    )
+
+
+def test_lexical_tokenise_lowercases_and_drops_punctuation():
+    assert lexical_tokenise("Hello, World! It's 2024.") == [
+        "hello",
+        "world",
+        "it",
+        "s",
+        "2024",
+    ]
+
+
+def test_term_frequencies_counts_tokens():
+    counts = term_frequencies("a cat, a cat and another cat")
+    assert counts["cat"] == 3
+    assert counts["a"] == 2
+    assert counts.total() == 7
+
+
+def test_bm25_scores_rank_matching_documents_first():
+    scores = bm25_scores("cat", DOCUMENTS)
+
+    assert scores.shape == (len(DOCUMENTS),)
+    assert np.argmax(scores) == 2  # *Highest term frequency
+    assert scores[0] > 0
+    assert scores[1] == 0  # *"cats" is a different token
+    assert scores[3] == 0
+    assert scores[4] == 0
+
+
+def test_bm25_scores_without_query_terms_or_documents():
+    assert np.array_equal(bm25_scores("", DOCUMENTS), np.zeros(len(DOCUMENTS)))
+    assert np.array_equal(bm25_scores("?!", DOCUMENTS), np.zeros(len(DOCUMENTS)))
+    assert len(bm25_scores("cat", [])) == 0
+
+
+def test_bm25_scores_ignore_repeated_query_terms():
+    assert np.allclose(bm25_scores("cat cat cat", DOCUMENTS), bm25_scores("cat", DOCUMENTS))
+
+
+def test_bm25_from_statistics_matches_bm25_scores_on_a_subset():
+    # *Only the documents matching a query term are needed, as long as df, no_docs and the average length cover the corpus
+    query_terms = ["cat", "mat"]
+    counts = [term_frequencies(document) for document in DOCUMENTS]
+    matching = [i for i, c in enumerate(counts) if any(c[t] for t in query_terms)]
+
+    tf = np.array([[counts[i][t] for t in query_terms] for i in matching], dtype=np.float64)
+    doc_lengths = np.array([counts[i].total() for i in matching], dtype=np.float64)
+
+    scores = bm25_from_statistics(
+        tf,
+        doc_lengths,
+        np.count_nonzero(tf, axis=0),
+        len(DOCUMENTS),
+        float(np.mean([c.total() for c in counts])),
+    )
+
+    assert np.allclose(scores, bm25_scores("cat mat", DOCUMENTS)[matching])
+
+
+def test_reciprocal_rank_fusion_rewards_agreement():
+    scores = reciprocal_rank_fusion(
+        [np.array([0, 1, 2]), np.array([1, 0, 3])], k=60
+    )
+
+    assert scores.shape == (4,)
+    assert np.isclose(scores[0], 1 / 61 + 1 / 62)
+    assert np.isclose(scores[1], 1 / 62 + 1 / 61)
+    assert np.isclose(scores[2], 1 / 63)
+    assert np.isclose(scores[3], 1 / 63)
+
+
+def test_reciprocal_rank_fusion_with_empty_rankings():
+    assert len(reciprocal_rank_fusion([np.array([], dtype=np.int64)])) == 0
+    assert np.allclose(
+        reciprocal_rank_fusion([np.array([], dtype=np.int64), np.array([1])], k=0),
+        [0.0, 1.0],
+    )
+
+
+def test_simhash_is_deterministic_and_64_bit():
+    signature = simhash("The quick brown fox jumps over the lazy dog")
+
+    assert signature == simhash("the quick brown fox, jumps over the lazy dog!")
+    assert 0 <= signature < 2**64
+    assert simhash("") == 0
+
+
+def test_simhash_similarities_separate_near_duplicates():
+    text = "Archival storage keeps long documents split into chunks for later search by the agent."
+    signatures = np.array(
+        [
+            simhash(text),
+            simhash(text.replace("later", "future")),
+            simhash("Completely unrelated sentence about cooking pasta with tomatoes and basil."),
+        ],
+        dtype=np.uint64,
+    )
+
+    similarities = simhash_similarities(simhash(text), signatures)
+
+    assert similarities[0] == 1.0
+    assert similarities[1] > similarities[2]
+    assert len(simhash_similarities(0, np.zeros(0, dtype=np.uint64))) == 0
@@ -0,0 +1,116 @@
+import os
+from multiprocessing import Process
+
+import pytest
+
+import llm_limiter
+from llm_limiter import (
+    LAST_REFILL,
+    MAX_LEASES,
+    REQUEST_BUCKET,
+    TOKEN_BUCKET,
+    RateLimiter,
+)
+from llm_router import Candidate
+
+
+def make_limiter(**limits):
+    candidate = Candidate(0, "backend", None, "model", limits=limits)
+    return RateLimiter([candidate]), candidate
+
+
+def test_unlimited_candidates_always_acquire():
+    limiter, candidate = make_limiter()
+
+    assert all(limiter.acquire(candidate, 10**6, max_wait=0) for _ in range(100))
+    limiter.release(candidate, 10**6, 10**6)
+    assert limiter.stats() == []
+
+
+def test_request_bucket_empties_and_refills():
+    limiter, candidate = make_limiter(rpm=2)
+
+    assert limiter.try_acquire(candidate, 1)
+    assert limiter.try_acquire(candidate, 1)
+    assert not limiter.try_acquire(candidate, 1)
+
+    # *Half a minute later the bucket has refilled by half of rpm
+    limiter.set_field(0, LAST_REFILL, limiter.field(0, LAST_REFILL) - 30)
+    assert limiter.try_acquire(candidate, 1)
+    assert not limiter.try_acquire(candidate, 1)
+
+    # *Refill is capped at one minute's worth
+    limiter.set_field(0, LAST_REFILL, limiter.field(0, LAST_REFILL) - 3600)
+    limiter.refill(candidate, limiter.field(0, LAST_REFILL) + 3600)
+    assert limiter.field(0, REQUEST_BUCKET) == pytest.approx(2)
+
+
+def test_token_bucket_and_usage_correction():
+    limiter, candidate = make_limiter(tpm=1000)
+
+    assert limiter.try_acquire(candidate, 600)
+    assert limiter.field(0, TOKEN_BUCKET) == pytest.approx(400, abs=1)
+    assert not limiter.try_acquire(candidate, 600)
+
+    # *Fewer tokens were used than estimated: the difference is returned
+    limiter.release(candidate, 600, 100)
+    assert limiter.field(0, TOKEN_BUCKET) == pytest.approx(900, abs=1)
+
+    # *Never above the bucket size
+    limiter.release(candidate, 600, 0)
+    assert limiter.field(0, TOKEN_BUCKET) == pytest.approx(1000)
+
+
+def test_oversized_request_only_needs_a_full_bucket():
+    limiter, candidate = make_limiter(tpm=1000)
+
+    assert limiter.try_acquire(candidate, 5000)
+    assert not limiter.try_acquire(candidate, 1)
+
+
+def test_concurrency_leases():
+    limiter, candidate = make_limiter(max_concurrency=2)
+
+    assert limiter.try_acquire(candidate, 1)
+    assert limiter.try_acquire(candidate, 1)
+    assert not limiter.try_acquire(candidate, 1)
+    assert limiter.stats()[0]["in_flight"] == 2
+
+    limiter.release(candidate, 1)
+    assert limiter.stats()[0]["in_flight"] == 1
+    assert limiter.try_acquire(candidate, 1)
+
+
+def test_leases_of_dead_processes_are_reclaimed():
+    limiter, candidate = make_limiter(max_concurrency=1)
+
+    process = Process(target=os.getpid)
+    process.start()
+    process.join()
+    limiter.leases[0] = process.pid  # *Held by a worker that has since exited
+
+    assert limiter.try_acquire(candidate, 1)
+    assert limiter.leases[0] == os.getpid()
+
+
+def test_lease_slots_are_per_candidate():
+    first = Candidate(0, "backend", None, "first", limits={"max_concurrency": 1})
+    second = Candidate(1, "backend", None, "second", limits={"max_concurrency": 1})
+    limiter = RateLimiter([first, second])
+
+    assert limiter.try_acquire(first, 1)
+    assert limiter.try_acquire(second, 1)
+    assert limiter.leases[0] == os.getpid()
+    assert limiter.leases[MAX_LEASES] == os.getpid()
+
+
+def test_acquire_gives_up_after_max_wait(monkeypatch):
+    monkeypatch.setattr(llm_limiter, "POLL_INTERVAL", 0.01)
+    limiter, candidate = make_limiter(rpm=1)
+
+    assert limiter.acquire(candidate, 1, max_wait=0)
+    assert not limiter.acquire(candidate, 1, max_wait=0.05)
+
+    stats = limiter.stats()[0]
+    assert stats["no_rejected"] == 1
+    assert stats["throttled_seconds"] >= 0.05
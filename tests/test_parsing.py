@@ -0,0 +1,67 @@
+from glob import glob
+from os import path
+
+import pytest
+import yaml
+
+import parsing
+from parsing import extract_yaml, load_yaml
+
+CORPUS_FILES = sorted(
+    glob(
+        path.join(
+            path.dirname(path.dirname(path.abspath(__file__))),
+            "benchmark_corpus",
+            "extract_yaml",
+            "*.txt",
+        )
+    )
+)
+
+
+class RejectingLoader(yaml.SafeLoader):
+    # *Stands in for a libyaml loader that rejects an input the pure-Python loader accepts
+    def __init__(self, stream):
+        raise yaml.YAMLError("rejected")
+
+
+@pytest.mark.parametrize("corpus_file", CORPUS_FILES, ids=path.basename)
+def test_extract_yaml_matches_the_pure_python_loader(corpus_file, monkeypatch):
+    with open(corpus_file, "r", encoding="utf-8") as f:
+        resp = f.read()
+
+    fast = extract_yaml(resp)
+    monkeypatch.setattr(parsing, "SafeLoader", yaml.SafeLoader)
+
+    assert fast == extract_yaml(resp)
+
+
+def test_load_yaml_falls_back_when_the_fast_loader_rejects(monkeypatch):
+    monkeypatch.setattr(parsing, "SafeLoader", RejectingLoader)
+
+    assert load_yaml("a: [1, 2]") == {"a": [1, 2]}
+
+
+def test_load_yaml_raises_without_a_fast_loader(monkeypatch):
+    monkeypatch.setattr(parsing, "SafeLoader", yaml.SafeLoader)
+
+    with pytest.raises(yaml.YAMLError):
+        load_yaml("a: [1, 2")
+
+
+def test_extract_yaml_uses_the_last_fence():
+    resp = "Example:\n```yaml\na: 1\n```\nAnswer:\n```yml\na: 2\n```"
+
+    assert extract_yaml(resp) == {"a": 2}
+
+
+def test_extract_yaml_strips_a_leading_think_block():
+    resp = "<think>\nkey: not this\n</think>\nkey: value"
+
+    assert extract_yaml(resp) == {"key": "value"}
+
+
+def test_extract_yaml_removes_lone_surrogates():
+    assert extract_yaml("message: a\ud800b") == {"message": "ab"}
+    assert extract_yaml('message: "a\\ud800b"') == {"message": "ab"}
+    assert extract_yaml('message: "caf\\u00e9"') == {"message": "café"}
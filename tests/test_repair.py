@@ -0,0 +1,175 @@
+from typing import Annotated, Any, Dict, List, Tuple
+
+import pytest
+from pydantic import BaseModel, conint
+
+import repair
+from repair import (
+    arguments_from_original,
+    candidate_documents,
+    coerce_call_agent_result,
+    coerce_emotion,
+    deterministic_repair,
+    repair_call_agent_output,
+)
+
+
+class FunctionCall(BaseModel):
+    name: str
+    arguments: Dict[str, Any]
+    do_heartbeat: bool
+
+
+class Result(BaseModel):  # *Same shape as agent.CallAgentResult
+    emotions: List[Tuple[str, Annotated[int, conint(ge=1, le=10)]]]
+    thoughts: List[str]
+    function_call: FunctionCall
+
+
+def test_candidate_documents_prefer_the_last_fence_and_drop_think_blocks():
+    text = """<think>```yaml
+bogus: true
+```</think>
+First try:
+```yaml
+thoughts: [first]
+```
+Second try:
+```json
+{"thoughts": ["second"]}
+```"""
+
+    documents = candidate_documents(text)
+
+    assert documents[0] == '{"thoughts": ["second"]}'
+    assert documents[1] == "thoughts: [first]"
+    assert not any("bogus" in document for document in documents[:2])
+
+
+def test_candidate_documents_accept_an_unclosed_fence():
+    assert candidate_documents("```yaml\nthoughts: [cut off]")[0] == "thoughts: [cut off]"
+
+
+@pytest.mark.parametrize(
+    "emotion, expected",
+    [
+        (["calm", 7], ["calm", 7]),
+        (["calm", "8/10"], ["calm", 8]),
+        (["calm", 12], ["calm", 10]),
+        (["calm", 0.2], ["calm", 1]),
+        ({"curious": 6}, ["curious", 6]),
+        ("joy (9/10)", ["joy", 9]),
+        ("relief: 4", ["relief", 4]),
+        ("just words", None),
+        (["calm", "high"], None),
+        (["too", "many", "parts"], None),
+    ],
+)
+def test_coerce_emotion(emotion, expected):
+    assert coerce_emotion(emotion) == expected
+
+
+def test_coerce_call_agent_result_fixes_common_shape_errors():
+    data = coerce_call_agent_result(
+        {
+            "response": {
+                "emotions": {"calm": "7/10", "unknown": "n/a"},
+                "thoughts": "a single thought",
+                "function_call": {
+                    "name": "send_message",
+                    "arguments": None,
+                    "do_heartbeat": "yes",
+                },
+            }
+        }
+    )
+
+    assert data == {
+        "emotions": [["calm", 7]],
+        "thoughts": ["a single thought"],
+        "function_call": {"name": "send_message", "arguments": {}, "do_heartbeat": True},
+    }
+
+
+def test_deterministic_repair_of_tab_indented_yaml_with_chatter():
+    text = """Sure! Here is my answer:
+emotions:
+\t- ["calm", 7]
+thoughts:
+\t- Reply to the user
+function_call:
+\tname: send_message
+\targuments:
+\t\tmessage: Hello there
+\tdo_heartbeat: false
+```"""
+
+    result = deterministic_repair(text, Result.model_validate)
+
+    assert result is not None
+    assert result.function_call.arguments == {"message": "Hello there"}
+    assert result.emotions == [("calm", 7)]
+
+
+def test_deterministic_repair_of_json_inside_prose():
+    text = 'I will call a function now: {"emotions": [["calm", "5"]], "thoughts": "ok", "function_call": {"name": "send_message", "arguments": {"message": "hi"}, "do_heartbeat": "false"}} Thanks.'
+
+    result = deterministic_repair(text, Result.model_validate)
+
+    assert result is not None
+    assert result.function_call.name == "send_message"
+    assert result.function_call.do_heartbeat is False
+
+
+def test_deterministic_repair_gives_up_on_garbage():
+    assert deterministic_repair("no structure at all", Result.model_validate) is None
+
+
+def test_arguments_from_original_allows_structural_fixes_only():
+    original = 'function_call: {name: send_message, arguments: {message: "She said \\"hi\\"\n  twice", count: 2}}'
+    repaired = {
+        "function_call": {
+            "name": "send_message",
+            "arguments": {"message": 'She said "hi" twice', "count": 2},
+        }
+    }
+
+    assert arguments_from_original(repaired, original)
+
+    repaired["function_call"]["arguments"]["message"] = "Something else entirely"
+    assert not arguments_from_original(repaired, original)
+
+    renamed = {"function_call": {"name": "archival_storage_insert", "arguments": {}}}
+    assert not arguments_from_original(renamed, original)
+
+
+def test_repair_call_agent_output_modes(monkeypatch):
+    text = "```yaml\nemotions: [[calm, 7]]\nthoughts: one thought\nfunction_call: {name: send_message, arguments: {message: hi}}\n```"
+
+    monkeypatch.setattr(repair, "OUTPUT_REPAIR", "off")
+    assert repair_call_agent_output(text, ValueError(), Result.model_validate) is None
+
+    monkeypatch.setattr(repair, "OUTPUT_REPAIR", "deterministic")
+    result, kind = repair_call_agent_output(text, ValueError(), Result.model_validate)
+    assert kind == "deterministic"
+    assert result.thoughts == ["one thought"]
+
+
+def test_llm_repair_rejects_rewritten_arguments(monkeypatch):
+    text = "function_call: name: send_message arguments: message: original words"
+    monkeypatch.setattr(repair, "OUTPUT_REPAIR", "llm")
+
+    def call_repair_llm(messages):
+        return "```yaml\nemotions: [[calm, 7]]\nthoughts: [fixed]\nfunction_call:\n  name: send_message\n  arguments:\n    message: original words\n  do_heartbeat: false\n```"
+
+    monkeypatch.setattr(repair, "call_repair_llm", call_repair_llm)
+    result, kind = repair_call_agent_output(text, ValueError(), Result.model_validate)
+    assert kind == "llm"
+    assert result.function_call.arguments == {"message": "original words"}
+
+    monkeypatch.setattr(
+        repair,
+        "call_repair_llm",
+        lambda messages: call_repair_llm(messages).replace("original words", "made up"),
+    )
+    assert repair_call_agent_output(text, ValueError(), Result.model_validate) is None
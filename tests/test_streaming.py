@@ -0,0 +1,192 @@
+import orjson
+import pytest
+import yaml
+
+from streaming import SendMessageStream, partial_send_message
+
+YAML_OUTPUTS = [
+    # *Double-quoted with escapes (\", \n, \u) that a chunk boundary can split
+    """emotions:
+  - ["calm", 7]
+thoughts:
+  - Answer the user
+function_call:
+  name: send_message
+  arguments:
+    message: "She said \\"hi\\"\\nthen left \\u00e9t\\u00e9 \\\\ done"
+  do_heartbeat: false
+""",
+    # *Single-quoted with an escaped quote
+    """function_call:
+  name: send_message
+  arguments:
+    message: 'It''s done, isn''t it?'
+  do_heartbeat: false
+""",
+    # *Literal block scalar
+    """function_call:
+  name: send_message
+  arguments:
+    message: |
+      First line
+      Second line
+
+      After a blank line
+  do_heartbeat: false
+""",
+    # *Folded block scalar
+    """function_call:
+  name: send_message
+  arguments:
+    message: >
+      Folded
+      into one line
+  do_heartbeat: false
+""",
+    # *Plain scalar
+    """function_call:
+  name: send_message
+  arguments:
+    message: Just a plain answer
+  do_heartbeat: false
+""",
+]
+
+
+def expected_message(output: str) -> str:
+    return yaml.safe_load(output)["function_call"]["arguments"]["message"].rstrip("\n")
+
+
+def stream(output: str, chunk_size: int) -> str:
+    send_message_stream = SendMessageStream()
+    return "".join(
+        send_message_stream.feed(output[i : i + chunk_size])
+        for i in range(0, len(output), chunk_size)
+    )
+
+
+@pytest.mark.parametrize("output", YAML_OUTPUTS)
+@pytest.mark.parametrize("chunk_size", [1, 2, 3, 7, 1000])
+def test_streamed_deltas_reassemble_the_message(output, chunk_size):
+    assert stream(output, chunk_size) == expected_message(output)
+
+
+@pytest.mark.parametrize("chunk_size", [1, 5, 1000])
+def test_streamed_deltas_from_json_output(chunk_size):
+    message = 'Quotes " and backslashes \\ and\nnewlines, plus café'
+    output = orjson.dumps(
+        {
+            "thoughts": ["reply"],
+            "function_call": {
+                "name": "send_message",
+                "arguments": {"message": message},
+                "do_heartbeat": False,
+            },
+        }
+    ).decode("utf-8")
+
+    assert stream(output, chunk_size) == message
+
+
+def test_escape_split_across_chunks_is_held_back():
+    send_message_stream = SendMessageStream()
+    prefix = 'function_call:\n  name: send_message\n  arguments:\n    message: "a'
+
+    assert send_message_stream.feed(prefix) == "a"
+    assert send_message_stream.feed("\\") == ""
+    assert send_message_stream.feed('"') == '"'
+    assert send_message_stream.feed("\\u00") == ""
+    assert send_message_stream.feed("e9") == "é"
+
+
+def test_other_functions_are_not_streamed():
+    output = """function_call:
+  name: archival_storage_insert
+  arguments:
+    message: "not for the user"
+"""
+
+    assert stream(output, 1) == ""
+    assert partial_send_message(output) is None
+
+
+def test_send_message_name_must_match_exactly():
+    output = 'function_call:\n  name: send_message_later\n  arguments:\n    message: "x"\n'
+
+    assert partial_send_message(output) is None
+
+
+def test_partial_send_message_reports_completion():
+    incomplete = 'function_call:\n  name: send_message\n  arguments:\n    message: "Hel'
+
+    assert partial_send_message(incomplete) == ("Hel", False)
+    assert partial_send_message(incomplete + 'lo"\n') == ("Hello", True)
+    assert partial_send_message("thoughts:\n  - nothing yet") is None
+
+
+ARCHIVAL_INSERT_BLOCK = """```yaml
+function_call:
+  name: archival_storage_insert
+  arguments:
+    content: "notes"
+  do_heartbeat: true
+```"""
+
+
+@pytest.mark.parametrize("chunk_size", [1, 4, 1000])
+def test_send_message_in_a_think_block_is_not_streamed(chunk_size):
+    output = (
+        '<think>\nMaybe function_call:\n  name: send_message\n  arguments:\n    message: "Hi there"\n</think>\n'
+        + ARCHIVAL_INSERT_BLOCK
+    )
+
+    assert stream(output, chunk_size) == ""
+
+
+def test_only_the_last_fenced_block_is_scanned():
+    example = 'For example:\n```yaml\nfunction_call:\n  name: send_message\n  arguments:\n    message: "Example text"\n```\nMy answer:\n'
+    answer = '```yaml\nfunction_call:\n  name: send_message\n  arguments:\n    message: "Real answer"\n  do_heartbeat: false\n```'
+
+    assert partial_send_message(example + answer) == ("Real answer", True)
+    assert partial_send_message(example + ARCHIVAL_INSERT_BLOCK) is None
+
+
+def test_text_streamed_from_an_example_fence_is_not_delivered():
+    # *While the example is the last fence so far its text is streamed; the final parse must then discard it
+    example = 'For example:\n```yaml\nfunction_call:\n  name: send_message\n  arguments:\n    message: "Example text"\n```\nMy answer:\n'
+    send_message_stream = SendMessageStream()
+    for char in example + ARCHIVAL_INSERT_BLOCK:
+        send_message_stream.feed(char)
+
+    assert send_message_stream.sent == "Example text"
+    assert not send_message_stream.delivered(
+        yaml.safe_load(ARCHIVAL_INSERT_BLOCK.strip("`").removeprefix("yaml"))["function_call"]
+    )
+
+
+def test_nothing_is_streamed_inside_an_unclosed_think_block():
+    assert (
+        partial_send_message(
+            '<think>function_call:\n  name: send_message\n  arguments:\n    message: "Hi'
+        )
+        is None
+    )
+
+
+def test_delivered_requires_the_parsed_send_message_to_extend_the_streamed_text():
+    send_message_stream = SendMessageStream()
+    send_message_stream.feed(
+        'function_call:\n  name: send_message\n  arguments:\n    message: "Hello'
+    )
+    assert send_message_stream.sent == "Hello"
+
+    assert send_message_stream.delivered(
+        {"name": "send_message", "arguments": {"message": "Hello world"}}
+    )
+    assert not send_message_stream.delivered(
+        {"name": "send_message", "arguments": {"message": "Goodbye"}}
+    )
+    assert not send_message_stream.delivered(
+        {"name": "archival_storage_insert", "arguments": {"content": "Hello world"}}
+    )
+    assert not send_message_stream.delivered({"name": "send_message", "arguments": None})